@@ -0,0 +1,326 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Vectorized simulation of many pac-man games at once. All games share the same
+level and are advanced in lockstep by a single call to step(), with the state
+of every game held in NumPy arrays.
+
+The rules are the ones of pacman.PacmanWorld: agents move between cell centres
+like AgentBody.update, the player eats food like PacmanAgent.eat_food and
+collisions follow GhostAgent.eat_player and PacmanAgent.eat_ghosts. Ghosts
+behave like pacman.RandomGhost. As in the world, agents are numbered in spawn
+order and updated in that order in each tick, and agents spawned during a
+tick (a respawned player, or the ghosts that replace eaten ones) are updated
+at the end of the same tick.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import numpy as np
+import levelcache
+import pacman
+
+
+class BatchPacmanWorld(object):
+    """N pac-man games on the same level, stepped together.
+
+    Actions are indices into ACTIONS, and NO_ACTION leaves the player alone
+    (like a _think that returns no actions). If the player is respawned
+    during a tick, the new player executes the action of the game too.
+    """
+
+    ACTIONS = ['up', 'down', 'left', 'right']
+    NO_ACTION = -1
+
+    # The last entry is the (0, 0) direction of an agent that never moved
+    DIRECTIONS = np.array([(0, 1), (0, -1), (-1, 0), (1, 0), (0, 0)])
+    STOP = 4
+    REVERSE = np.array([1, 0, 3, 2, 4])
+
+    DOT_VALUE = 10
+    PELLET_VALUE = 50
+
+    def __init__(self, level_filename, n_games, n_ghosts=1, player_lives=1,
+                 seed=None):
+        self.n_games = n_games
+        self.n_ghosts = n_ghosts
+        self.player_lives = player_lives
+        self._rng = np.random.default_rng(seed)
+
+        self._load(level_filename)
+
+        n = n_games
+        g = n_ghosts
+        self.food = np.zeros((n, self.height, self.width), dtype=np.int16)
+        self.food_count = np.zeros(n, dtype=np.int32)
+        self.score = np.zeros(n, dtype=np.int64)
+        self.lives = np.zeros(n, dtype=np.int32)
+        self.ticks = np.zeros(n, dtype=np.int64)
+        self.game_over = np.zeros(n, dtype=bool)
+        self.player_win = np.zeros(n, dtype=bool)
+        # spawn numbers, which are the uids of the agents in PacmanWorld
+        self.next_uid = np.zeros(n, dtype=np.int64)
+        self.puid = np.zeros(n, dtype=np.int64)
+        self.guid = np.zeros((n, g), dtype=np.int64)
+
+        # player body: cell, target cell, ticks moved and ticks to move
+        self.px = np.zeros(n, dtype=np.int64)
+        self.py = np.zeros(n, dtype=np.int64)
+        self.ptx = np.zeros(n, dtype=np.int64)
+        self.pty = np.zeros(n, dtype=np.int64)
+        self.pdir = np.zeros(n, dtype=np.int64)
+        self.pmoving = np.zeros(n, dtype=bool)
+        self.pprogress = np.zeros(n, dtype=np.int64)
+        self.pmove_ticks = np.zeros(n, dtype=np.int64)
+
+        # ghost bodies
+        self.gx = np.zeros((n, g), dtype=np.int64)
+        self.gy = np.zeros((n, g), dtype=np.int64)
+        self.gtx = np.zeros((n, g), dtype=np.int64)
+        self.gty = np.zeros((n, g), dtype=np.int64)
+        self.gdir = np.zeros((n, g), dtype=np.int64)
+        self.gmoving = np.zeros((n, g), dtype=bool)
+        self.gprogress = np.zeros((n, g), dtype=np.int64)
+        self.gmove_ticks = np.zeros((n, g), dtype=np.int64)
+        self.scared = np.zeros((n, g), dtype=bool)
+        self.scared_timer = np.zeros((n, g), dtype=np.int64)
+
+        self.reset()
+
+    def _load(self, filename):
+        level = levelcache.load_level(filename)
+        self.height = level.height
+        self.width = level.width
+        self.walls = np.array(level.walls)
+        self.valid = np.array(level.valid)
+        self._initial_food = np.zeros((self.height, self.width),
+                                      dtype=np.int16)
+        self._initial_food[level.food == levelcache.DOT] = \
+            BatchPacmanWorld.DOT_VALUE
+        self._initial_food[level.food == levelcache.PELLET] = \
+            BatchPacmanWorld.PELLET_VALUE
+        self._player_start = tuple(level.player_start.tolist())
+        self._ghost_start = np.array(level.ghost_starts)
+
+    def reset(self, games=None):
+        """Reset the given games (a boolean mask or array of indices) to their
+        initial state. All games are reset by default."""
+        if games is None:
+            games = np.arange(self.n_games)
+        games = np.arange(self.n_games)[games]
+
+        self.food[games] = self._initial_food
+        self.food_count[games] = np.count_nonzero(self._initial_food)
+        self.lives[games] = self.player_lives
+        self.ticks[games] = 0
+        self.game_over[games] = False
+        self.player_win[games] = False
+        self.next_uid[games] = 0
+        self._spawn_player(games)
+        for j in range(self.n_ghosts):
+            self._spawn_ghost(games, j)
+
+    def _spawn_player(self, games):
+        self.puid[games] = self.next_uid[games]
+        self.next_uid[games] += 1
+        self.score[games] = 0
+        self.px[games] = self._player_start[0]
+        self.py[games] = self._player_start[1]
+        self.pdir[games] = BatchPacmanWorld.STOP
+        self.pmoving[games] = False
+        self.pprogress[games] = 0
+
+    def _spawn_ghost(self, games, j):
+        # j is the ghost of each game, a number or an array like games
+        uids = self.next_uid[games]
+        self.next_uid[games] += 1
+        self.guid[games, j] = uids
+        location = self._choose_ghost_starts(games, uids)
+        self.gx[games, j] = self._ghost_start[location, 0]
+        self.gy[games, j] = self._ghost_start[location, 1]
+        self.gdir[games, j] = BatchPacmanWorld.STOP
+        self.gmoving[games, j] = False
+        self.gprogress[games, j] = 0
+        self.scared[games, j] = False
+        self.scared_timer[games, j] = 0
+
+    def _choose_ghost_starts(self, games, uids):
+        # Index into the ghost starts of the level for each new ghost, like
+        # PacmanWorld._choose_ghost_start
+        return self._rng.integers(len(self._ghost_start), size=len(games))
+
+    def _choose_ghost_actions(self, games, uids, valid):
+        # Index of the action of each deciding ghost, chosen uniformly from
+        # the True entries of the rows of valid, like RandomGhost
+        return np.argmax(self._rng.random(valid.shape) * valid, axis=-1)
+
+    @property
+    def player_cells(self):
+        """(N, 2) array with the cell of the player in each game."""
+        return np.stack((self.px, self.py), axis=-1)
+
+    @property
+    def ghost_cells(self):
+        """(N, G, 2) array with the cell of each ghost in each game."""
+        return np.stack((self.gx, self.gy), axis=-1)
+
+    def _set_direction(self, index, action, x, y, tx, ty, direction, moving,
+                       progress, move_ticks, ticks):
+        # AgentBody.direction setter, for the agents at index
+        direction[index] = action
+        tx[index] = x[index] + BatchPacmanWorld.DIRECTIONS[action, 0]
+        ty[index] = y[index] + BatchPacmanWorld.DIRECTIONS[action, 1]
+        moving[index] = True
+        progress[index] = 0
+        move_ticks[index] = ticks
+
+    def _move(self, mask, x, y, tx, ty, moving, progress, move_ticks):
+        # AgentBody.update followed by the toroidal wrap of the world
+        m = mask & moving
+        progress[m] += 1
+        arrived = m & (progress >= move_ticks)
+        x[arrived] = tx[arrived] % self.width
+        y[arrived] = ty[arrived] % self.height
+        moving[arrived] = False
+        progress[arrived] = 0
+
+    def _eat_ghosts(self, games):
+        # PacmanAgent.eat_ghosts: ghosts are eaten, and replaced, in spawn
+        # order
+        eaten = (self.scared[games] &
+                 (self.gx[games] == self.px[games, None]) &
+                 (self.gy[games] == self.py[games, None]))
+        if not eaten.any():
+            return
+        order = np.argsort(np.where(eaten, self.guid[games],
+                                    np.iinfo(np.int64).max), axis=-1)
+        rows = np.arange(len(games))
+        for i in range(self.n_ghosts):
+            j = order[:, i]
+            e = eaten[rows, j]
+            if not e.any():
+                break
+            self._spawn_ghost(games[e], j[e])
+
+    def _update_player(self, games, actions, rewards):
+        # PacmanAgent.update: eat ghosts, act, eat food and eat ghosts again
+        self._eat_ghosts(games)
+
+        x = self.px[games]
+        y = self.py[games]
+        has_action = actions != BatchPacmanWorld.NO_ACTION
+        action = np.where(has_action, actions, 0)
+        decide = ~self.pmoving[games] & has_action & self.valid[y, x, action]
+        self._set_direction(games[decide], action[decide], self.px, self.py,
+                            self.ptx, self.pty, self.pdir, self.pmoving,
+                            self.pprogress, self.pmove_ticks,
+                            pacman.AgentBody.TICKS_PER_CELL)
+
+        value = self.food[games, y, x]
+        ate = value > 0
+        eating = games[ate]
+        value = value[ate]
+        rewards[eating] += value
+        self.score[eating] += value
+        self.food[eating, y[ate], x[ate]] = 0
+        self.food_count[eating] -= 1
+        pellet = eating[value == BatchPacmanWorld.PELLET_VALUE]
+        self.scared[pellet] = True
+        self.scared_timer[pellet] = pacman.GhostAgent.GHOST_SCARE_TIMEOUT
+
+        self._eat_ghosts(games)
+
+    def _update_ghost(self, games, j):
+        # RandomGhost.update: act, then count down the scare timer or eat
+        # the player
+        x = self.gx[games, j]
+        y = self.gy[games, j]
+        direction = self.gdir[games, j]
+        valid = self.valid[y, x]
+        filter_reverse = ((direction != BatchPacmanWorld.STOP) &
+                          (valid.sum(axis=-1) > 1))
+        reverse = BatchPacmanWorld.REVERSE[direction]
+        valid = valid & ~((np.arange(4) == reverse[:, None]) &
+                          filter_reverse[:, None])
+        decide = ~self.gmoving[games, j] & valid.any(axis=-1)
+        if decide.any():
+            deciding = games[decide]
+            choice = self._choose_ghost_actions(
+                deciding, self.guid[deciding, j], valid[decide])
+            ticks = np.where(self.scared[deciding, j],
+                             pacman.GhostBody.SCARED_TICKS_PER_CELL,
+                             pacman.AgentBody.TICKS_PER_CELL)
+            self._set_direction((deciding, j), choice, self.gx, self.gy,
+                                self.gtx, self.gty, self.gdir, self.gmoving,
+                                self.gprogress, self.gmove_ticks, ticks)
+
+        scared = self.scared[games, j]
+        counting = games[scared]
+        self.scared_timer[counting, j] -= 1
+        self.scared[counting[self.scared_timer[counting, j] <= 0], j] = False
+
+        hunting = games[~scared]
+        caught = hunting[(self.lives[hunting] > 0) &
+                         (self.gx[hunting, j] == self.px[hunting]) &
+                         (self.gy[hunting, j] == self.py[hunting])]
+        self.lives[caught] -= 1
+        self._spawn_player(caught[self.lives[caught] > 0])
+
+    def step(self, actions):
+        """Advance all games that are not over by one tick.
+
+        :param actions: Array with one action index per game.
+        :return: A tuple (rewards, game_over), with the points scored in this
+            tick and whether each game is over.
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        active = ~self.game_over
+        rewards = np.zeros(self.n_games, dtype=np.int64)
+        n_ghosts = self.n_ghosts
+
+        # Update the agents in spawn order, one per game at a time, until
+        # every game has updated all its agents, including those spawned
+        # during the tick.
+        last = np.full(self.n_games, -1, dtype=np.int64)
+        pending = active.copy()
+        while True:
+            uids = np.concatenate((self.guid, self.puid[:, None]), axis=1)
+            uids = np.where(uids > last[:, None], uids,
+                            np.iinfo(np.int64).max)
+            agent = np.argmin(uids, axis=1)
+            pending &= uids[np.arange(self.n_games), agent] < \
+                np.iinfo(np.int64).max
+            if not pending.any():
+                break
+            last[pending] = uids[pending, agent[pending]]
+
+            games = np.flatnonzero(pending & (agent == n_ghosts) &
+                                   (self.lives > 0))
+            if len(games):
+                self._update_player(games, actions[games], rewards)
+            for j in range(n_ghosts):
+                games = np.flatnonzero(pending & (agent == j))
+                if len(games):
+                    self._update_ghost(games, j)
+
+        # Move all bodies
+        alive = active & (self.lives > 0)
+        self._move(alive, self.px, self.py, self.ptx, self.pty, self.pmoving,
+                   self.pprogress, self.pmove_ticks)
+        self._move(active[:, None], self.gx, self.gy, self.gtx, self.gty,
+                   self.gmoving, self.gprogress, self.gmove_ticks)
+
+        self.ticks[active] += 1
+        win = active & (self.food_count == 0)
+        self.player_win[win] = True
+        self.game_over[win | (active & (self.lives == 0))] = True
+
+        return rewards, self.game_over.copy()
@@ -0,0 +1,324 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Benchmarks of world construction and stepping, graph searches, the neural
+network of ex04_nn and the genetic algorithms of ex05_ga, run from the command
+line::
+
+    python benchmark.py -o before.json
+    python benchmark.py search nn --quick -o after.json --compare before.json
+
+Each benchmark measures a rate (operations per second, higher is better), as
+the best of several repeats. Results are written as JSON, with one entry per
+benchmark keyed by a name that includes its parameters, so that runs can be
+compared with --compare. Progress and comparisons are printed to stderr.
+
+Searches run on levels/pacman.txt and on large mazes made by generate_maze.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+# Benchmarks never open a window
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import platform
+import random
+import sys
+import time
+import numpy as np
+import graph
+import levelcache
+import pacman
+import search
+import ex04_nn
+import ex05_ga
+
+
+GROUPS = ['construction', 'ticks', 'search', 'nn', 'ga']
+
+LEVELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels')
+
+
+def level_path(name):
+    return os.path.join(LEVELS, name)
+
+
+def generate_maze(width, height, seed=0, loops=0.1):
+    """A random maze level, as the rows of characters of read_level. The
+    maze is carved by a randomized depth-first search, so it is a tree, and
+    then a fraction loops of the remaining inner walls that separate two
+    corridors are removed, to make cycles as in pac-man levels. Every open
+    cell has a dot, the player starts at (1, 1) and a ghost starts at the
+    opposite corner.
+
+    :param width: Width, made odd if needed, and likewise for height.
+    """
+    width += 1 - width % 2
+    height += 1 - height % 2
+    rng = random.Random(seed)
+    grid = [['X'] * width for _ in range(height)]
+
+    grid[1][1] = '.'
+    stack = [(1, 1)]
+    while stack:
+        x, y = stack[-1]
+        neighbours = [(x + dx, y + dy, dx, dy)
+                      for dx, dy in ((0, 2), (0, -2), (2, 0), (-2, 0))
+                      if 0 < x + dx < width - 1 and 0 < y + dy < height - 1 and
+                      grid[y + dy][x + dx] == 'X']
+        if neighbours:
+            nx, ny, dx, dy = rng.choice(neighbours)
+            grid[y + dy // 2][x + dx // 2] = '.'
+            grid[ny][nx] = '.'
+            stack.append((nx, ny))
+        else:
+            stack.pop()
+
+    for y in range(1, height - 1):
+        for x in range(1, width - 1):
+            if grid[y][x] == 'X' and rng.random() < loops:
+                if (grid[y][x - 1] != 'X' and grid[y][x + 1] != 'X') or \
+                        (grid[y - 1][x] != 'X' and grid[y + 1][x] != 'X'):
+                    grid[y][x] = '.'
+
+    grid[1][1] = 'P'
+    grid[height - 2][width - 2] = 'G'
+    return grid
+
+
+def best_time(function, repeat):
+    """Shortest wall time of repeat calls of function."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+class Benchmarks(object):
+    """Runs the benchmarks and collects their results.
+
+    :param quick: Use fewer and smaller workloads, for a fast check.
+    :param repeat: Number of repeats of each measurement.
+    """
+
+    def __init__(self, quick=False, repeat=3, log=sys.stderr):
+        self.quick = quick
+        self.repeat = repeat
+        self.results = []
+        self._log = log
+
+    def add(self, name, rate, unit, **params):
+        self.results.append({'name': name, 'rate': rate, 'unit': unit,
+                             'params': params})
+        if self._log is not None:
+            print('{:<56} {:>14.1f} {}'.format(name, rate, unit),
+                  file=self._log)
+
+    def measure(self, name, function, operations, unit, **params):
+        """Add the rate of a function that does the given number of
+        operations in each call."""
+        seconds = best_time(function, self.repeat)
+        self.add(name, operations / seconds, unit, **params)
+
+    def run(self, groups=GROUPS):
+        for group in groups:
+            getattr(self, 'bench_' + group)()
+        return self.results
+
+    def bench_construction(self):
+        # Levels are compiled and cached on first use, so this measures
+        # the construction from the cache.
+        for filename in sorted(glob.glob(level_path('*.txt'))):
+            level = os.path.basename(filename)
+            pacman.PacmanWorld(20, filename, headless=True)
+            self.measure('construction[{}]'.format(level),
+                         lambda: pacman.PacmanWorld(20, filename,
+                                                    headless=True),
+                         1, 'worlds/s', level=level)
+
+    def bench_ticks(self):
+        ticks = 500 if self.quick else 2000
+        ghost_counts = [4, 16] if self.quick else [4, 16, 64]
+        for n_ghosts in ghost_counts:
+            for scheduled in (False, True):
+                name = 'ticks[pacman.txt,ghosts={},{}]'.format(
+                    n_ghosts, 'scheduled' if scheduled else 'every_tick')
+                self.measure(name, lambda: self._play(n_ghosts, scheduled,
+                                                      ticks),
+                             ticks, 'ticks/s', level='pacman.txt',
+                             ghosts=n_ghosts, scheduled=scheduled)
+
+    def _play(self, n_ghosts, scheduled, ticks):
+        # A player that never moves, so the game only ends with its lives
+        random.seed(0)
+        world = pacman.PacmanWorld(20, level_path('pacman.txt'),
+                                   headless=True, scheduled=scheduled)
+        world.spawn_player(pacman.PacmanAgent)
+        world.player_lives = ticks + 1
+        for _ in range(n_ghosts):
+            world.spawn_ghost(pacman.RandomGhost)
+        world.run(ticks)
+
+    def bench_search(self):
+        queries = 20 if self.quick else 100
+        world = pacman.PacmanWorld(20, level_path('pacman.txt'),
+                                   headless=True)
+        mazes = [('pacman.txt', world.compact_graph, queries)]
+        sizes = [(101, 101)] if self.quick else [(101, 101), (301, 301)]
+        for width, height in sizes:
+            level = levelcache.CompiledLevel.from_grid(
+                generate_maze(width, height))
+            # fewer queries on larger mazes, which take longer each
+            mazes.append(('maze{}x{}'.format(width, height),
+                          graph.CompactGraph.from_grid(
+                              level.walls, level.valid, levelcache.ACTIONS),
+                          max(5, queries * 10000 // (width * height))))
+
+        algorithms = [('breadth_first', search.breadth_first, False),
+                      ('uniform_cost', search.uniform_cost, False),
+                      ('astar', search.astar, True)]
+        for maze, compact, n_queries in mazes:
+            cells = [tuple(c) for c in compact.cells.tolist()]
+            rng = random.Random(0)
+            pairs = [(rng.choice(cells), rng.choice(cells))
+                     for _ in range(n_queries)]
+            heuristic = search.torus_manhattan(compact.width, compact.height)
+
+            # the same maze as a dictionary based graph.Graph
+            dict_graph = graph.Graph()
+            for cell in cells:
+                dict_graph.add_node(cell, compact.get_connections(cell))
+
+            for kind, g in (('compact', compact), ('dict', dict_graph)):
+                for algorithm, function, informed in algorithms:
+                    kwargs = {'heuristic': heuristic} if informed else {}
+                    self.measure(
+                        'search[{},{},{}]'.format(maze, kind, algorithm),
+                        lambda: [function(g, start, goal, **kwargs)
+                                 for start, goal in pairs],
+                        n_queries, 'queries/s', maze=maze, graph=kind,
+                        algorithm=algorithm, queries=n_queries)
+
+    def bench_nn(self):
+        rng = np.random.RandomState(0)
+        random.seed(0)
+        nn = ex04_nn.NNFeedForward(14, 14, 2)
+        inputs = rng.randint(0, 2, size=(4096, 14)).astype(float)
+        single = inputs[0].tolist()
+
+        calls = 200 if self.quick else 1000
+        self.measure('nn.feed_forward[single]',
+                     lambda: [nn.feed_forward(single) for _ in range(calls)],
+                     calls, 'calls/s', inputs=14, hidden=14, outputs=2)
+        self.measure('nn.feed_forward[batch=4096]',
+                     lambda: nn.feed_forward(inputs), len(inputs), 'rows/s',
+                     inputs=14, hidden=14, outputs=2, rows=len(inputs))
+
+        targets = rng.randint(0, 2, size=(len(inputs), 2)).astype(float)
+        data = np.hstack([inputs, targets])
+        self.measure('nn.train[batch_size=32]',
+                     lambda: nn.train(data, 0.2, epochs=1, seed=0),
+                     len(data), 'rows/s', rows=len(data), batch_size=32)
+
+    def bench_ga(self):
+        random.seed(0)
+        generations = 20 if self.quick else 100
+        ga = ex05_ga.GA(100)
+        self.measure('ga.run[xor,population=100]',
+                     lambda: _quiet(ga.run, generations), generations,
+                     'generations/s', population=100)
+
+        generations = 1 if self.quick else 3
+        self.measure('ga.run[pacman,population=8]',
+                     lambda: _quiet(ex05_ga.PacmanGA(
+                         8, level_path('medium.txt'), episodes=1,
+                         max_ticks=500, processes=1).run, generations),
+                     generations, 'generations/s', population=8,
+                     level='medium.txt', episodes=1, max_ticks=500)
+
+
+def _quiet(function, *args):
+    # the GAs print every generation
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+def metadata(quick, repeat):
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'quick': quick,
+            'repeat': repeat}
+
+
+def compare(results, previous):
+    """Lines with the ratio of each rate to the rate of the same benchmark
+    in a previous run."""
+    old = dict((r['name'], r['rate']) for r in previous['results'])
+    lines = []
+    for r in results:
+        if r['name'] in old and old[r['name']]:
+            lines.append('{:<56} {:>8.2f}x'.format(r['name'],
+                                                   r['rate'] / old[r['name']]))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pac-man code and write JSON results.")
+    parser.add_argument('groups', nargs='*', metavar='group',
+                        help="Benchmarks to run: {} (default: all).".format(
+                            ', '.join(GROUPS)))
+    parser.add_argument('--quick', action='store_true',
+                        help="Smaller workloads, for a fast check.")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Repeats of each measurement (default: 3).")
+    parser.add_argument('-o', '--output',
+                        help="Write the results to this file instead of "
+                             "stdout.")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="Results of a previous run to compare with.")
+    args = parser.parse_args(argv)
+    for group in args.groups:
+        if group not in GROUPS:
+            parser.error("unknown benchmark group: " + group)
+
+    benchmarks = Benchmarks(args.quick, args.repeat)
+    results = benchmarks.run(args.groups or GROUPS)
+    output = {'meta': metadata(args.quick, args.repeat), 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=1)
+    else:
+        json.dump(output, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print('\n'.join(compare(results, previous)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
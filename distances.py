@@ -0,0 +1,144 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Precomputed all-pairs shortest path distances over a static graph.Graph, such
+as the maze graph generated by pacman.PacmanWorld. After the table is built,
+the distance between any two nodes and the first action to take to go from one
+to the other are O(1) lookups.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+from collections import deque
+import numpy as np
+
+
+class DistanceTable(object):
+    """All-pairs distance and next-hop table, built with a breadth-first
+    search from every node. Edge weights are ignored (every connection counts
+    as one step), which is the case for the pac-man maze graph. Wrap-around
+    connections of toroidal worlds are followed like any other.
+
+    Nodes are given integer ids, in sorted order, and the tables are NumPy
+    arrays indexed by [from_id, to_id]:
+
+    - distances holds the number of steps, or UNREACHABLE;
+    - first_actions holds the index, in actions, of the first action to take,
+      or NO_ACTION.
+    """
+
+    UNREACHABLE = -1
+    NO_ACTION = -1
+    # distances are stored in the first type that holds the longest one
+    DISTANCE_DTYPES = (np.int16, np.int32)
+
+    def __init__(self, graph, tables=None):
+        """
+        :param graph: The graph.
+        :param tables: Optional (distances, first_actions) arrays previously
+            computed for the same graph, e.g. loaded from a level cache.
+        """
+        self._nodes = sorted(graph.get_nodes())
+        self._ids = dict((node, i) for i, node in enumerate(self._nodes))
+        self.actions = []
+        action_ids = {}
+
+        # adjacency lists of (node id, action index)
+        adjacency = []
+        for node in self._nodes:
+            adjacency.append([])
+            for conn in graph.get_connections(node):
+                if conn[2] not in action_ids:
+                    action_ids[conn[2]] = len(self.actions)
+                    self.actions.append(conn[2])
+                adjacency[-1].append((self._ids[conn[0]], action_ids[conn[2]]))
+        self._adjacency = adjacency
+
+        if tables is not None:
+            self.distances, self.first_actions = tables
+            return
+
+        n = len(self._nodes)
+        # a shortest path has at most n - 1 steps
+        dtype = [t for t in self.DISTANCE_DTYPES
+                 if np.iinfo(t).max >= n - 1][0]
+        self.distances = np.empty((n, n), dtype=dtype)
+        self.first_actions = np.empty((n, n), dtype=np.int8)
+        for source in range(n):
+            self.distances[source], self.first_actions[source] = \
+                self._bfs(source)
+
+    def _bfs(self, source):
+        distance = [DistanceTable.UNREACHABLE] * len(self._nodes)
+        first = [DistanceTable.NO_ACTION] * len(self._nodes)
+        distance[source] = 0
+
+        queue = deque()
+        for node, action in self._adjacency[source]:
+            if distance[node] == DistanceTable.UNREACHABLE:
+                distance[node] = 1
+                first[node] = action
+                queue.append(node)
+
+        while queue:
+            current = queue.popleft()
+            d = distance[current] + 1
+            f = first[current]
+            for node, _ in self._adjacency[current]:
+                if distance[node] == DistanceTable.UNREACHABLE:
+                    distance[node] = d
+                    first[node] = f
+                    queue.append(node)
+
+        return distance, first
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def node_id(self, node):
+        return self._ids[node]
+
+    def node(self, node_id):
+        return self._nodes[node_id]
+
+    def distance(self, start, goal):
+        """Number of steps from start to goal, or None if unreachable."""
+        d = self.distances[self._ids[start], self._ids[goal]]
+        if d == DistanceTable.UNREACHABLE:
+            return None
+        return int(d)
+
+    def first_action(self, start, goal):
+        """Name of the first action on a shortest path from start to goal, or
+        None if start == goal or goal is unreachable."""
+        a = self.first_actions[self._ids[start], self._ids[goal]]
+        if a == DistanceTable.NO_ACTION:
+            return None
+        return self.actions[a]
+
+    def path(self, start, goal):
+        """A shortest path from start to goal as a list of action names, or
+        None if goal is unreachable."""
+        if self.distance(start, goal) is None:
+            return None
+
+        path = []
+        current = self._ids[start]
+        goal = self._ids[goal]
+        while current != goal:
+            action = self.first_actions[current, goal]
+            path.append(self.actions[action])
+            for node, a in self._adjacency[current]:
+                if a == action:
+                    current = node
+                    break
+
+        return path
@@ -0,0 +1,200 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+A Gym-style environment for learning to play pac-man, with reset(seed) and
+step(action). The game runs in a headless PacmanWorld, and observations are
+a NumPy array of shape (channels, height, width) with one channel for each of
+walls, dots, pellets, ghosts, scared ghosts and the player. The same array is
+returned by every call, and only the cells that changed are updated, so copy
+it if it must be kept.
+
+Each step() lasts until the player reaches the centre of a cell and can act
+again, since actions given while it moves between cells have no effect.
+
+Typical use::
+
+    env = environment.PacmanEnv('levels/pacman.txt')
+    obs = env.reset(seed=0)
+    done = False
+    while not done:
+        obs, reward, done, info = env.step(policy(obs))
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+# The environment never opens a window
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import numpy as np
+import levelcache
+import pacman
+
+
+WALLS, DOTS, PELLETS, GHOSTS, SCARED_GHOSTS, PLAYER = range(6)
+N_CHANNELS = 6
+
+ACTIONS = [a.name for a in pacman.PacmanWorld.GAME_ACTIONS]
+
+
+class EnvPacman(pacman.PacmanAgent):
+    """The player controlled by PacmanEnv.step."""
+
+    ACTS_AT_CELL_CENTRES = True
+
+    def __init__(self, x, y, cell):
+        super(EnvPacman, self).__init__(x, y, cell)
+        self.next_action = None
+
+    def _think(self, delta):
+        if self.body.target is None and self.next_action is not None:
+            action = self._actions[self.next_action]
+            self.next_action = None
+            return [action]
+
+
+class PacmanEnv(object):
+    """Pac-man as a reinforcement learning environment. Actions are indices
+    into ACTIONS, and the reward of a step is the number of points scored in
+    it.
+    """
+
+    def __init__(self, level_filename='levels/pacman.txt',
+                 ghost_classes=(pacman.RandomGhost,) * 4, player_lives=1,
+                 max_ticks=None, dtype=np.float32):
+        """
+        :param max_ticks: Episodes end after this many ticks, with
+            info['truncated'] set.
+        """
+        self.world = pacman.PacmanWorld(20, level_filename, headless=True,
+                                        scheduled=True)
+        self.ghost_classes = list(ghost_classes)
+        self.player_lives = player_lives
+        self.max_ticks = max_ticks
+        self.n_actions = len(ACTIONS)
+
+        level = self.world._level
+        self.observation = np.zeros((N_CHANNELS, level.height, level.width),
+                                    dtype=dtype)
+        self.observation[WALLS] = level.walls
+        self._dots = level.food == levelcache.DOT
+        self._pellets = level.food == levelcache.PELLET
+        # cells set in the agent channels, to be cleared on the next update
+        self._marked = []
+        self._score = 0
+        self._player = None
+        self.done = True
+
+    def reset(self, seed=None):
+        """Start a new episode.
+
+        :param seed: Seed for the random module, which drives the ghosts.
+        :return: The observation.
+        """
+        if seed is not None:
+            random.seed(seed)
+
+        world = self.world
+        world.reset()
+        world.spawn_player(EnvPacman)
+        for ghost_class in self.ghost_classes:
+            world.spawn_ghost(ghost_class)
+        world.player_lives = self.player_lives
+        self._player = world.player
+        self._score = 0
+        self.done = False
+
+        obs = self.observation
+        np.copyto(obs[DOTS], self._dots)
+        np.copyto(obs[PELLETS], self._pellets)
+        self._update_agents()
+        return obs
+
+    def step(self, action):
+        """Execute an action and play until the player can act again.
+
+        :param action: Index into ACTIONS.
+        :return: (observation, reward, done, info)
+        """
+        world = self.world
+        if self.done:
+            return self.observation, 0, True, self._info(False)
+
+        world.player.next_action = ACTIONS[action]
+        food = world.food_grid
+        obs = self.observation
+        width = world.grid_width
+        height = world.grid_height
+        while True:
+            before = world.player.body.cell
+            world.step()
+
+            # food is eaten where the player was, or where it respawned
+            body = world.player.body
+            cells = (before,) if body is None else (before, body.cell)
+            for x, y in cells:
+                x %= width
+                y %= height
+                if not food[y, x]:
+                    obs[DOTS, y, x] = 0
+                    obs[PELLETS, y, x] = 0
+
+            if world.game_over or body.target is None or self._truncated():
+                break
+
+        reward = self._gained()
+        self._update_agents()
+        truncated = self._truncated() and not world.game_over
+        self.done = world.game_over or truncated
+        return obs, reward, self.done, self._info(truncated)
+
+    def _truncated(self):
+        return self.max_ticks is not None and \
+            self.world.ticks >= self.max_ticks
+
+    def _gained(self):
+        # The score of the world is the score of the current player, which
+        # starts from zero when it is respawned.
+        player = self.world.player
+        if player is not self._player:
+            gained = self._player.score - self._score + player.score
+            self._player = player
+        else:
+            gained = player.score - self._score
+        self._score = player.score
+        return gained
+
+    def _update_agents(self):
+        obs = self.observation
+        for channel, y, x in self._marked:
+            obs[channel, y, x] = 0
+        marked = []
+        world = self.world
+        for agent in world._agents:
+            if agent.is_dead:
+                continue
+            x, y = agent.body.cell
+            x %= world.grid_width
+            y %= world.grid_height
+            if isinstance(agent, pacman.GhostAgent):
+                channel = SCARED_GHOSTS if agent.scared else GHOSTS
+            else:
+                channel = PLAYER
+            obs[channel, y, x] += 1
+            marked.append((channel, y, x))
+        self._marked = marked
+
+    def _info(self, truncated):
+        world = self.world
+        return {'ticks': world.ticks, 'score': world.score,
+                'lives': world.player_lives, 'win': world.player_win,
+                'truncated': truncated}
@@ -18,6 +18,7 @@ __version__ = '1.0'
 import pacman
 import pyafai
 import graph
+import search
 
 
 class GhostGraph(graph.Graph):
@@ -37,6 +38,8 @@ class GhostGraph(graph.Graph):
 
 
 class SearchGhost(pacman.GhostAgent):
+    ACTS_AT_CELL_CENTRES = True
+
     def __init__(self, x, y, cell):
         super(SearchGhost, self).__init__(x, y, cell)
 
@@ -69,6 +72,42 @@ class SearchGhost(pacman.GhostAgent):
                 return [self._actions[next_action]]
 
 
+class PursuitGhost(SearchGhost):
+    """Ghost that chases pac-man using an incremental planner. The search
+    tree is kept between decisions, so each re-plan only has to deal with the
+    moves made since the previous one."""
+
+    def __init__(self, x, y, cell):
+        super(PursuitGhost, self).__init__(x, y, cell)
+
+        self._planner = None
+
+    def _think(self, delta):
+        # If the previous action has finished
+        if self.body.target is None:
+            player = self.world.player
+            if player is None or player.is_dead:
+                return
+
+            if self._planner is None:
+                ghost_graph = self.world.graph
+                if not isinstance(ghost_graph, GhostGraph):
+                    ghost_graph = GhostGraph(ghost_graph)
+                h = search.world_heuristic(self.world)
+                self._planner = search.FringeRetrievingAStar(
+                    ghost_graph, heuristic=h,
+                    goal_key=lambda node: node[:2], with_actions=True)
+
+            start = self.body.cell + (self.last_action,)
+            result = self._planner.plan(start, player.body.cell)
+            self._path = result.path
+
+            # If we have a non empty path
+            if self._path:
+                next_action = self._path.pop(0)
+                return [self._actions[next_action]]
+
+
 def setup():
     world = pacman.PacmanWorld(20, 'levels/pacman.txt')
     display = pacman.PacmanDisplay(world)
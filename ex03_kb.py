@@ -16,15 +16,26 @@ __author__ = 'Tiago Baptista, Alexandre Pinto'
 __version__ = '1.0'
 
 
+from io import open
+import hashlib
+import json
+import os
+import tempfile
 import pacman
 import pyafai
 
 
+KB_CACHE_VERSION = 2
+
+
 class Literal(object):
     def __init__(self, lit_string =""):
         self._lit_string = lit_string.strip()
         self.neg = self._lit_string.startswith('not ')
-        self.atom = lit_string.lstrip('not ')
+        if self.neg:
+            self.atom = self._lit_string[4:].strip()
+        else:
+            self.atom = self._lit_string
 
     def is_neg(self):
         return self.neg
@@ -39,21 +50,98 @@ class Literal(object):
         return "Literal(" + self._lit_string + ")"
 
 
+def parse_rule(line):
+    """Split a rule (or fact) into its head and its body literals, without
+    splitting at commas inside terms such as f(a, b).
+
+    :return: A tuple (head, body), where body is a list of (negated, atom).
+    """
+    line = line.strip()
+    if line.endswith('.'):
+        line = line[:-1]
+
+    i = line.find(':-')
+    if i < 0:
+        return line.strip(), []
+
+    head = line[:i].strip()
+    body = line[i + 2:]
+    if '(' in body:
+        parts = []
+        depth = 0
+        start = 0
+        for j, c in enumerate(body):
+            if c == '(':
+                depth += 1
+            elif c == ')':
+                depth -= 1
+            elif c == ',' and depth == 0:
+                parts.append(body[start:j])
+                start = j + 1
+        parts.append(body[start:])
+    else:
+        parts = body.split(',')
+
+    literals = []
+    for part in parts:
+        part = part.strip()
+        if part.startswith('not '):
+            literals.append((True, part[4:].strip()))
+        else:
+            literals.append((False, part))
+
+    return head, literals
+
+
+def parse_kb(lines):
+    """Parse the lines of a KB file into interned atom ids. Blank lines are
+    skipped.
+
+    :return: A tuple (atoms, heads, bodies, facts): the list of atoms, indexed
+        by id; the head atom id and the body, as a list of (negated, atom id),
+        of each rule; and the atom ids of the facts.
+    """
+    ids = {}
+    atoms = []
+    heads = []
+    bodies = []
+    facts = []
+
+    def intern(atom):
+        atom_id = ids.get(atom)
+        if atom_id is None:
+            atom_id = len(atoms)
+            ids[atom] = atom_id
+            atoms.append(atom)
+        return atom_id
+
+    for line in lines:
+        if line.isspace() or not line:
+            continue
+        head, body = parse_rule(line)
+        if body:
+            heads.append(intern(head))
+            bodies.append([(neg, intern(atom)) for neg, atom in body])
+        else:
+            facts.append(intern(head))
+
+    return atoms, heads, bodies, facts
+
+
 class Rule(object):
     def __init__(self, line):
-        rule_components = line.split(":-")
-        self.head = rule_components[0]
-        self.head = self.head.strip(" .\n")
-        self.body = ""
-        if len(rule_components) > 1:
-            self.body = rule_components[1]
-            self.body = self.body.split(",")
-            for i in range(len(self.body)):
-                lit = self.body.pop(0)
-                lit = lit.strip(" .\n")
-                self.body.append(Literal(lit))
-        else:
-            self.body = []
+        self.head, body = parse_rule(line)
+        self.body = [Literal('not ' + atom if neg else atom)
+                     for neg, atom in body]
+
+    @classmethod
+    def from_parts(cls, head, body):
+        """Build a rule from a head atom and a list of (negated, atom)."""
+        rule = cls.__new__(cls)
+        rule.head = head
+        rule.body = [Literal('not ' + atom if neg else atom)
+                     for neg, atom in body]
+        return rule
 
     def is_fact(self):
         return len(self.body) == 0
@@ -78,34 +166,543 @@ class Rule(object):
         return "Rule(" + str(self) + ")"
 
 
+class RuleEngine(object):
+    """Forward chaining over a list of rules, compiled once and reused for
+    every inference.
+
+    Atoms are interned as integer ids. Each rule keeps a counter of the
+    positive body literals not yet known to be true, and an index from each
+    atom to the rules with that atom in their positive body. When an atom
+    becomes true only the rules in its index are updated, and a rule fires
+    when its counter reaches zero.
+
+    Negation is negation as failure. Rules are split in strata, so that the
+    atoms in negative literals are fully derived, in lower strata, before
+    the rules that use them fire.
+    """
+
+    def __init__(self, atoms, heads, bodies):
+        """
+        :param atoms: List of atoms, indexed by id.
+        :param heads: Head atom id of each rule.
+        :param bodies: Body of each rule, as a list of (negated, atom id).
+        """
+        self._atoms = list(atoms)
+        self._ids = dict((atom, i) for i, atom in enumerate(self._atoms))
+        self._heads = list(heads)
+        self._pos = []
+        self._neg = []
+        for body in bodies:
+            self._pos.append(sorted(set(a for neg, a in body if not neg)))
+            self._neg.append(sorted(set(a for neg, a in body if neg)))
+
+        self._watch = [[] for _ in self._atoms]
+        self._watch_neg = [[] for _ in self._atoms]
+        for r in range(len(self._heads)):
+            for atom in self._pos[r]:
+                self._watch[atom].append(r)
+            for atom in self._neg[r]:
+                self._watch_neg[atom].append(r)
+        self._counts = [len(pos) for pos in self._pos]
+
+        self._strata = self._stratify()
+        self._n_strata = max(self._strata) + 1 if self._strata else 0
+        # rules with no positive literals are ready from the start
+        self._ready = [[] for _ in range(self._n_strata)]
+        for r, count in enumerate(self._counts):
+            if count == 0:
+                self._ready[self._strata[r]].append(r)
+
+    @classmethod
+    def from_rules(cls, rules):
+        """Compile a list of Rule objects."""
+        ids = {}
+        atoms = []
+        heads = []
+        bodies = []
+
+        def intern(atom):
+            atom_id = ids.get(atom)
+            if atom_id is None:
+                atom_id = len(atoms)
+                ids[atom] = atom_id
+                atoms.append(atom)
+            return atom_id
+
+        for rule in rules:
+            heads.append(intern(rule.head))
+            bodies.append([(lit.is_neg(), intern(lit.get_atom()))
+                           for lit in rule.body])
+
+        return cls(atoms, heads, bodies)
+
+    def _stratify(self):
+        # Atoms depend on the atoms in the bodies of their rules, through a
+        # negation or not. The strongly connected components of that graph
+        # (Tarjan's algorithm, without recursion) come out dependencies
+        # first. Each one is placed above the components it negates and not
+        # below those it uses, and must not depend on itself via a negation.
+        n = len(self._atoms)
+        deps = [[] for _ in range(n)]
+        for r, head in enumerate(self._heads):
+            deps[head].extend((a, 0) for a in self._pos[r])
+            deps[head].extend((a, 1) for a in self._neg[r])
+
+        stratum = [0] * n
+        index = [-1] * n
+        low = [0] * n
+        on_stack = [False] * n
+        stack = []
+        counter = 0
+        for root in range(n):
+            if index[root] >= 0:
+                continue
+            work = [(root, 0)]
+            while work:
+                atom, i = work.pop()
+                if i == 0:
+                    index[atom] = low[atom] = counter
+                    counter += 1
+                    stack.append(atom)
+                    on_stack[atom] = True
+                else:
+                    low[atom] = min(low[atom], low[deps[atom][i - 1][0]])
+                while i < len(deps[atom]):
+                    dep = deps[atom][i][0]
+                    i += 1
+                    if index[dep] < 0:
+                        work.append((atom, i))
+                        work.append((dep, 0))
+                        break
+                    elif on_stack[dep]:
+                        low[atom] = min(low[atom], index[dep])
+                else:
+                    if low[atom] == index[atom]:
+                        component = []
+                        while True:
+                            a = stack.pop()
+                            on_stack[a] = False
+                            component.append(a)
+                            if a == atom:
+                                break
+                        self._place(component, deps, stratum, on_stack)
+
+        self._atom_strata = stratum
+        return [stratum[head] for head in self._heads]
+
+    def _place(self, component, deps, stratum, marked):
+        for a in component:
+            marked[a] = True
+        s = 0
+        for a in component:
+            for dep, negated in deps[a]:
+                if marked[dep]:
+                    if negated:
+                        raise ValueError("Rules with a cycle through "
+                                         "negation: " + self._atoms[a])
+                elif stratum[dep] + negated > s:
+                    s = stratum[dep] + negated
+        for a in component:
+            marked[a] = False
+            stratum[a] = s
+
+    def atom_id(self, atom):
+        """Id of an atom, or None if it does not occur in the rules."""
+        return self._ids.get(atom)
+
+    def atom(self, atom_id):
+        return self._atoms[atom_id]
+
+    def head(self, rule):
+        return self._heads[rule]
+
+    def __len__(self):
+        return len(self._heads)
+
+    def run(self, atoms):
+        """Derive everything that follows from the rules and a set of atoms
+        (facts and perceptions) known to be true.
+
+        :param atoms: Iterable of atom strings. Atoms that do not occur in
+            the rules are ignored.
+        :return: A tuple (true, fired) with the set of ids of the true atoms,
+            and the list of indices of the rules that fired.
+        """
+        true = set()
+        counts = self._counts[:]
+        agenda = [ready[:] for ready in self._ready]
+        watch = self._watch
+        strata = self._strata
+
+        def assert_atom(atom_id):
+            true.add(atom_id)
+            for r in watch[atom_id]:
+                counts[r] -= 1
+                if counts[r] == 0:
+                    agenda[strata[r]].append(r)
+
+        ids = self._ids
+        for atom in atoms:
+            atom_id = ids.get(atom)
+            if atom_id is not None and atom_id not in true:
+                assert_atom(atom_id)
+
+        fired = []
+        heads = self._heads
+        neg = self._neg
+        for queue in agenda:
+            i = 0
+            while i < len(queue):
+                r = queue[i]
+                i += 1
+                blocked = False
+                for atom_id in neg[r]:
+                    if atom_id in true:
+                        blocked = True
+                        break
+                if not blocked:
+                    fired.append(r)
+                    if heads[r] not in true:
+                        assert_atom(heads[r])
+
+        return true, fired
+
+
+class WorkingMemory(object):
+    """The conclusions of a RuleEngine, kept from one inference to the next.
+
+    Base atoms (facts and perceptions) are asserted and retracted one by one,
+    and only the conclusions that depend on them are updated, so the cost of
+    an update depends on what changed, not on the size of the KB.
+
+    For each rule the memory counts the positive body atoms that are false
+    and the negative body atoms that are true. A rule is active when both
+    are zero, and an atom is true while it is a base atom or the head of an
+    active rule. The memory starts from a full inference by RuleEngine.run,
+    as does recompute(), and is then updated incrementally.
+
+    Retractions use delete and rederive: the atoms that may depend on a
+    removed atom are deleted, and those with another derivation are derived
+    again. Strata are updated in order, so negated atoms are settled before
+    they are used.
+    """
+
+    def __init__(self, engine, watched=(), atoms=()):
+        """
+        :param engine: The RuleEngine.
+        :param watched: Indices of rules to track in active_watched.
+        :param atoms: Initial base atoms.
+        """
+        self._engine = engine
+        self._base = [0] * len(engine._atoms)
+        for atom in atoms:
+            atom_id = engine.atom_id(atom)
+            if atom_id is not None:
+                self._base[atom_id] += 1
+        self._watched = set(watched)
+        self.recompute()
+
+    def recompute(self):
+        """Derive all conclusions from the base atoms from scratch, with
+        RuleEngine.run, instead of propagating the changes since the last
+        update."""
+        engine = self._engine
+        true, fired = engine.run(engine.atom(a)
+                                 for a, n in enumerate(self._base) if n)
+        self._true = [a in true for a in range(len(self._base))]
+        self._counts = [sum(1 for a in pos if a not in true)
+                        for pos in engine._pos]
+        self._blocks = [sum(1 for a in neg if a in true)
+                        for neg in engine._neg]
+        self._active = [False] * len(engine)
+        self._support = [0] * len(self._base)
+        for r in fired:
+            self._active[r] = True
+            self._support[engine._heads[r]] += 1
+        self.active_watched = self._watched.intersection(fired)
+
+        # rules (per stratum) whose counters changed since they were checked
+        self._dirty = [[] for _ in range(engine._n_strata)]
+        # atoms (per stratum) that stopped being base atoms
+        self._suspect = [[] for _ in self._dirty]
+
+    def is_true(self, atom):
+        atom_id = self._engine.atom_id(atom)
+        return atom_id is not None and self._true[atom_id]
+
+    def true_atoms(self):
+        """Set of ids of all true atoms."""
+        return set(a for a, value in enumerate(self._true) if value)
+
+    def assert_atom(self, atom):
+        """Add a base atom. Call update() to propagate the changes."""
+        atom_id = self._engine.atom_id(atom)
+        if atom_id is not None:
+            self._base[atom_id] += 1
+            if not self._true[atom_id]:
+                self._set(atom_id, True)
+
+    def retract_atom(self, atom):
+        """Remove a base atom previously asserted. Call update() to propagate
+        the changes."""
+        atom_id = self._engine.atom_id(atom)
+        if atom_id is not None:
+            self._base[atom_id] -= 1
+            if self._base[atom_id] == 0:
+                self._suspect[self._engine._atom_strata[atom_id]].append(
+                    atom_id)
+
+    def _set(self, atom_id, value):
+        engine = self._engine
+        strata = engine._strata
+        dirty = self._dirty
+        self._true[atom_id] = value
+        step = -1 if value else 1
+        counts = self._counts
+        for r in engine._watch[atom_id]:
+            counts[r] += step
+            dirty[strata[r]].append(r)
+        blocks = self._blocks
+        for r in engine._watch_neg[atom_id]:
+            blocks[r] -= step
+            dirty[strata[r]].append(r)
+
+    def _activate(self, r, value):
+        self._active[r] = value
+        self._support[self._engine._heads[r]] += 1 if value else -1
+        if r in self._watched:
+            if value:
+                self.active_watched.add(r)
+            else:
+                self.active_watched.discard(r)
+
+    def update(self):
+        """Propagate the asserted and retracted atoms to all conclusions."""
+        heads = self._engine._heads
+        true = self._true
+        base = self._base
+        support = self._support
+        counts = self._counts
+        blocks = self._blocks
+        active = self._active
+        for s in range(len(self._dirty)):
+            dirty = self._dirty[s]
+            if not dirty and not self._suspect[s]:
+                continue
+
+            # Delete: rules that stopped holding, and everything that may
+            # depend on them in this stratum.
+            deleted = []
+            queue = self._suspect[s]
+            i = 0
+            while True:
+                while i < len(dirty):
+                    r = dirty[i]
+                    i += 1
+                    if active[r] and (counts[r] or blocks[r]):
+                        self._activate(r, False)
+                        queue.append(heads[r])
+                if not queue:
+                    break
+                a = queue.pop()
+                if true[a] and not base[a]:
+                    self._set(a, False)
+                    deleted.append(a)
+
+            # Rederive: deleted atoms still supported, and the consequences
+            # of rules that now hold.
+            queue = [a for a in deleted if support[a] > 0]
+            i = 0
+            while True:
+                while i < len(dirty):
+                    r = dirty[i]
+                    i += 1
+                    if not active[r] and not counts[r] and not blocks[r]:
+                        self._activate(r, True)
+                        queue.append(heads[r])
+                if not queue:
+                    break
+                a = queue.pop()
+                if not true[a]:
+                    self._set(a, True)
+
+            del dirty[:]
+            self._suspect[s] = []
+
+
+def kb_cache_dir():
+    """Directory of the compiled KB caches: pacman/kb in $XDG_CACHE_HOME, or
+    in ~/.cache if that is not set."""
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pacman', 'kb')
+
+
+def kb_cache_path(filename):
+    """Path of the compiled cache for the current contents of a KB file."""
+    with open(filename, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(kb_cache_dir(), '{}.{}.v{}.json'.format(
+        name, digest, KB_CACHE_VERSION))
+
+
+def compile_kb(filename, use_cache=True):
+    """Parse and compile a KB file, or load it from its compiled cache. The
+    cache is written on the first load, in kb_cache_dir(), unless that is
+    not possible. It is plain JSON, so loading it never runs any code.
+
+    :return: A tuple (engine, bodies, facts): the RuleEngine, the body of
+        each rule as in parse_kb, and the list of fact atoms.
+    """
+    path = kb_cache_path(filename) if use_cache else None
+    if path is not None and os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf8') as f:
+                cache = json.load(f)
+            engine = RuleEngine.__new__(RuleEngine)
+            engine.__dict__.update(cache['engine'])
+            engine._ids = dict((atom, i)
+                               for i, atom in enumerate(engine._atoms))
+            bodies = [[(neg, a) for neg, a in body]
+                      for body in cache['bodies']]
+            return engine, bodies, cache['facts']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    with open(filename, 'r', encoding='utf8') as f:
+        atoms, heads, bodies, facts = parse_kb(f)
+    engine = RuleEngine(atoms, heads, bodies)
+    facts = [atoms[a] for a in facts]
+
+    if path is not None:
+        # write to a temporary file and rename it, so that concurrent
+        # readers never see a partial cache
+        state = dict((k, v) for k, v in vars(engine).items() if k != '_ids')
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path),
+                                       suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf8') as f:
+                json.dump({'engine': state, 'bodies': bodies,
+                           'facts': facts}, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    return engine, bodies, facts
+
+
 class KB(object):
-    def __init__(self, kbfile):
-        self.rules = []
-        self.facts = []
-        with open(kbfile) as f:
-            for line in f:
-                if line != "\n":
-                    new_rule = Rule(line)
-                    if (new_rule.is_fact()):
-                        self.facts.append(new_rule)
-                    else:
-                        self.rules.append(new_rule)
+    def __init__(self, kbfile, actions=(), use_cache=True):
+        """
+        :param actions: Atoms that are actions, besides those written as
+            terms (e.g. go(home)).
+        :param use_cache: Load the compiled KB from its cache (see
+            compile_kb).
+        """
+        self._actions = set(actions)
+        self._engine, self._bodies, facts = compile_kb(kbfile, use_cache)
+        self._rules = None
+        self.facts = [Rule.from_parts(fact, []) for fact in facts]
+        self._reset_memory()
+
+    @property
+    def rules(self):
+        # Rule objects are only built when needed, from the compiled rules
+        if self._rules is None:
+            engine = self._engine
+            self._rules = [Rule.from_parts(engine.atom(engine.head(r)),
+                                           [(neg, engine.atom(a))
+                                            for neg, a in self._bodies[r]])
+                           for r in range(len(engine))]
+        return self._rules
+
+    @rules.setter
+    def rules(self, rules):
+        self._rules = rules
+
+    def compile(self):
+        """Compile the rules for inference, and build a new working memory
+        with the facts. Must be called again if the rules are changed."""
+        self._engine = RuleEngine.from_rules(self.rules)
+        self._bodies = [[(lit.is_neg(), self._engine.atom_id(lit.get_atom()))
+                         for lit in rule.body] for rule in self.rules]
+        self._reset_memory()
+
+    def _reset_memory(self):
+        engine = self._engine
+        watched = []
+        for r in range(len(engine)):
+            head = engine.atom(engine.head(r))
+            if self._is_goal_action(head) or self.is_action(head):
+                watched.append(r)
+        self._fact_atoms = set(fact.head for fact in self.facts)
+        self._memory = WorkingMemory(engine, watched, self._fact_atoms)
+        self._perceptions = set()
 
     def add_fact(self, fact):
         rule = Rule(fact + '.')
         self.facts.append(rule)
+        if fact not in self._fact_atoms:
+            self._fact_atoms.add(fact)
+            self._memory.assert_atom(fact)
 
     def remove_fact(self, fact):
-        for f in self.facts:
-            if f.head == fact:
-                self.facts.remove(f)
+        self.facts = [f for f in self.facts if f.head != fact]
+        if fact in self._fact_atoms:
+            self._fact_atoms.discard(fact)
+            self._memory.retract_atom(fact)
 
     def infer(self, perceptions):
-        # TODO
-        pass
+        """Derive all conclusions from the facts and the perceptions.
+
+        Conclusions are kept in a working memory between calls, and only the
+        perceptions that changed since the previous call are retracted or
+        asserted.
+
+        Rules with an add(fact) or remove(fact) head change the facts of the
+        KB, once inference is finished, so the change is seen by the next
+        inference.
+
+        :param perceptions: List of atoms perceived to be true.
+        :return: The action in the head of the first rule (in file order)
+            that fired, or None.
+        """
+        memory = self._memory
+        perceptions = set(perceptions)
+        for atom in self._perceptions - perceptions:
+            memory.retract_atom(atom)
+        for atom in perceptions - self._perceptions:
+            memory.assert_atom(atom)
+        self._perceptions = perceptions
+        memory.update()
+
+        action = None
+        changes = []
+        for r in sorted(memory.active_watched):
+            head = self._engine.atom(self._engine.head(r))
+            if self._is_goal_action(head):
+                changes.append(head)
+            elif action is None:
+                action = head
+
+        for head in changes:
+            fact = head[head.index('(') + 1:-1]
+            if head.startswith('add('):
+                if fact not in self._fact_atoms:
+                    self.add_fact(fact)
+            else:
+                self.remove_fact(fact)
+
+        return action
+
+    def _is_goal_action(self, string):
+        return string.startswith('add(') or string.startswith('remove(')
 
     def is_action(self, string):
-        if "(" in string:
+        if "(" in string or string in self._actions:
             return True
         else:
             return False
@@ -119,6 +716,8 @@ class KB(object):
 
 
 class KBPacman(pacman.PacmanAgent):
+    ACTS_AT_CELL_CENTRES = True
+
     def __init__(self, x, y, cell, kb_file):
         super(KBPacman, self).__init__(x, y, cell)
 
@@ -130,7 +729,7 @@ class KBPacman(pacman.PacmanAgent):
         self.add_perception(WallPerception((-1, 0)))
         self.add_perception(GhostPerception())
 
-        self._kb = KB(kb_file)
+        self._kb = KB(kb_file, self._actions.keys())
 
     def _think(self, delta):
         # If the previous action has finished
@@ -182,7 +781,7 @@ class GhostPerception(pyafai.Perception):
     def update(self, agent):
         x = agent.body.cell_x
         y = agent.body.cell_y
-        nhood = GhostPerception.NHOOD[dir]
+        nhood = GhostPerception.NHOOD[agent.body.direction]
         self.value = ''
         for d in nhood:
             if agent.world.has_object_type_at(x + d[0], y + d[1],
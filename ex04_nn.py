@@ -16,40 +16,48 @@ __author__ = 'Tiago Baptista'
 __version__ = '1.0'
 
 
+import os
 import pacman
 import pyafai
 import random
-import math
+import recording
+import numpy as np
 
 
 class NNLayer():
     def __init__(self, n_neurons, n_inputs):
-
-        self._weights = []
-        for i in range(n_neurons):
-            self._weights.append([])
-            for j in range(n_inputs + 1):
-                self._weights[i].append(random.uniform(-1, 1))
+        # One row of weights per neuron, with the bias weight last
+        self._weights = np.array([[random.uniform(-1, 1)
+                                   for j in range(n_inputs + 1)]
+                                  for i in range(n_neurons)])
 
         self._nin = n_inputs
         self._nout = n_neurons
 
     def sigmoid(self, x):
-        return 1 / (1 + math.e ** -x)
+        # Same as 1 / (1 + e^-x), but does not overflow for large |x|
+        return 0.5 * (1 + np.tanh(0.5 * x))
 
     def feed_forward(self, inputs):
-        inputs = inputs[:]
-        inputs.append(1)
-        outputs = []
-        for neuron in range(len(self._weights)):
-            x = 0
-            for i in range(len(self._weights[neuron])):
-                x += self._weights[neuron][i] * inputs[i]
+        """Outputs of the layer for an input vector, or for each row of a 2D
+        array of input vectors.
 
-            y = self.sigmoid(x)
-            outputs.append(y)
+        :return: A NumPy array.
+        """
+        inputs = np.asarray(inputs, dtype=float)
+        x = np.dot(inputs, self._weights[:, :-1].T) + self._weights[:, -1]
+        return self.sigmoid(x)
 
-        return outputs
+    def set_weights(self, weights):
+        """Set all weights from a flat sequence, neuron by neuron, each with
+        its input weights followed by the bias weight."""
+        self._weights[:] = np.reshape(weights, self._weights.shape)
+
+    def n_weights(self):
+        return self._weights.size
+
+    def __len__(self):
+        return self._nout
 
 
 class NNFeedForward():
@@ -60,17 +68,136 @@ class NNFeedForward():
         self._hidden_outputs = []
 
     def feed_forward(self, inputs):
+        """Outputs of the network for an input vector, as a list, or for each
+        row of a 2D array of input vectors, as a 2D NumPy array."""
         self._hidden_outputs = self._hidden.feed_forward(inputs)
         outputs = self._out.feed_forward(self._hidden_outputs)
 
+        if outputs.ndim == 1:
+            return outputs.tolist()
         return outputs
 
-    def train(self, data, rate):
-        # TODO
-        pass
+    def set_weights(self, weights):
+        n = self._hidden.n_weights()
+        self._hidden.set_weights(weights[:n])
+        self._out.set_weights(weights[n:])
+
+    def train(self, data, rate, epochs=1, batch_size=32, momentum=0.9,
+              validation=0.0, patience=None, verbose=False, seed=None):
+        """Train the network with mini-batch gradient descent with momentum,
+        minimizing the mean squared error.
+
+        :param data: 2D array-like with one row per example, holding the
+            inputs followed by the target outputs, or an object such as
+            recording.RecordingRows that returns those rows when indexed with
+            an array of row indices.
+        :param rate: Learning rate.
+        :param epochs: Maximum number of passes over the training data.
+        :param batch_size: Number of examples per weight update.
+        :param momentum: Fraction of the previous update added to each one.
+        :param validation: Fraction of the data held out for validation.
+        :param patience: Stop after this many epochs without improving the
+            validation loss, and keep the best weights found. Only used with
+            a validation split.
+        :param verbose: Print the losses of each epoch.
+        :param seed: Seed for shuffling. Defaults to a seed drawn from the
+            random module.
+        :return: List with a (training loss, validation loss) tuple per
+            epoch. The validation loss is None without a validation split.
+        """
+        if isinstance(data, (list, tuple)):
+            data = np.asarray(data, dtype=float)
+        n_in = self._hidden._nin
+        if seed is None:
+            seed = random.getrandbits(32)
+        rng = np.random.RandomState(seed)
+
+        order = rng.permutation(len(data))
+        n_val = int(len(data) * validation)
+        val_rows = order[:n_val]
+        train_rows = order[n_val:]
+
+        w1 = self._hidden._weights
+        w2 = self._out._weights
+        v1 = np.zeros_like(w1)
+        v2 = np.zeros_like(w2)
+
+        history = []
+        best = None
+        best_loss = None
+        waiting = 0
+        for epoch in range(epochs):
+            order = train_rows[rng.permutation(len(train_rows))]
+            for start in range(0, len(order), batch_size):
+                # sorted rows read faster from memory mapped data
+                batch = data[np.sort(order[start:start + batch_size])]
+                x = batch[:, :n_in]
+                hidden = self._hidden.feed_forward(x)
+                out = self._out.feed_forward(hidden)
+
+                # Deltas of the output and hidden layers
+                d_out = (out - batch[:, n_in:]) * out * (1 - out)
+                d_hidden = np.dot(d_out, w2[:, :-1]) * hidden * (1 - hidden)
+
+                m = len(x)
+                v2 *= momentum
+                v2[:, :-1] -= rate * np.dot(d_out.T, hidden) / m
+                v2[:, -1] -= rate * d_out.sum(axis=0) / m
+                v1 *= momentum
+                v1[:, :-1] -= rate * np.dot(d_hidden.T, x) / m
+                v1[:, -1] -= rate * d_hidden.sum(axis=0) / m
+                w2 += v2
+                w1 += v1
+
+            loss = self._data_loss(data, train_rows)
+            val_loss = self._data_loss(data, val_rows) if n_val else None
+            history.append((loss, val_loss))
+            if verbose:
+                print("Epoch:", epoch, "Loss:", loss, "Validation:", val_loss)
+
+            if val_loss is not None and patience is not None:
+                if best_loss is None or val_loss < best_loss:
+                    best_loss = val_loss
+                    best = (w1.copy(), w2.copy())
+                    waiting = 0
+                else:
+                    waiting += 1
+                    if waiting >= patience:
+                        break
+
+        if best is not None:
+            w1[:] = best[0]
+            w2[:] = best[1]
+
+        return history
+
+    def _data_loss(self, data, rows, chunk_size=65536):
+        # loss over selected rows of data, read in chunks
+        n_in = self._hidden._nin
+        rows = np.sort(rows)
+        total = 0.0
+        for start in range(0, len(rows), chunk_size):
+            chunk = data[rows[start:start + chunk_size]]
+            total += self.loss(chunk[:, :n_in], chunk[:, n_in:]) * len(chunk)
+        return total / len(rows) if len(rows) else 0.0
+
+    def loss(self, inputs, targets):
+        """Mean squared error of the network over arrays of examples."""
+        if len(inputs) == 0:
+            return 0.0
+        outputs = self._out.feed_forward(self._hidden.feed_forward(inputs))
+        return float(np.mean((outputs - targets) ** 2))
 
 class NNPacman(pacman.PacmanAgent):
-    def __init__(self, x, y, cell):
+    # RandomPerception draws from the random module in every tick, so
+    # NNPacman keeps the default of being updated in every tick
+    ACTS_AT_CELL_CENTRES = False
+
+    def __init__(self, x, y, cell, weights=None):
+        """
+        :param weights: Optional flat vector of network weights, in the
+            layout of NNFeedForward.set_weights.
+        """
         super(NNPacman, self).__init__(x, y, cell)
 
         # Create perceptions
@@ -93,6 +220,8 @@ class NNPacman(pacman.PacmanAgent):
         # Create Neural Network controller.
         # Connect perceptions to input layer, and actions to output layer.
         self._nn = NNFeedForward(14, 14, 2)
+        if weights is not None:
+            self._nn.set_weights(weights)
         self._inputs =[self._perceptions['wall_up'],
                        self._perceptions['wall_down'],
                        self._perceptions['wall_left'],
@@ -120,26 +249,42 @@ class NNPacman(pacman.PacmanAgent):
             action = self._action_dict[(x, y)]
             return [self._actions[action]]
 
-    def train(self, filename, rate=0.2, epochs=100):
+    def train(self, filename, rate=0.2, epochs=100, **kwargs):
+        """Train the network on a recording, either a CSV file saved with
+        save_recording or a binary recording directory (see recording.py).
+        Binary recordings are read on demand, without loading them whole.
+        Rows whose action the network cannot output, such as 'stop', are
+        skipped. Extra keyword arguments are passed to NNFeedForward.train.
+
+        :return: The per-epoch losses returned by NNFeedForward.train.
+        """
+        if os.path.isdir(filename):
+            rec = recording.Recording(filename)
+            actions = rec.categories('action')
+            # the targets of the actions of skipped rows are never used
+            targets = [self._rev_action_dict.get(a, (0, 0)) for a in actions]
+            known = [i for i, a in enumerate(actions)
+                     if a in self._rev_action_dict]
+            rows = np.flatnonzero(np.isin(rec.column('action'), known))
+            data = rec.rows_of([p.name for p in self._inputs] + ['action'],
+                               {'action': targets}, rows)
+            return self._nn.train(data, rate, epochs=epochs, **kwargs)
+
         data = []
 
         # Read and parse data file
         with open(filename, 'r') as f:
             header = f.readline().strip().split(',')
+            columns = [header.index(p.name) for p in self._inputs]
             for line in f:
                 line = line.strip().split(',')
-                line[:-1] = [int(x) for x in line[:-1]]
-                data.append([])
-
-                for p in self._inputs:
-                    data[-1].append(line[header.index(p.name)])
-
-                data[-1].extend(self._rev_action_dict[line[-1]])
+                target = self._rev_action_dict.get(line[-1])
+                if target is not None:
+                    data.append([int(line[i]) for i in columns])
+                    data[-1].extend(target)
 
         # Train network
-        for i in range(epochs):
-            self._nn.train(data, rate)
-
+        return self._nn.train(data, rate, epochs=epochs, **kwargs)
 
 
 class DirectionPerception(pyafai.Perception):
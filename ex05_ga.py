@@ -7,9 +7,9 @@
 """
 Evolving Neural Networks with a Genetic Algorithm
 
-Note: This exercise is still not complete. The connection to pacman is not 
-implemented. It can still serve as a starting point for an exercise that needs
-more time to complete.
+GA evolves a small network for the XOR function. PacmanGA evolves the weights
+of the NNPacman controller, by playing games in headless worlds over a pool of
+processes.
 
 """
 
@@ -20,43 +20,47 @@ __author__ = 'Tiago Baptista'
 __version__ = '1.0'
 
 
+import functools
+import multiprocessing
 import random
-import math
+import numpy as np
+import runner
+import pacman
+import ex04_nn
 
 
 class NNLayer:
     def __init__(self, n_neurons, n_inputs):
-
-        self._weights = []
-        for i in range(n_neurons):
-            self._weights.append([])
-            for j in range(n_inputs + 1):
-                self._weights[i].append(random.uniform(-1, 1))
+        # One row of weights per neuron, with the bias weight last
+        self._weights = np.array([[random.uniform(-1, 1)
+                                   for j in range(n_inputs + 1)]
+                                  for i in range(n_neurons)])
 
         self._nin = n_inputs
         self._nout = n_neurons
 
-    def sigmoid(self, x):
-        return 1 / (1 + math.e ** -x)
+    @staticmethod
+    def sigmoid(x):
+        # Same as 1 / (1 + e^-x), but does not overflow for large |x|
+        return 0.5 * (1 + np.tanh(0.5 * x))
 
     def feed_forward(self, inputs):
-        inputs = inputs[:]
-        inputs.append(1)
-        outputs = []
-        for neuron in range(len(self._weights)):
-            x = 0
-            for i in range(len(self._weights[neuron])):
-                x += self._weights[neuron][i] * inputs[i]
-
-            y = self.sigmoid(x)
-            outputs.append(y)
+        """Outputs of the layer for an input vector, or for each row of a 2D
+        array of input vectors.
 
-        return outputs
+        :return: A NumPy array.
+        """
+        inputs = np.asarray(inputs, dtype=float)
+        x = np.dot(inputs, self._weights[:, :-1].T) + self._weights[:, -1]
+        return self.sigmoid(x)
 
     def set_weights(self, weights):
-        for neuron in range(len(self._weights)):
-            for i in range(len(self._weights[neuron])):
-                self._weights[neuron][i] = weights[neuron * len(self._weights[neuron]) + i]
+        """Set all weights from a flat sequence, neuron by neuron, each with
+        its input weights followed by the bias weight."""
+        self._weights[:] = np.reshape(weights, self._weights.shape)
+
+    def n_weights(self):
+        return self._weights.size
 
     def __len__(self):
         return self._nout
@@ -72,20 +76,27 @@ class NNFeedForward:
         self._hidden_outputs = []
 
     def feed_forward(self, inputs):
+        """Outputs of the network for an input vector, as a list, or for each
+        row of a 2D array of input vectors, as a 2D NumPy array."""
         self._hidden_outputs = self._hidden.feed_forward(inputs)
         outputs = self._out.feed_forward(self._hidden_outputs)
 
+        if outputs.ndim == 1:
+            return outputs.tolist()
         return outputs
 
     def set_weights(self, weights):
-        self._hidden.set_weights(weights[:self._nin * (len(self._hidden) + 1)])
-        self._out.set_weights(weights[self._nin * (len(self._hidden) + 1):])
+        n = self._hidden.n_weights()
+        self._hidden.set_weights(weights[:n])
+        self._out.set_weights(weights[n:])
 
 
 class GA:
     def __init__(self, n=20):
         self._population_size = n
-        self._population = [[self.create_individual(), 0.0] for i in range(n)]
+        # Pairs of [individual, fitness], with fitness None until evaluated
+        self._population = [[self.create_individual(), None] for i in range(n)]
+        self._shape = (2, 2, 1)
 
         self._sigma = 2
 
@@ -101,8 +112,7 @@ class GA:
 
         while not stop:
             # Evaluate
-            for i in range(len(self._population)):
-                self._population[i][1] = self.fitness(self._population[i][0])
+            self.evaluate()
             self._population.sort(key=lambda x: x[1])
             print("Generation:", gen, "Best:", self._population[0][1])
 
@@ -122,17 +132,27 @@ class GA:
 
             # Select new population
             self._population = self._population[:self._elitism]
-            self._population += [[ind, 0.0] for ind in offspring]
+            self._population += [[ind, None] for ind in offspring]
 
             gen += 1
             if gen >= iterations:
                 stop = True
 
-        self._population.sort(key=lambda x: self.fitness(x[0]))
+        self.evaluate()
+        self._population.sort(key=lambda x: x[1])
         best = self._population[0]
-        nn = NNFeedForward(2, 2, 1)
+        nn = NNFeedForward(*self._shape)
         nn.set_weights(best[0])
-        return nn, self.fitness(best[0])
+        return nn, best[1]
+
+    def evaluate(self):
+        """Compute the fitness of the individuals not yet evaluated. Elite
+        individuals keep the fitness computed in previous generations."""
+        pending = [p for p in self._population if p[1] is None]
+        if pending:
+            fitness = self.population_fitness([p[0] for p in pending])
+            for p, f in zip(pending, fitness.tolist()):
+                p[1] = f
 
     def create_individual(self):
         return [random.uniform(-10, 10) for _ in range(9)]
@@ -144,17 +164,20 @@ class GA:
 
     def cross_over(self, ind1, ind2):
         if random.random() < self._prob_cx:
-            k = random.randint(1, 8)
+            k = random.randint(1, len(ind1) - 1)
             child1 = ind1[:k] + ind2[k:]
             child2 = ind2[:k] + ind1[k:]
             return child1, child2
         else:
-            return ind1, ind2
+            # Copies, as offspring are mutated in place
+            return ind1[:], ind2[:]
 
     def select_parents(self):
         parents = []
+        # tournaments of 8, or of the whole population if it is smaller
+        size = min(8, len(self._population))
         for i in range(len(self._population) - self._elitism):
-            t = random.sample(self._population, 8)
+            t = random.sample(self._population, size)
             t.sort(key=lambda x: x[1])
             if random.random() < 1.0:
                 parents.append(t[0][0])
@@ -164,14 +187,105 @@ class GA:
         return parents
 
     def fitness(self, ind):
-        nn = NNFeedForward(2, 2, 1)
-        nn.set_weights(ind)
+        return self.population_fitness([ind])[0]
+
+    def population_fitness(self, individuals):
+        """Fitness of many individuals at once. The networks of all
+        individuals are evaluated on all test cases with stacked (individual,
+        test case) arrays.
+
+        :return: NumPy array with the fitness of each individual.
+        """
+        n_in, n_hidden, n_out = self._shape
+        weights = np.asarray(individuals, dtype=float)
+        n = n_hidden * (n_in + 1)
+        hidden = weights[:, :n].reshape(-1, n_hidden, n_in + 1)
+        out = weights[:, n:].reshape(-1, n_out, n_hidden + 1)
+
+        inputs = np.array([i for i, o in self._test], dtype=float)
+        targets = np.array([o for i, o in self._test], dtype=float)
+
+        # Same layout as NNLayer: bias weights last
+        x = np.einsum('si,phi->psh', inputs, hidden[:, :, :-1])
+        h = NNLayer.sigmoid(x + hidden[:, None, :, -1])
+        x = np.einsum('psh,poh->pso', h, out[:, :, :-1])
+        outputs = NNLayer.sigmoid(x + out[:, None, :, -1])
+
+        return np.abs(outputs[:, :, 0] - targets).sum(axis=1)
+
+
+def _play(level_filename, n_ghosts, max_ticks, task):
+    weights, seed = task
+    result = runner.run_episode(level_filename, ex04_nn.NNPacman,
+                                [pacman.RandomGhost] * n_ghosts, seed,
+                                player_args=(weights,), max_ticks=max_ticks,
+                                reuse_world=True)
+    return result.score
+
+
+class PacmanGA(GA):
+    """Evolve the weights of NNPacman. The fitness of an individual is minus
+    its average score over the same seeded episodes for every individual, so
+    that, as in GA, lower is better.
+
+    Games are played in headless worlds by a pool of worker processes, each
+    reusing one world per level (see runner.get_world).
+    """
+
+    def __init__(self, n=20, level_filename='levels/medium.txt', n_ghosts=2,
+                 episodes=3, seed=0, max_ticks=3000, processes=None):
+        """
+        :param episodes: Number of games played by each individual.
+        :param seed: Seed of the first episode. Episode i uses seed + i.
+        :param max_ticks: Maximum length of each game.
+        :param processes: Number of worker processes. Defaults to the number
+            of cores. With 1, games are played in this process.
+        """
+        self._level_filename = level_filename
+        self._n_ghosts = n_ghosts
+        self._episodes = episodes
+        self._seed = seed
+        self._max_ticks = max_ticks
+        self._processes = processes
+        self._pool = None
+        super(PacmanGA, self).__init__(n)
+        self._shape = (14, 14, 2)
+        self._sigma = 0.5
 
-        total = 0
-        for i, o in self._test:
-            total += abs(nn.feed_forward(i)[0] - o)
+    def run(self, iterations):
+        try:
+            return super(PacmanGA, self).run(iterations)
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the worker processes."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
 
-        return total
+    def create_individual(self):
+        # Same initial range as NNLayer, for the (14, 14, 2) network
+        return [random.uniform(-1, 1) for _ in range(14 * 15 + 2 * 15)]
+
+    def population_fitness(self, individuals):
+        tasks = [(ind, self._seed + i) for ind in individuals
+                 for i in range(self._episodes)]
+        play = functools.partial(_play, self._level_filename, self._n_ghosts,
+                                 self._max_ticks)
+        if self._processes == 1:
+            # Episodes seed the random module, which the GA also uses
+            state = random.getstate()
+            scores = list(map(play, tasks))
+            random.setstate(state)
+        else:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self._processes)
+            scores = self._pool.map(play, tasks)
+
+        scores = np.array(scores, dtype=float).reshape(-1, self._episodes)
+        return -scores.mean(axis=1)
 
 
 if __name__ == '__main__':
@@ -182,3 +296,6 @@ if __name__ == '__main__':
     print(best.feed_forward([1, 0]))
     print(best.feed_forward([1, 1]))
 
+    # Evolve pac-man controllers
+    #nn, fitness = PacmanGA(40).run(50)
+
@@ -0,0 +1,143 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Distance from every cell of the maze to the nearest remaining food, kept up to
+date as food is eaten. Only the cells whose nearest food was the one removed
+are searched again, starting from the distances of the cells around them.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+from collections import deque
+import heapq
+
+
+class FoodDistanceField(object):
+    """Multi-source shortest distances (in steps) from each node of a
+    graph.CompactGraph to the nearest food cell. The graph must be symmetric,
+    as the pac-man maze is, so that distances to the food are the same as
+    distances from it.
+    """
+
+    UNREACHABLE = -1
+
+    def __init__(self, maze, food_cells):
+        """
+        :param maze: The maze as a graph.CompactGraph.
+        :param food_cells: Iterable of (x, y) cells with food.
+        """
+        self._maze = maze
+        self._offsets, self._neighbours, _, self._actions = maze.csr_views()
+        n = len(maze)
+        self._distance = [FoodDistanceField.UNREACHABLE] * n
+        # the food node each distance was measured from
+        self._source = [-1] * n
+
+        queue = deque()
+        for cell in food_cells:
+            node = maze.node_id(cell)
+            if node >= 0 and self._source[node] < 0:
+                self._distance[node] = 0
+                self._source[node] = node
+                queue.append(node)
+
+        offsets = self._offsets
+        neighbours = self._neighbours
+        distance = self._distance
+        source = self._source
+        while queue:
+            node = queue.popleft()
+            d = distance[node] + 1
+            for i in range(offsets[node], offsets[node + 1]):
+                child = neighbours[i]
+                if source[child] < 0:
+                    distance[child] = d
+                    source[child] = source[node]
+                    queue.append(child)
+
+    def remove(self, cell):
+        """Remove the food at cell (x, y) and update the affected distances.
+
+        :return: Number of cells whose distance was recomputed.
+        """
+        food = self._maze.node_id(cell)
+        if food < 0 or self._source[food] != food:
+            return 0
+
+        offsets = self._offsets
+        neighbours = self._neighbours
+        distance = self._distance
+        source = self._source
+
+        # Every cell measured from the removed food is connected to it through
+        # cells measured from the same food.
+        region = [food]
+        source[food] = -1
+        distance[food] = FoodDistanceField.UNREACHABLE
+        for node in region:
+            for i in range(offsets[node], offsets[node + 1]):
+                child = neighbours[i]
+                if source[child] == food:
+                    source[child] = -1
+                    distance[child] = FoodDistanceField.UNREACHABLE
+                    region.append(child)
+
+        # Seed the region from its border, then relax it with a heap, since
+        # the seeds have different distances.
+        heap = []
+        for node in region:
+            for i in range(offsets[node], offsets[node + 1]):
+                child = neighbours[i]
+                if source[child] >= 0:
+                    heap.append((distance[child] + 1, node, source[child]))
+        heapq.heapify(heap)
+
+        while heap:
+            d, node, src = heapq.heappop(heap)
+            if source[node] >= 0:
+                continue
+            distance[node] = d
+            source[node] = src
+            for i in range(offsets[node], offsets[node + 1]):
+                child = neighbours[i]
+                if source[child] < 0:
+                    heapq.heappush(heap, (d + 1, child, src))
+
+        return len(region)
+
+    def distance(self, cell):
+        """Number of steps from cell (x, y) to the nearest food, or None if no
+        food can be reached."""
+        node = self._maze.node_id(cell)
+        if node < 0 or self._distance[node] == FoodDistanceField.UNREACHABLE:
+            return None
+        return self._distance[node]
+
+    def nearest(self, cell):
+        """The (x, y) cell of the food nearest to cell, or None."""
+        node = self._maze.node_id(cell)
+        if node < 0 or self._source[node] < 0:
+            return None
+        return self._maze.node(self._source[node])
+
+    def direction(self, cell):
+        """Name of the action that leads one step closer to the nearest food,
+        or None if cell has food or no food can be reached."""
+        node = self._maze.node_id(cell)
+        if node < 0:
+            return None
+        d = self._distance[node]
+        if d <= 0:
+            return None
+
+        for i in range(self._offsets[node], self._offsets[node + 1]):
+            if self._distance[self._neighbours[i]] == d - 1:
+                return self._maze.action_names[self._actions[i]]
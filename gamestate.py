@@ -0,0 +1,325 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Compact, immutable state of a pac-man game, and a pure step function that
+advances it by one tick exactly as PacmanWorld.step does. States are cheap to
+keep and share, which is what lookahead search (expectimax, MCTS) needs: a
+state is taken from a world with PacmanWorld.snapshot(), expanded with step()
+for each combination of actions, and optionally put back into the world with
+PacmanWorld.restore().
+
+The state holds the food as a bitset, and the body and game state of each
+agent (position, direction, target, scared timer, score), but not what the
+agents have in mind: the actions of each agent are given to step().
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+from collections import namedtuple
+import random
+
+
+AgentState = namedtuple('AgentState', ['uid', 'agent_class', 'ghost', 'dead',
+                                       'x', 'y', 'direction', 'target',
+                                       'progress', 'move_ticks', 'scared',
+                                       'scared_timer', 'score'])
+
+# field indices, used by step on mutable copies of AgentState
+(_UID, _CLASS, _GHOST, _DEAD, _X, _Y, _DIRECTION, _TARGET, _PROGRESS,
+ _MOVE_TICKS, _SCARED, _TIMER, _SCORE) = range(len(AgentState._fields))
+
+
+class GameRules(object):
+    """The static part of a game: the maze and the constants of the game.
+    It is built once per world and shared by all its states."""
+
+    def __init__(self, width, height, valid_actions, player_start,
+                 ghost_starts, pellets, dot_value, pellet_value, player_ticks,
+                 ghost_ticks, scared_ticks, directions):
+        """
+        :param valid_actions: Valid action names of each cell, indexed [y][x].
+        :param pellets: Bitset of the cells that start with a pellet.
+        :param player_ticks: Ticks the player takes to move one cell, and
+            likewise for ghost_ticks and scared_ticks.
+        :param directions: Dictionary from action name to (dx, dy).
+        """
+        self.width = width
+        self.height = height
+        self.valid_actions = valid_actions
+        self.player_start = player_start
+        self.ghost_starts = ghost_starts
+        self.pellets = pellets
+        self.dot_value = dot_value
+        self.pellet_value = pellet_value
+        self.player_ticks = player_ticks
+        self.ghost_ticks = ghost_ticks
+        self.scared_ticks = scared_ticks
+        self.directions = directions
+        self.direction_names = dict((d, name)
+                                    for name, d in directions.items())
+
+    def bit(self, x, y):
+        """The food bitset bit of cell (x, y)."""
+        return 1 << ((y % self.height) * self.width + x % self.width)
+
+
+class GameState(object):
+    """A state of the game. States are immutable: step() returns a new one.
+
+    - food: bitset of the cells with food (see GameRules.bit);
+    - agents: tuple of AgentState, in the order agents are updated;
+    - player: uid of the world's player, or -1.
+    """
+
+    __slots__ = ('rules', 'ticks', 'food', 'food_count', 'agents', 'player',
+                 'score', 'player_lives', 'game_over', 'player_win',
+                 'next_uid')
+
+    def __init__(self, rules, ticks, food, food_count, agents, player, score,
+                 player_lives, game_over, player_win, next_uid):
+        self.rules = rules
+        self.ticks = ticks
+        self.food = food
+        self.food_count = food_count
+        self.agents = agents
+        self.player = player
+        self.score = score
+        self.player_lives = player_lives
+        self.game_over = game_over
+        self.player_win = player_win
+        self.next_uid = next_uid
+
+    def has_food_at(self, x, y):
+        return bool(self.food & self.rules.bit(x, y))
+
+    def agent(self, uid):
+        """The AgentState of the agent with the given uid, or None."""
+        for agent in self.agents:
+            if agent.uid == uid:
+                return agent
+        return None
+
+    def __eq__(self, other):
+        return isinstance(other, GameState) and \
+            all(getattr(self, s) == getattr(other, s)
+                for s in GameState.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+def step(state, actions, rng=None):
+    """Advance state by one tick.
+
+    :param actions: Dictionary from agent uid to the name of the action (or
+        list of names) the agent executes in this tick. Agents that are not
+        in it do nothing, as when their _think returns nothing.
+    :param rng: Where respawned ghosts draw their starting cell from, with
+        choice(). Defaults to the random module, like the world.
+    :return: The new GameState. state itself is left unchanged.
+    """
+    if state.game_over:
+        return state
+
+    tick = _Tick(state, rng or random)
+    tick.run(actions)
+    return tick.result()
+
+
+class _Tick(object):
+    # The world's update, on lists in place of agents and bodies. Methods
+    # mirror the world and agent methods of the same name.
+
+    def __init__(self, state, rng):
+        self.state = state
+        self.rules = state.rules
+        self.rng = rng
+        self.food = state.food
+        self.food_count = state.food_count
+        self.player_lives = state.player_lives
+        self.next_uid = state.next_uid
+        self.agents = []
+        self.player = None
+        for agent in state.agents:
+            agent = list(agent)
+            self.agents.append(agent)
+            if agent[_UID] == state.player:
+                self.player = agent
+        if self.player is None and state.player >= 0:
+            # the player was removed from the world when it died
+            self.player = [state.player, None, False, True, 0, 0, (0, 0),
+                           None, 0, 0, False, 0, state.score]
+
+    def run(self, actions):
+        agents = self.agents
+        removed = []
+        i = 0
+        # process_agents, including the agents spawned meanwhile
+        while i < len(agents):
+            agent = agents[i]
+            if not agent[_DEAD]:
+                names = actions.get(agent[_UID], ())
+                if isinstance(names, str):
+                    names = (names,)
+                if agent[_GHOST]:
+                    self.update_ghost(agent, names)
+                else:
+                    self.update_pacman(agent, names)
+            if agent[_DEAD]:
+                removed.append(agent[_UID])
+            i += 1
+
+        for agent in agents:
+            self.move(agent)
+
+        if removed:
+            removed = set(removed)
+            self.agents = [a for a in agents if a[_UID] not in removed]
+
+    def result(self):
+        state = self.state
+        game_over = False
+        player_win = False
+        if self.food_count == 0:
+            game_over = True
+            player_win = True
+        if self.player_lives == 0:
+            game_over = True
+
+        agents = tuple(AgentState._make(agent) for agent in self.agents)
+        player = self.player
+        return GameState(self.rules, state.ticks + 1, self.food,
+                         self.food_count, agents,
+                         -1 if player is None else player[_UID],
+                         0 if player is None else player[_SCORE],
+                         self.player_lives, game_over, player_win,
+                         self.next_uid)
+
+    def update_pacman(self, agent, names):
+        self.eat_ghosts(agent)
+        for name in names:
+            self.execute(agent, name)
+        self.eat_food(agent)
+        self.eat_ghosts(agent)
+
+    def update_ghost(self, agent, names):
+        for name in names:
+            self.execute(agent, name)
+
+        if agent[_SCARED]:
+            agent[_TIMER] -= 1
+            if agent[_TIMER] <= 0:
+                agent[_SCARED] = False
+                agent[_TIMER] = 0
+        else:
+            self.eat_player(agent)
+
+    def eat_food(self, agent):
+        bit = self.rules.bit(agent[_X], agent[_Y])
+        if self.food & bit:
+            self.food &= ~bit
+            self.food_count -= 1
+            if self.rules.pellets & bit:
+                agent[_SCORE] += self.rules.pellet_value
+                self.scare_ghosts()
+            else:
+                agent[_SCORE] += self.rules.dot_value
+
+    def eat_ghosts(self, agent):
+        cell = (agent[_X], agent[_Y])
+        # agents are in uid order, like the ghosts eaten by the world
+        ghosts = [g for g in self.agents if g[_GHOST] and g[_SCARED] and
+                  (g[_X], g[_Y]) == cell]
+        for ghost in ghosts:
+            self.kill_ghost(ghost)
+
+    def eat_player(self, agent):
+        player = self.player
+        if player is not None and not player[_DEAD] and \
+                agent[_X] == player[_X] and agent[_Y] == player[_Y]:
+            self.kill_player()
+
+    def scare_ghosts(self):
+        for agent in self.agents:
+            if agent[_GHOST]:
+                agent[_SCARED] = True
+                agent[_TIMER] = agent[_CLASS].GHOST_SCARE_TIMEOUT
+
+    def kill_player(self):
+        if self.player is not None:
+            self.player[_DEAD] = True
+            self.player_lives -= 1
+
+            if self.player_lives > 0:
+                self.spawn(self.player[_CLASS], False,
+                           self.rules.player_start)
+
+    def kill_ghost(self, ghost):
+        # As in the world, a ghost killed earlier in the tick, but still in
+        # the grid until the end of it, is not killed again
+        if not ghost[_DEAD]:
+            ghost[_DEAD] = True
+            self.spawn(ghost[_CLASS], True,
+                       self.rng.choice(self.rules.ghost_starts))
+
+    def spawn(self, agent_class, ghost, location):
+        agent = [self.next_uid, agent_class, ghost, False, location[0],
+                 location[1], (0, 0), None, 0, 0, False, 0, 0]
+        self.next_uid += 1
+        self.agents.append(agent)
+        if not ghost:
+            self.player = agent
+
+    def get_valid_actions(self, agent):
+        if agent[_TARGET] is not None:
+            return ()
+
+        valid = self.rules.valid_actions[agent[_Y]][agent[_X]]
+        if agent[_GHOST]:
+            direction = agent[_DIRECTION]
+            if direction != (0, 0) and len(valid) > 1:
+                reverse = (direction[0] * -1, direction[1] * -1)
+                name = self.rules.direction_names.get(reverse)
+                if name in valid:
+                    valid = [a for a in valid if a != name]
+
+        return valid
+
+    def execute(self, agent, name):
+        if name in self.get_valid_actions(agent):
+            self.set_direction(agent, self.rules.directions[name])
+
+    def set_direction(self, agent, direction):
+        if agent[_TARGET] is None:
+            agent[_DIRECTION] = direction
+            agent[_TARGET] = (agent[_X] + direction[0],
+                              agent[_Y] + direction[1])
+            agent[_PROGRESS] = 0
+            if not agent[_GHOST]:
+                agent[_MOVE_TICKS] = self.rules.player_ticks
+            elif agent[_SCARED]:
+                agent[_MOVE_TICKS] = self.rules.scared_ticks
+            else:
+                agent[_MOVE_TICKS] = self.rules.ghost_ticks
+
+    def move(self, agent):
+        # AgentBody.update, followed by the wrap around of the world
+        if agent[_TARGET] is not None:
+            agent[_PROGRESS] += 1
+            if agent[_PROGRESS] >= agent[_MOVE_TICKS]:
+                agent[_X], agent[_Y] = agent[_TARGET]
+                agent[_TARGET] = None
+                agent[_PROGRESS] = 0
+
+                agent[_X] %= self.rules.width
+                agent[_Y] %= self.rules.height
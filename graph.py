@@ -9,6 +9,8 @@ from __future__ import division
 __docformat__ = 'restructuredtext'
 __author__ = 'Tiago Baptista'
 
+import numpy as np
+
 
 class Graph(object):
     """Base class for directed graphs. It is completely generic.
@@ -51,3 +53,180 @@ class Graph(object):
 
     def __iter__(self):
         return self._graph.__iter__()
+
+
+class CompactGraph(Graph):
+    """Immutable graph whose nodes are the (x, y) cells of a width x height
+    grid, stored in compressed sparse row (CSR) form.
+
+    Nodes have integer ids, in sorted (x, y) order. The connections of node i
+    are at positions offsets[i] to offsets[i + 1] of the neighbours, weights
+    and actions arrays, where actions holds indices into action_names.
+
+    get_connections() returns the same ((x, y), weight, action_name) tuples as
+    Graph, but searches should prefer get_connection_ids(), which returns
+    slices of the arrays without building any tuples. Weights are kept as
+    integers when they are all whole numbers, so path costs have the same
+    type as with Graph.
+
+    The graph cannot be changed: add_node() and clear() raise TypeError.
+    """
+
+    def __init__(self, width, height, cells, offsets, neighbours, weights,
+                 actions, action_names):
+        super(CompactGraph, self).__init__()
+        self.width = width
+        self.height = height
+        self.cells = np.asarray(cells, dtype=np.int32).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.neighbours = np.asarray(neighbours, dtype=np.int32)
+        weights = np.asarray(weights)
+        if np.array_equal(weights, np.round(weights)):
+            self.weights = weights.astype(np.int64)
+        else:
+            self.weights = weights.astype(np.float64)
+        self.actions = np.asarray(actions, dtype=np.int8)
+        self.action_names = list(action_names)
+
+        self._cell_ids = np.full(width * height, -1, dtype=np.int32)
+        self._cell_ids[self.cells[:, 1] * width + self.cells[:, 0]] = \
+            np.arange(len(self.cells), dtype=np.int32)
+
+        # memoryviews index faster than NumPy arrays from Python code
+        self._offsets_view = memoryview(self.offsets)
+        self._neighbours_view = memoryview(self.neighbours)
+        self._weights_view = memoryview(self.weights)
+        self._actions_view = memoryview(self.actions)
+        self._cell_ids_view = memoryview(self._cell_ids)
+        self._cells_view = memoryview(self.cells.reshape(-1))
+
+    @classmethod
+    def from_graph(cls, graph, width, height):
+        """Build a CompactGraph from a Graph whose nodes are (x, y) cells."""
+        cells = sorted(graph.get_nodes())
+        ids = dict((node, i) for i, node in enumerate(cells))
+        action_names = []
+        action_ids = {}
+        offsets = [0]
+        neighbours = []
+        weights = []
+        actions = []
+        for node in cells:
+            for dest, weight, action in graph.get_connections(node):
+                if action not in action_ids:
+                    action_ids[action] = len(action_names)
+                    action_names.append(action)
+                neighbours.append(ids[dest])
+                weights.append(weight)
+                actions.append(action_ids[action])
+            offsets.append(len(neighbours))
+
+        return cls(width, height, cells, offsets, neighbours, weights,
+                   actions, action_names)
+
+    @classmethod
+    def from_grid(cls, walls, valid, actions, tor=True):
+        """Build a CompactGraph directly from grid arrays, with unit weights.
+
+        :param walls: (height, width) bool array. Every other cell is a node.
+        :param valid: (height, width, len(actions)) bool array, True where the
+            action can be executed.
+        :param actions: List of (action_name, (dx, dy)).
+        :param tor: If the grid wraps around its edges.
+        """
+        walls = np.asarray(walls, dtype=bool)
+        valid = np.asarray(valid, dtype=bool)
+        height, width = walls.shape
+
+        # argwhere over the transpose gives (x, y) pairs in sorted order
+        cells = np.argwhere(~walls.T)
+        cell_ids = np.full((height, width), -1, dtype=np.int64)
+        cell_ids[cells[:, 1], cells[:, 0]] = np.arange(len(cells))
+
+        deltas = np.array([d for _, d in actions]).reshape(-1, 2)
+        node_valid = valid[cells[:, 1], cells[:, 0]]
+        x1 = cells[:, 0, None] + deltas[None, :, 0]
+        y1 = cells[:, 1, None] + deltas[None, :, 1]
+        if tor:
+            x1 %= width
+            y1 %= height
+        else:
+            node_valid = node_valid & (0 <= x1) & (x1 < width) & \
+                         (0 <= y1) & (y1 < height)
+
+        node, action = np.nonzero(node_valid)
+        neighbours = cell_ids[y1[node, action], x1[node, action]]
+        offsets = np.zeros(len(cells) + 1, dtype=np.int64)
+        np.cumsum(node_valid.sum(axis=1), out=offsets[1:])
+
+        return cls(width, height, cells, offsets, neighbours,
+                   np.ones(len(neighbours)), action,
+                   [name for name, _ in actions])
+
+    def add_node(self, node, connections):
+        raise TypeError("CompactGraph is immutable")
+
+    def clear(self):
+        raise TypeError("CompactGraph is immutable")
+
+    def node_id(self, node):
+        """Id of the node at cell (x, y), or -1 if there is none."""
+        x, y = node[0], node[1]
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self._cell_ids_view[y * self.width + x]
+        return -1
+
+    def node(self, node_id):
+        """Cell (x, y) of a node id."""
+        return (self._cells_view[2 * node_id],
+                self._cells_view[2 * node_id + 1])
+
+    def node_ids(self, cells):
+        """Vectorized node_id for an (n, 2) array of cells."""
+        cells = np.asarray(cells)
+        return self._cell_ids[cells[..., 1] * self.width + cells[..., 0]]
+
+    def nodes(self, node_ids):
+        """Vectorized node for an array of node ids, as an (n, 2) array."""
+        return self.cells[node_ids]
+
+    def csr_views(self):
+        """The (offsets, neighbours, weights, actions) arrays as memoryviews,
+        for tight search loops. Such loops should report their work with
+        add_to_counters()."""
+        return (self._offsets_view, self._neighbours_view,
+                self._weights_view, self._actions_view)
+
+    def add_to_counters(self, expanded, visited):
+        self._expanded_counter += expanded
+        self._visited_counter += visited
+
+    def get_connection_ids(self, node_id):
+        """Connections of a node id as (neighbour ids, weights, action
+        indices) memoryview slices."""
+        start = self._offsets_view[node_id]
+        end = self._offsets_view[node_id + 1]
+        self._expanded_counter += end - start
+        self._visited_counter += 1
+        return (self._neighbours_view[start:end],
+                self._weights_view[start:end],
+                self._actions_view[start:end])
+
+    def get_connections(self, node):
+        node_id = self.node_id(node)
+        if node_id < 0:
+            self._visited_counter += 1
+            return []
+
+        neighbours, weights, actions = self.get_connection_ids(node_id)
+        return [(self.node(n), w, self.action_names[a])
+                for n, w, a in zip(neighbours, weights, actions)]
+
+    def get_nodes(self):
+        return [tuple(cell) for cell in self.cells.tolist()]
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __iter__(self):
+        return iter(self.get_nodes())
@@ -0,0 +1,217 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Compiled pac-man levels. A level text file is parsed once into NumPy arrays
+(walls, food, spawn points and valid actions), which are saved in a cache
+directory next to the level file. The cache is keyed by a hash of the level
+file contents, and later loads memory map the arrays instead of parsing the
+text again.
+
+Level files use one character per cell: 'X' for walls, '.' for dots, 'O' for
+pellets, 'P' for the player start and 'G' for ghost starts.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+from io import open
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+import distances
+
+
+CACHE_VERSION = 1
+
+# Same order as pacman.PacmanWorld.GAME_ACTIONS
+ACTIONS = [('up', (0, 1)), ('down', (0, -1)), ('left', (-1, 0)),
+           ('right', (1, 0))]
+
+NO_FOOD = 0
+DOT = 1
+PELLET = 2
+
+
+def read_level(filename):
+    """Read a level file into a list of rows of characters. Rows are reversed,
+    so that grid[y][x] uses the world's coordinates (y grows upwards)."""
+    with open(filename, 'r', encoding='utf8') as f:
+        grid = [list(line.strip('\n')) for line in f.readlines()]
+        grid.reverse()
+
+    return grid
+
+
+class CompiledLevel(object):
+    """The static data of a level, as NumPy arrays:
+
+    - walls: (height, width) bool array;
+    - food: (height, width) array of NO_FOOD, DOT or PELLET;
+    - player_start: (x, y) array;
+    - ghost_starts: (n, 2) array of (x, y);
+    - valid: (height, width, 4) bool array, True if the action with the same
+      index in ACTIONS can be executed from that cell.
+    """
+
+    ARRAYS = ['walls', 'food', 'player_start', 'ghost_starts', 'valid']
+    DISTANCE_ARRAYS = ['distances', 'first_actions']
+
+    def __init__(self, arrays, cache_dir=None):
+        self.walls = arrays['walls']
+        self.food = arrays['food']
+        self.player_start = arrays['player_start']
+        self.ghost_starts = arrays['ghost_starts']
+        self.valid = arrays['valid']
+        self.height, self.width = self.walls.shape
+        self._cache_dir = cache_dir
+
+    @classmethod
+    def from_grid(cls, grid):
+        height = len(grid)
+        width = len(grid[0])
+        walls = np.zeros((height, width), dtype=bool)
+        food = np.zeros((height, width), dtype=np.int8)
+        player_start = np.zeros(2, dtype=np.int64)
+        ghost_starts = []
+        for y in range(height):
+            for x in range(len(grid[y])):
+                if grid[y][x] == 'X':
+                    walls[y, x] = True
+                elif grid[y][x] == '.':
+                    food[y, x] = DOT
+                elif grid[y][x] == 'O':
+                    food[y, x] = PELLET
+                elif grid[y][x] == 'P':
+                    player_start[:] = (x, y)
+                elif grid[y][x] == 'G':
+                    ghost_starts.append((x, y))
+
+        # The world is toroidal, so neighbours wrap around the edges
+        valid = np.zeros((height, width, len(ACTIONS)), dtype=bool)
+        for i, (_, (dx, dy)) in enumerate(ACTIONS):
+            blocked = np.roll(walls, shift=(-dy, -dx), axis=(0, 1))
+            valid[:, :, i] = ~walls & ~blocked
+
+        return cls({'walls': walls, 'food': food,
+                    'player_start': player_start,
+                    'ghost_starts': np.array(ghost_starts,
+                                             dtype=np.int64).reshape(-1, 2),
+                    'valid': valid})
+
+    def valid_action_names(self):
+        """Valid actions as lists of action names, indexed by [y][x]."""
+        names = [name for name, _ in ACTIONS]
+        return [[[names[i] for i in range(len(names)) if cell[i]]
+                 for cell in row] for row in self.valid.tolist()]
+
+    def distance_table(self, graph):
+        """Return a distances.DistanceTable for the level graph, loading it
+        from the cache if it was saved before, and saving it otherwise."""
+        if self._cache_dir is not None:
+            paths = [os.path.join(self._cache_dir, name + '.npy')
+                     for name in CompiledLevel.DISTANCE_ARRAYS]
+            if all(os.path.exists(path) for path in paths):
+                tables = [np.load(path, mmap_mode='r') for path in paths]
+                return distances.DistanceTable(graph, tables)
+
+        table = distances.DistanceTable(graph)
+        if self._cache_dir is not None:
+            try:
+                _save_arrays(self._cache_dir,
+                             {'distances': table.distances,
+                              'first_actions': table.first_actions})
+            except OSError:
+                pass
+
+        return table
+
+
+def cache_dir_for(filename):
+    """Path of the cache directory for the current contents of a level."""
+    with open(filename, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+
+    return '{}.{}.v{}.levelcache'.format(os.path.splitext(filename)[0],
+                                         digest, CACHE_VERSION)
+
+
+def _umask_mode(mode):
+    # mkstemp and mkdtemp only give access to their owner, but the cache is
+    # shared like files made with open and os.makedirs
+    umask = os.umask(0)
+    os.umask(umask)
+    return mode & ~umask
+
+
+def _save_arrays(directory, arrays):
+    # Write each array to a temporary file and rename it, so that concurrent
+    # readers never see a partially written file.
+    mode = _umask_mode(0o644)
+    for name, array in arrays.items():
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, np.ascontiguousarray(array))
+        os.chmod(tmp, mode)
+        os.replace(tmp, os.path.join(directory, name + '.npy'))
+
+
+def _load_cached(directory):
+    arrays = {}
+    for name in CompiledLevel.ARRAYS:
+        arrays[name] = np.load(os.path.join(directory, name + '.npy'),
+                               mmap_mode='r')
+
+    return CompiledLevel(arrays, directory)
+
+
+def _write_cache(directory, level):
+    # Build the cache in a temporary directory and rename it into place, so
+    # that concurrent processes never load an incomplete cache.
+    parent = os.path.dirname(directory) or '.'
+    tmp = tempfile.mkdtemp(dir=parent, suffix='.tmp')
+    try:
+        os.chmod(tmp, _umask_mode(0o755))
+        _save_arrays(tmp, dict((name, getattr(level, name))
+                               for name in CompiledLevel.ARRAYS))
+        os.rename(tmp, directory)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(directory):
+            raise
+
+
+def load_level(filename, use_cache=True):
+    """Load a level, from its compiled cache if available. The cache is
+    created on the first load. If it cannot be written (e.g. read-only
+    directory), the level is simply parsed.
+
+    :return: A CompiledLevel.
+    """
+    if not use_cache:
+        return CompiledLevel.from_grid(read_level(filename))
+
+    directory = cache_dir_for(filename)
+    if os.path.isdir(directory):
+        try:
+            return _load_cached(directory)
+        except (OSError, ValueError):
+            pass
+
+    level = CompiledLevel.from_grid(read_level(filename))
+    try:
+        if not os.path.isdir(directory):
+            _write_cache(directory, level)
+        level._cache_dir = directory
+    except OSError:
+        pass
+
+    return level
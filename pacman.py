@@ -6,12 +6,24 @@
 
 from __future__ import division
 from io import open
+import os
+import pyglet
+if os.environ.get('PACMAN_HEADLESS'):
+    # No display available, so pyglet must not try to create a shadow window
+    pyglet.options['shadow_window'] = False
 import pyafai
 from pyafai import shapes
-import pyglet
 from pyglet.window import key
 import graph
+import levelcache
+import foodfield
+import recording
+import gamestate
+import profiling
 import random
+import heapq
+from collections import deque
+import numpy as np
 
 __docformat__ = 'restructuredtext'
 __author__ = 'Tiago Baptista'
@@ -37,22 +49,26 @@ class ColorConfig(object):
 
 
 class AgentBody(pyafai.Object):
+    """Body of an agent. Bodies move between cell centres in a whole number
+    of ticks, and x and y are always the cell the body is in (or leaving).
+    Smooth movement is only a matter of drawing, see render_position.
+    """
     dir_to_angle = {(0, 1): 90,
                     (0, -1): 270,
                     (1, 0): 0,
                     (-1, 0): 180}
 
-    VELOCITY = 5.0
+    # 5 cells per second, at 60 ticks per second
+    TICKS_PER_CELL = 12
 
     def __init__(self, x, y):
         super(AgentBody, self).__init__(x, y)
 
-        self.velocity = AgentBody.VELOCITY
+        self.ticks_per_cell = AgentBody.TICKS_PER_CELL
         self._direction = (0, 0)
         self._target = None
-        self._velx = 0
-        self._vely = 0
-        self._excess = [0, 0]
+        self._progress = 0      # ticks spent moving to the target
+        self._move_ticks = 0    # ticks the move to the target takes
         self.animate = True
 
     @property
@@ -60,61 +76,23 @@ class AgentBody(pyafai.Object):
         return self._target
 
     def update(self, delta):
-        if self.animate:
-            if self._target is not None:
-                if self._excess[0] != 0:
-                    self.x += self._excess[0]
-                    self._excess[0] = 0
-                elif self._excess[1] != 0:
-                    self.y += self._excess[1]
-                    self._excess[1] = 0
-
-                self.x += self._velx * delta
-                self.y += self._vely * delta
-
-                w = self.agent.world.grid_width
-                h = self.agent.world.grid_height
-
-                if self._direction[0] > 0:
-                    if self.x > w - 0.5:
-                        self._target = (self._target[0] % w, self._target[1])
-
-                    elif self._target[0] - self.x <= 0:
-                        self._excess[0] = self.x - self._target[0]
-                        self.x = self._target[0]
-                        self._target = None
-
-                elif self._direction[0] < 0:
-                    if self.x < -0.5:
-                        self._target = (self._target[0] % w, self._target[1])
-
-                    elif self.x - self._target[0] <= 0:
-                        self._excess[0] = self.x - self._target[0]
-                        self.x = self._target[0]
-                        self._target = None
-
-                elif self._direction[1] > 0:
-                    if self.y > h - 0.5:
-                        self._target = (self._target[0], self._target[1] % h)
-
-                    elif self._target[1] - self.y <= 0:
-                        self._excess[1] = self.y - self._target[1]
-                        self.y = self._target[1]
-                        self._target = None
-
-                elif self._direction[1] < 0:
-                    if self.y < -0.5:
-                        self._target = (self._target[0], self._target[1] % h)
-
-                    elif self.y - self._target[1] <= 0:
-                        self._excess[1] = self.y - self._target[1]
-                        self.y = self._target[1]
-                        self._target = None
-
-        elif self._target is not None:
-            self.x = self._target[0]
-            self.y = self._target[1]
-            self._target = None
+        if self._target is not None:
+            self._progress += 1
+            if self._progress >= self._move_ticks:
+                # the world wraps targets outside the grid around
+                self.x, self.y = self._target
+                self._target = None
+                self._progress = 0
+
+    @property
+    def render_position(self):
+        """The position to draw the body at, in cells. When animated, the
+        body is drawn part of the way to its target."""
+        if self.animate and self._target is not None:
+            f = self._progress / self._move_ticks
+            return (self.x + (self._target[0] - self.x) * f,
+                    self.y + (self._target[1] - self.y) * f)
+        return self.x, self.y
 
     @property
     def cell(self):
@@ -135,26 +113,21 @@ class AgentBody(pyafai.Object):
     @direction.setter
     def direction(self, direction):
         if self._target is None:
-            if self._direction != direction:
-                self._excess = [0, 0]
-
             self._direction = direction
             self._target = (self.cell_x + direction[0],
                             self.cell_y + direction[1])
-            if direction != (0, 0):
-                self._velx = direction[0] * self.velocity
-                self._vely = direction[1] * self.velocity
-            else:
-                self._velx = 0
-                self._vely = 0
+            self._progress = 0
+            self._move_ticks = self.ticks_per_cell
 
 
 class PacmanBody(AgentBody):
     def __init__(self, x, y, cell):
         super(PacmanBody, self).__init__(x, y)
 
-        shape = shapes.Circle(int(cell * 0.6), color=ColorConfig.PACMAN)
-        self.add_shape(shape)
+        # A cell size of None creates a body without shapes (headless)
+        if cell is not None:
+            shape = shapes.Circle(int(cell * 0.6), color=ColorConfig.PACMAN)
+            self.add_shape(shape)
 
     @property
     def direction(self):
@@ -168,16 +141,17 @@ class PacmanBody(AgentBody):
 
 
 class GhostBody(AgentBody):
+    # scared ghosts move at half speed
+    SCARED_TICKS_PER_CELL = 2 * AgentBody.TICKS_PER_CELL
+
     def __init__(self, x, y, cell, color=ColorConfig.GHOST1):
         super(GhostBody, self).__init__(x, y)
-        self._normal_velocity = AgentBody.VELOCITY * 1.0
-        self._scared_velocity = AgentBody.VELOCITY * 0.5
         self._color = color
         self._scared = False
-        self.velocity = self._normal_velocity
 
-        shape = shapes.Rect(cell * 1.25, cell * 1.25, color=color)
-        self.add_shape(shape)
+        if cell is not None:
+            shape = shapes.Rect(cell * 1.25, cell * 1.25, color=color)
+            self.add_shape(shape)
 
     @property
     def scared(self):
@@ -188,11 +162,15 @@ class GhostBody(AgentBody):
         if value != self._scared:
             self._scared = value
             if value:
-                self._shapes[0].color = ColorConfig.GHOST_SCARED
-                self.velocity = self._scared_velocity
+                self.ticks_per_cell = GhostBody.SCARED_TICKS_PER_CELL
             else:
-                self._shapes[0].color = self._color
-                self.velocity = self._normal_velocity
+                self.ticks_per_cell = AgentBody.TICKS_PER_CELL
+
+            if self._shapes:
+                if value:
+                    self._shapes[0].color = ColorConfig.GHOST_SCARED
+                else:
+                    self._shapes[0].color = self._color
 
 
 class GameAction(pyafai.Action):
@@ -205,6 +183,9 @@ class GameAction(pyafai.Action):
                'stop': 'stop'}
 
     def execute(self, agent):
+        log = agent.world.replay_log
+        if log is not None:
+            log.on_action(agent, self.name)
         if agent.world.is_valid_action(agent, self):
             agent.body.direction = self.direction
 
@@ -246,12 +227,23 @@ class RightAction(GameAction):
 
 
 class PacmanAgent(pyafai.Agent):
+    # Agents that only act when their body is at a cell centre set this, so
+    # that scheduled worlds skip them while they move
+    ACTS_AT_CELL_CENTRES = False
+
+    # (method, phase) timed while the world is profiled, see profiling
+    PROFILED_METHODS = [('update', 'update'),
+                        ('_update_perceptions', 'perceptions'),
+                        ('_think', 'think'), ('_record', 'record'),
+                        ('eat_food', 'eat_food'), ('eat_ghosts', 'eat_ghosts')]
+
     def __init__(self, x, y, cell):
         super(PacmanAgent, self).__init__()
         self.score = 0
         self._history = []
         self._header = []
         self._recording = False
+        self._recorder = None
 
         self.body = PacmanBody(x, y, cell)
 
@@ -274,11 +266,12 @@ class PacmanAgent(pyafai.Agent):
         x, y = self.body.cell
         l = self.world.get_cell_contents(x, y)
         if l:
-            for obj in l:
-                if obj.is_body:
-                    ag = obj.agent
-                    if isinstance(ag, GhostAgent) and ag.scared:
-                        self.world.kill_ghost(ag)
+            # in spawn order, whatever the order of the bodies in the cell
+            ghosts = [obj.agent for obj in l if obj.is_body and
+                      isinstance(obj.agent, GhostAgent) and obj.agent.scared]
+            ghosts.sort(key=lambda ag: ag.uid)
+            for ag in ghosts:
+                self.world.kill_ghost(ag)
 
     def update(self, delta):
         self.eat_ghosts()
@@ -291,19 +284,39 @@ class PacmanAgent(pyafai.Agent):
         super(PacmanAgent, self).update(delta)
 
         if self._recording and flag:
-            self._history.append([])
-            self._history[-1].extend([p.value for p in self._perceptions.values()])
-            self._history[-1].append(self.last_action)
+            self._record()
 
         self.eat_food()
         self.eat_ghosts()
 
-    def start_recording(self):
+    def _record(self):
+        row = [p.value for p in self._perceptions.values()]
+        row.append(self.last_action)
+        if self._recorder is not None:
+            self._recorder.append(row)
+        else:
+            self._history.append(row)
+
+    def start_recording(self, path=None, chunk_size=4096):
+        """Start recording the perceptions and action of each decision.
+
+        :param path: If given, rows are streamed to a binary recording in this
+            directory (see recording.RecordingWriter) instead of being kept in
+            memory for save_recording.
+        """
         self._header = [p.name for p in self._perceptions.values()] + ['action']
+        if path is not None:
+            columns = [(p.name, p.type) for p in self._perceptions.values()]
+            columns.append(('action', str))
+            self._recorder = recording.RecordingWriter(path, columns,
+                                                       chunk_size)
         self._recording = True
 
     def stop_recording(self):
         self._recording = False
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
 
     def save_recording(self, filename):
         with open(filename, 'w') as f:
@@ -315,7 +328,15 @@ class PacmanAgent(pyafai.Agent):
 
 
 class GhostAgent(pyafai.Agent):
-    GHOST_SCARE_TIMEOUT = 6
+    # ticks (6 seconds)
+    GHOST_SCARE_TIMEOUT = 360
+
+    # see PacmanAgent
+    ACTS_AT_CELL_CENTRES = False
+    PROFILED_METHODS = [('update', 'update'),
+                        ('_update_perceptions', 'perceptions'),
+                        ('_think', 'think'),
+                        ('_count_down_or_eat', 'eat_player')]
 
     def __init__(self, x, y, cell, color=ColorConfig.GHOST1):
         super(GhostAgent, self).__init__()
@@ -353,9 +374,11 @@ class GhostAgent(pyafai.Agent):
 
     def update(self, delta):
         super(GhostAgent, self).update(delta)
+        self._count_down_or_eat()
 
+    def _count_down_or_eat(self):
         if self._scared:
-            self._scared_timer -= delta
+            self._scared_timer -= 1
             if self._scared_timer <= 0:
                 self.scared = False
         else:
@@ -366,6 +389,8 @@ class GhostAgent(pyafai.Agent):
 
 
 class RandomGhost(GhostAgent):
+    ACTS_AT_CELL_CENTRES = True
+
     def __init__(self, x, y, cell, color=ColorConfig.GHOST1):
         super(RandomGhost, self).__init__(x, y, cell, color)
 
@@ -380,7 +405,24 @@ class RandomGhost(GhostAgent):
                 return [self._actions[action]]
 
 
+class NearestFoodPerception(pyafai.Perception):
+    """Distance (in steps) and direction to the nearest remaining food, as a
+    tuple (distance, action_name). Both are None if no food is reachable, and
+    the action is None when the agent is over food."""
+
+    def __init__(self):
+        super(NearestFoodPerception, self).__init__(tuple, 'nearest_food')
+        self.value = (None, None)
+
+    def update(self, agent):
+        field = agent.world.food_field
+        cell = agent.body.cell
+        self.value = (field.distance(cell), field.direction(cell))
+
+
 class KeyboardAgent(PacmanAgent):
+    ACTS_AT_CELL_CENTRES = True
+
     def __init__(self, x, y, cell):
         super(KeyboardAgent, self).__init__(x, y, cell)
 
@@ -431,38 +473,58 @@ class Food(pyafai.Object):
 
 
 class Dot(Food):
+    VALUE = 10
+
     def __init__(self, x, y, cell_size, batch):
         super(Dot, self).__init__(x, y)
 
-        self.value = 10
+        self.value = Dot.VALUE
 
-        half = cell_size / 2
-        shape = shapes.Rect(int(cell_size / 5), int(cell_size / 5), x * cell_size + half,
-                            y * cell_size + half,
-                            color=ColorConfig.DOT)
-        shape.add_to_batch(batch)
-        self._shapes.append(shape)
+        # Without a batch there is nothing to draw (headless)
+        if batch is not None:
+            half = cell_size / 2
+            shape = shapes.Rect(int(cell_size / 5), int(cell_size / 5), x * cell_size + half,
+                                y * cell_size + half,
+                                color=ColorConfig.DOT)
+            shape.add_to_batch(batch)
+            self._shapes.append(shape)
 
 
 class Pellet(Food):
+    VALUE = 50
+
     def __init__(self, x, y, cell_size, batch):
         super(Pellet, self).__init__(x, y)
 
-        self.value = 50
+        self.value = Pellet.VALUE
 
-        half = cell_size / 2
-        shape = shapes.Circle(half / 1.5, x * cell_size + half,
-                              y * cell_size + half,
-                              color=ColorConfig.PELLET)
-        shape.add_to_batch(batch)
-        self._shapes.append(shape)
+        if batch is not None:
+            half = cell_size / 2
+            shape = shapes.Circle(half / 1.5, x * cell_size + half,
+                                  y * cell_size + half,
+                                  color=ColorConfig.PELLET)
+            shape.add_to_batch(batch)
+            self._shapes.append(shape)
 
 
 class PacmanWorld(pyafai.World2DGrid):
     GAME_ACTIONS = [UpAction, DownAction, LeftAction, RightAction]
     NAME_TO_ACTION = dict([(a.name, a) for a in GAME_ACTIONS])
 
-    def __init__(self, cell_size, level_filename):
+    # The game advances in ticks of fixed duration
+    TICKS_PER_SECOND = 60
+    FIXED_DELTA = 1 / TICKS_PER_SECOND
+    MAX_TICKS_PER_UPDATE = 5
+
+    def __init__(self, cell_size, level_filename, headless=False,
+                 scheduled=False):
+        """
+        :param scheduled: Only update agents when they have something to do,
+            see _update_scheduled. Only headless worlds can be scheduled.
+        """
+        if scheduled and not headless:
+            raise ValueError("Only headless worlds can be scheduled")
+
         self.player = None
         self.game_over = False
         self.player_win = False
@@ -475,13 +537,34 @@ class PacmanWorld(pyafai.World2DGrid):
         self._food_count = 0
         self._valid_actions = None  # speedup for valid actions
         self._walls = None  # speedup for detection of walls
+        self._food = None   # Food object of each cell, or None
+        self.food_grid = None   # numpy bool array, True where there is food
         self._graph_display = None
         self._animate = True
+        self._headless = headless
+        self._level_graph = self.graph
+        self._distances = None
+        self._compact_graph = None
+        self._food_field = None
+        self._rules = None
+        self._next_uid = 0  # uid of the next agent spawned
+        self._scheduled = scheduled
+        self._due = {}      # tick -> {uid: agent} to update in that tick
+        self._arrivals = []     # heap of (tick, uid, agent) of moving bodies
+        self._arrival_ticks = {}    # uid -> tick the body arrives at
+        self._turn = None   # uid of the agent being updated, if any
+        self._current = None    # agents to update in the current tick
+        self._turns = None  # heap of their uids
+        self.ticks = 0
+        self._clock = 0     # time not yet run as ticks, see update
+        self.level_filename = level_filename
+        self.replay_log = None  # replay.ReplayLog recording this game
+        self.profile = None     # profiling.Profile timing this game
 
         # load level
-        grid = self._load_level(level_filename)
-        width = len(grid[0])
-        height = len(grid)
+        self._level = self._load_level(level_filename)
+        width = self._level.width
+        height = self._level.height
 
         # call superclass constructor
         super(PacmanWorld, self).__init__(width, height, cell_size,
@@ -490,36 +573,27 @@ class PacmanWorld(pyafai.World2DGrid):
 
         self.paused = False
 
+        if headless:
+            # Headless worlds are stepped explicitly, not by pyglet's clock
+            pyglet.clock.unschedule(self._start_schedule)
+
         # create objects from level data
-        self._walls = [[False for x in range(self.width)] for y in
-                       range(self.height)]
-        for y in range(len(grid)):
-            self._walls.append([])
-            for x in range(len(grid[y])):
-                if grid[y][x] == 'X':
-                    half = cell_size / 2
-                    shape = shapes.Rect(half, half, x * cell_size + half,
-                            y * cell_size + half,
-                            color=ColorConfig.WALL)
-                    shape.add_to_batch(self._batch)
-                    self._shapes.append(shape)
-                    self._walls[y][x] = True
-
-                elif grid[y][x] == '.':
-                    dot = Dot(x, y, cell_size, self._batch)
-                    self.add_object(dot)
-                    self._food_count += 1
-
-                elif grid[y][x] == 'O':
-                    pellet = Pellet(x, y, cell_size, self._batch)
-                    self.add_object(pellet)
-                    self._food_count += 1
-
-                elif grid[y][x] == 'P':
-                    self._player_start = (x, y)
-
-                elif grid[y][x] == 'G':
-                    self._ghost_start.append((x, y))
+        self._walls = self._level.walls.tolist()
+        if not headless:
+            half = cell_size / 2
+            for y, x in zip(*self._level.walls.nonzero()):
+                shape = shapes.Rect(half, half, x * cell_size + half,
+                        y * cell_size + half,
+                        color=ColorConfig.WALL)
+                shape.add_to_batch(self._batch)
+                self._shapes.append(shape)
+
+        self._food = [[None] * width for y in range(height)]
+        self._add_food()
+
+        self._player_start = tuple(self._level.player_start.tolist())
+        self._ghost_start = [tuple(p) for p in
+                             self._level.ghost_starts.tolist()]
 
         # generate static valid action map
         self._generate_valid_actions()
@@ -528,27 +602,168 @@ class PacmanWorld(pyafai.World2DGrid):
         self._generate_graph()
 
         # generate graph display
-        self._graph_display = GraphDisplay(self.graph, self)
+        if not headless:
+            self._graph_display = GraphDisplay(self.graph, self)
+
+    def _add_food(self):
+        # Place food on every cell of the level that should have food and
+        # does not have it.
+        food = self._level.food
+        batch = None if self._headless else self._batch
+        for y, x in zip(*food.nonzero()):
+            x = int(x)
+            y = int(y)
+            if self._food[y][x] is None:
+                if food[y, x] == levelcache.DOT:
+                    obj = Dot(x, y, self.cell, batch)
+                else:
+                    obj = Pellet(x, y, self.cell, batch)
+                self.add_object(obj)
+                self._food[y][x] = obj
+                self._food_count += 1
+        self.food_grid = food != levelcache.NO_FOOD
+        self._food_field = None
+
+    def reset(self):
+        """Restore the world to the start of the game: all agents are
+        removed, food is placed back and the game state is cleared. Agents
+        must then be spawned again.
+
+        Reusing a world this way is much cheaper than creating a new one,
+        since the level and its graphs are kept.
+        """
+        for agent in list(self._agents):
+            body = agent.body
+            self._remove_agent(agent)
+            agent.body = None
+            body.agent = None
+            self.remove_object(body)
+        self._dead_agents.clear()
+
+        self._add_food()
+        self.player = None
+        self.game_over = False
+        self.player_win = False
+        self.player_lives = 1
+        self.ticks = 0
+        self._clock = 0
+        self._next_uid = 0
+        self._reschedule()
 
-    def _load_level(self, filename):
-        grid = []
-        with open(filename, 'r', encoding='utf8') as f:
-            grid = [list(line.strip('\n')) for line in f.readlines()]
-            grid.reverse()
+    @property
+    def rules(self):
+        """The gamestate.GameRules of this world, built on first use."""
+        if self._rules is None:
+            width, height = self._width, self._height
+            pellets = 0
+            is_pellet = self._level.food == levelcache.PELLET
+            for y, x in zip(*np.nonzero(is_pellet)):
+                pellets |= 1 << (int(y) * width + int(x))
+            directions = dict((a.name, a.direction)
+                              for a in PacmanWorld.GAME_ACTIONS)
+            self._rules = gamestate.GameRules(
+                width, height, self._valid_actions, self._player_start,
+                self._ghost_start, pellets, Dot.VALUE, Pellet.VALUE,
+                AgentBody.TICKS_PER_CELL, AgentBody.TICKS_PER_CELL,
+                GhostBody.SCARED_TICKS_PER_CELL, directions)
+        return self._rules
+
+    def snapshot(self):
+        """Capture the state of the game as a compact gamestate.GameState,
+        that gamestate.step() can advance without the world. What the agents
+        have in mind, and the state of the random module, are not part of
+        it.
+        """
+        rules = self.rules
+        if self._scheduled:
+            self._sync_progress()
+        food = int.from_bytes(np.packbits(self.food_grid, axis=None,
+                                          bitorder='little').tobytes(),
+                              'little')
+        agents = []
+        for agent in self._agents:
+            body = agent.body
+            ghost = isinstance(agent, GhostAgent)
+            agents.append(gamestate.AgentState(
+                agent.uid, type(agent), ghost, agent.is_dead, body.x, body.y,
+                body.direction, body.target, body._progress,
+                body._move_ticks, ghost and agent.scared,
+                agent._scared_timer if ghost else 0,
+                0 if ghost else agent.score))
+
+        player = self.player
+        return gamestate.GameState(
+            rules, self.ticks, food, self._food_count, tuple(agents),
+            -1 if player is None else player.uid,
+            0 if player is None else player.score, self.player_lives,
+            self.game_over, self.player_win, self._next_uid)
+
+    def restore(self, state):
+        """Put the world in the given gamestate.GameState. Agents of the
+        state that are in the world keep their objects, the others are
+        created from their class with (x, y, cell), as when respawned."""
+        food = np.unpackbits(np.frombuffer(
+            state.food.to_bytes(self.food_grid.size // 8 + 1, 'little'),
+            dtype=np.uint8), bitorder='little')
+        food = food[:self.food_grid.size].reshape(self.food_grid.shape) > 0
+        if (food & ~self.food_grid).any():
+            self._add_food()
+        for y, x in zip(*np.nonzero(self.food_grid & ~food)):
+            self._remove_food(self._food[y][x])
+
+        # take the bodies out of the world, without discarding them
+        current = {}
+        for agent in self._agents:
+            body = agent.body
+            self._grid[body.y][body.x].remove(body)
+            self._objects.remove(body)
+            agent.world = None
+            current[agent.uid] = agent
+        self._agents = []
+        self._dead_agents.clear()
+        if self.player is not None and self.player.body is not None:
+            current.setdefault(self.player.uid, self.player)
+
+        player = None
+        for s in state.agents:
+            agent = current.get(s.uid)
+            if agent is None or type(agent) is not s.agent_class:
+                agent = s.agent_class(s.x, s.y, self.body_cell)
+                agent.uid = s.uid
+            body = agent.body
+            body.x = s.x
+            body.y = s.y
+            body._direction = s.direction
+            body._target = s.target
+            body._progress = s.progress
+            body._move_ticks = s.move_ticks
+            body.animate = self._animate
+            agent._dead = s.dead
+            if s.ghost:
+                agent.scared = s.scared
+                agent._scared_timer = s.scared_timer
+            else:
+                agent.score = s.score
+            self.add_agent(agent)
+            if s.uid == state.player:
+                player = agent
+
+        if player is None and self.player is not None and \
+                self.player.uid == state.player:
+            player = self.player
+        self.player = player
+        self.ticks = state.ticks
+        self.game_over = state.game_over
+        self.player_win = state.player_win
+        self.player_lives = state.player_lives
+        self._next_uid = state.next_uid
+        self._reschedule()
 
-        return grid
+    def _load_level(self, filename):
+        return levelcache.load_level(filename)
 
     def _generate_valid_actions(self):
-        self._valid_actions = []
-        for y in range(self.height):
-            self._valid_actions.append([])
-            for x in range(self.width):
-                self._valid_actions[y].append([])
-                if not self.has_wall_at(x, y):
-                    for action in PacmanWorld.GAME_ACTIONS:
-                        if not self.has_wall_at(x + action.direction[0],
-                                                y + action.direction[1]):
-                            self._valid_actions[y][x].append(action.name)
+        self._valid_actions = self._level.valid_action_names()
 
     def _generate_graph(self):
         self.graph.clear()
@@ -595,6 +810,47 @@ class PacmanWorld(pyafai.World2DGrid):
         else:
             return 0
 
+    @property
+    def distances(self):
+        """All-pairs distance table over the maze graph generated from the
+        level. It is only computed when first used."""
+        if self._distances is None:
+            self._distances = self._level.distance_table(self._level_graph)
+        return self._distances
+
+    @property
+    def compact_graph(self):
+        """The maze graph as a graph.CompactGraph, built on first use."""
+        if self._compact_graph is None:
+            self._compact_graph = graph.CompactGraph.from_grid(
+                self._level.walls, self._level.valid, levelcache.ACTIONS,
+                self._tor)
+        return self._compact_graph
+
+    @property
+    def food_field(self):
+        """A foodfield.FoodDistanceField over the maze, built on first use and
+        updated as food is eaten."""
+        if self._food_field is None:
+            cells = [(int(x), int(y)) for y, x in zip(*self.food_grid.nonzero())]
+            self._food_field = foodfield.FoodDistanceField(self.compact_graph,
+                                                           cells)
+        return self._food_field
+
+    @property
+    def food_count(self):
+        return self._food_count
+
+    @property
+    def headless(self):
+        return self._headless
+
+    @property
+    def body_cell(self):
+        """Cell size to give to new agent bodies. It is None when the world
+        is headless, so that bodies are created without shapes."""
+        return None if self._headless else self.cell
+
     @property
     def animate(self):
         return self._animate
@@ -606,6 +862,9 @@ class PacmanWorld(pyafai.World2DGrid):
             agent.body.animate = value
 
     def draw(self):
+        if self._headless:
+            return
+
         super(PacmanWorld, self).draw()
 
         if self.show_graph:
@@ -614,7 +873,7 @@ class PacmanWorld(pyafai.World2DGrid):
     def spawn_player(self, player_class, *args, **kwargs):
         if self.player is None or self.player.is_dead:
             self.player = player_class(self._player_start[0],
-                                       self._player_start[1], self.cell,
+                                       self._player_start[1], self.body_cell,
                                        *args, **kwargs)
             if isinstance(self.player, KeyboardAgent):
                 if self.keys is not None:
@@ -623,17 +882,28 @@ class PacmanWorld(pyafai.World2DGrid):
                     print("No key state dictionary has been set!")
 
             self.player.body.animate = self._animate
+            self.player.uid = self._next_uid
+            self._next_uid += 1
 
             self.add_agent(self.player)
+            if self.replay_log is not None:
+                self.replay_log.on_spawn(self.player, self._player_start)
         else:
             print("Only one player is allowed!")
 
     def spawn_ghost(self, ghost_class, *args, **kwargs):
-        location = random.choice(self._ghost_start)
-        ghost = ghost_class(location[0], location[1], self.cell,
+        location = self._choose_ghost_start()
+        ghost = ghost_class(location[0], location[1], self.body_cell,
                             *args, **kwargs)
         ghost.body.animate = self._animate
+        ghost.uid = self._next_uid
+        self._next_uid += 1
         self.add_agent(ghost)
+        if self.replay_log is not None:
+            self.replay_log.on_spawn(ghost, location)
+
+    def _choose_ghost_start(self):
+        return random.choice(self._ghost_start)
 
     def is_valid_action(self, agent, action):
         if action.name in self.get_valid_actions(agent):
@@ -659,7 +929,50 @@ class PacmanWorld(pyafai.World2DGrid):
         return valid
 
     def has_food_at(self, x, y):
-        return self.has_object_type_at(x, y, Food)
+        return self.get_food_at(x, y) is not None
+
+    def get_food_at(self, x, y):
+        """The Food object at cell (x, y), or None."""
+        if self._tor:
+            x = round(x) % self._width
+            y = round(y) % self._height
+
+        return self._food[round(y)][round(x)]
+
+    def count_food_in_region(self, x, y, width, height):
+        """Number of food items in the rectangle of cells with lower left
+        corner (x, y), clipped to the grid."""
+        x0 = max(x, 0)
+        y0 = max(y, 0)
+        return int(self.food_grid[y0:y + height, x0:x + width].sum())
+
+    def nearest_food(self, x, y):
+        """Find the food closest to cell (x, y), following the maze.
+
+        :return: A tuple ((x, y), distance), or None if no food is reachable.
+        """
+        maze = self.compact_graph
+        offsets, neighbours, _, _ = maze.csr_views()
+        food = self._food
+        start = maze.node_id((round(x) % self._width, round(y) % self._height))
+        if start < 0:
+            return None
+
+        distance = {start: 0}
+        frontier = deque([start])
+        while frontier:
+            node = frontier.popleft()
+            cx, cy = maze.node(node)
+            if food[cy][cx] is not None:
+                return (cx, cy), distance[node]
+
+            for i in range(offsets[node], offsets[node + 1]):
+                child = neighbours[i]
+                if child not in distance:
+                    distance[child] = distance[node] + 1
+                    frontier.append(child)
+
+        return None
 
     def has_wall_at(self, x, y):
         if self._tor:
@@ -669,36 +982,83 @@ class PacmanWorld(pyafai.World2DGrid):
         return self._walls[round(y)][round(x)]
 
     def eat_food_at(self, x, y):
-        l = self.get_cell_contents(x, y)
-        for obj in l:
-            if isinstance(obj, Food):
-                self.remove_object(obj)
-                self._food_count -= 1
-                if isinstance(obj, Pellet):
-                    self.scare_ghosts()
-                return obj
+        obj = self.get_food_at(x, y)
+        if obj is not None:
+            self._remove_food(obj)
+            if isinstance(obj, Pellet):
+                self.scare_ghosts()
+            return obj
+
+    def _remove_food(self, obj):
+        self.remove_object(obj)
+        self._food[obj.y][obj.x] = None
+        self.food_grid[obj.y, obj.x] = False
+        if self._food_field is not None:
+            self._food_field.remove((obj.x, obj.y))
+        self._food_count -= 1
 
     def scare_ghosts(self):
         for g in self._agents:
             if isinstance(g, GhostAgent):
                 g.scared = True
+                if self._scheduled:
+                    self._schedule(g, self.ticks)
 
     def kill_player(self):
         if self.player is not None:
             self.player.kill()
+            if self._scheduled:
+                self._schedule(self.player, self.ticks)
             self.player_lives -= 1
 
             if self.player_lives > 0:
                 self.spawn_player(type(self.player))
 
     def kill_ghost(self, ghost):
-        if ghost in self._agents:
+        # a ghost eaten earlier in the tick stays in the grid until the end
+        # of it, and must not be killed (and replaced) again
+        if ghost in self._agents and not ghost.is_dead:
             ghost.kill()
+            if self._scheduled:
+                self._schedule(ghost, self.ticks)
             self.spawn_ghost(type(ghost))
 
     def update(self, delta):
+        """Called by pyglet's clock with the time elapsed since the last
+        call. Runs as many ticks as fit in it, so that the game runs at
+        TICKS_PER_SECOND whatever the frame rate, and its outcome does not
+        depend on it."""
+        if self.paused:
+            return
+
+        self._clock += delta
+        ticks = int(self._clock / PacmanWorld.FIXED_DELTA + 0.5)
+        if ticks > PacmanWorld.MAX_TICKS_PER_UPDATE:
+            # too far behind, slow the game down instead of catching up
+            ticks = PacmanWorld.MAX_TICKS_PER_UPDATE
+            self._clock = 0
+        else:
+            self._clock -= ticks * PacmanWorld.FIXED_DELTA
+        for _ in range(ticks):
+            self.step()
+
+    def step(self):
+        """Advance the game by a single tick."""
         if not self.game_over:
-            super(PacmanWorld, self).update(delta)
+            profile = self.profile
+            if profile is not None:
+                start = profile.clock()
+
+            if self.replay_log is not None and not self.paused:
+                self.replay_log.on_tick(self)
+
+            if self._headless:
+                self._update_headless(PacmanWorld.FIXED_DELTA)
+            else:
+                super(PacmanWorld, self).update(PacmanWorld.FIXED_DELTA)
+
+            if not self.paused:
+                self.ticks += 1
 
             if self._food_count == 0:
                 self.game_over = True
@@ -707,6 +1067,243 @@ class PacmanWorld(pyafai.World2DGrid):
             if self.player_lives == 0:
                 self.game_over = True
 
+            if profile is not None:
+                profile.add(type(self), 'tick', profile.clock() - start)
+
+    def start_profile(self, profile=None):
+        """Start timing the game, see profiling.
+
+        :param profile: The profiling.Profile to add to. Defaults to a new
+            one, watching the graph and the compact graph of the world.
+        :return: The profile.
+        """
+        if profile is None:
+            profile = profiling.Profile()
+            profile.watch_graph('graph', self.graph)
+            profile.watch_graph('compact_graph', self.compact_graph)
+        if self.profile is not None:
+            self._untime_agents()
+        self.profile = profile
+        for agent in self._agents:
+            profile.time_methods(agent, agent.PROFILED_METHODS)
+        return profile
+
+    def stop_profile(self):
+        """Stop timing the game.
+
+        :return: The profile, or None if there was none.
+        """
+        profile = self.profile
+        self.profile = None
+        if profile is not None:
+            self._untime_agents()
+            profile.stop()
+        return profile
+
+    def _untime_agents(self):
+        for agent in self._agents:
+            profiling.Profile.untime_methods(agent, agent.PROFILED_METHODS)
+
+    def _update_headless(self, delta):
+        # Same as World2DGrid.update, but only agent bodies are updated, since
+        # food never moves and has nothing to draw.
+        if self.paused:
+            return
+
+        if self._scheduled:
+            self._update_scheduled(delta)
+            return
+
+        self.process_agents(delta)
+
+        profile = self.profile
+        if profile is not None:
+            start = profile.clock()
+
+        for agent in self._agents:
+            body = agent.body
+            self._grid[body.y][body.x].remove(body)
+
+            body.update(delta)
+
+            if body.x >= self._width or body.x < 0:
+                body.x %= self._width
+            if body.y >= self._height or body.y < 0:
+                body.y %= self._height
+
+            self._grid[body.y][body.x].append(body)
+
+        if profile is not None:
+            self._remove_dead_agents_timed(profile, start)
+        else:
+            self._remove_dead_agents()
+
+    def _update_scheduled(self, delta):
+        # _update_headless, with the same outcome, but agents are only updated
+        # in the ticks where they may do something: when their body is at a
+        # cell centre, when they share a cell with an agent they can eat or
+        # be eaten by, while scared, and when they die (to be removed at the
+        # same tick). Agents that may act at other times are updated in every
+        # tick, see PacmanAgent.ACTS_AT_CELL_CENTRES. Bodies are only updated
+        # when they arrive at their target, so their progress is only brought
+        # up to date on snapshots.
+        tick = self.ticks
+        current = self._due.pop(tick, {})
+        turns = list(current)
+        heapq.heapify(turns)
+        self._current = current
+        self._turns = turns
+
+        # agents are updated in the order of process_agents, which is the
+        # order of their uids
+        while turns:
+            uid = heapq.heappop(turns)
+            agent = current[uid]
+            if agent.world is not self:
+                continue
+            self._turn = uid
+
+            if not agent.is_dead:
+                body = agent.body
+                moving = body.target is not None
+                scared = isinstance(agent, GhostAgent) and agent.scared
+                agent.update(delta)
+                if not moving and body.target is not None:
+                    self._add_arrival(agent, tick + body._move_ticks - 1)
+                if body.target is None or scared or \
+                        not agent.ACTS_AT_CELL_CENTRES:
+                    self._schedule(agent, tick + 1)
+
+            if agent.is_dead:
+                self._dead_agents.append(agent)
+        self._turn = None
+        self._current = None
+        self._turns = None
+
+        profile = self.profile
+        if profile is not None:
+            start = profile.clock()
+
+        grid = self._grid
+        arrivals = self._arrivals
+        while arrivals and arrivals[0][0] <= tick:
+            agent = heapq.heappop(arrivals)[2]
+            del self._arrival_ticks[agent.uid]
+            if agent.world is not self:
+                continue
+            body = agent.body
+            grid[body.y][body.x].remove(body)
+
+            body._progress = body._move_ticks - 1
+            body.update(delta)
+            body.x %= self._width
+            body.y %= self._height
+
+            grid[body.y][body.x].append(body)
+            self._wake_cell(body.x, body.y, tick + 1)
+
+        if profile is not None:
+            self._remove_dead_agents_timed(profile, start)
+        else:
+            self._remove_dead_agents()
+
+    def _remove_dead_agents_timed(self, profile, start):
+        # the movement phase started at start, and ends here
+        moved = profile.clock()
+        self._remove_dead_agents()
+        profile.add(type(self), 'movement', moved - start)
+        profile.add(type(self), 'remove_dead', profile.clock() - moved)
+
+    def _schedule(self, agent, tick):
+        # Update agent at its turn in the given tick, or in the next one if
+        # its turn in the current tick is over.
+        if tick == self.ticks and self._turn is not None:
+            if agent.uid > self._turn:
+                if agent.uid not in self._current:
+                    self._current[agent.uid] = agent
+                    heapq.heappush(self._turns, agent.uid)
+                return
+            tick += 1
+
+        due = self._due.get(tick)
+        if due is None:
+            due = self._due[tick] = {}
+        due[agent.uid] = agent
+
+    def _wake_cell(self, x, y, tick):
+        for obj in self._grid[y][x]:
+            if obj.is_body:
+                self._schedule(obj.agent, tick)
+
+    def _add_arrival(self, agent, tick):
+        heapq.heappush(self._arrivals, (tick, agent.uid, agent))
+        self._arrival_ticks[agent.uid] = tick
+
+    def _reschedule(self):
+        # Start the schedule over from the agents in the world: all are
+        # updated in the next tick, and moving bodies arrive as their
+        # progress says.
+        self._due = {}
+        self._arrivals = []
+        self._arrival_ticks = {}
+        if self._scheduled:
+            for agent in self._agents:
+                self._schedule(agent, self.ticks)
+                body = agent.body
+                if body.target is not None:
+                    self._add_arrival(agent, self.ticks + body._move_ticks -
+                                      body._progress - 1)
+
+    def _sync_progress(self):
+        for agent in self._agents:
+            body = agent.body
+            if body.target is not None:
+                body._progress = (self.ticks + body._move_ticks - 1 -
+                                  self._arrival_ticks[agent.uid])
+
+    def add_agent(self, agent):
+        super(PacmanWorld, self).add_agent(agent)
+        if self.profile is not None:
+            self.profile.time_methods(agent, agent.PROFILED_METHODS)
+        if self._scheduled and agent.body is not None:
+            self._wake_cell(agent.body.x, agent.body.y, self.ticks)
+
+    def draw_objects(self):
+        # Bodies are drawn at their render position, which is part of the way
+        # to their target when animated.
+        cell = self.cell
+        half = cell / 2
+        for obj in self._objects:
+            x = obj.x
+            y = obj.y
+            if obj.is_body:
+                rx, ry = obj.render_position
+            else:
+                rx, ry = x, y
+            obj.x = rx * cell + half
+            obj.y = ry * cell + half
+            obj.draw()
+            obj.x = x
+            obj.y = y
+
+    def run(self, max_ticks=None):
+        """Step the world until the game is over, or until max_ticks ticks
+        have been executed. A paused world does not advance, so it returns
+        at once, without executing any tick.
+
+        :return: The number of ticks executed.
+        """
+        if self.paused:
+            return 0
+
+        start = self.ticks
+        while not self.game_over:
+            if max_ticks is not None and self.ticks - start >= max_ticks:
+                break
+            self.step()
+
+        return self.ticks - start
+
 
 class PacmanDisplay(pyafai.Display):
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,183 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Opt-in profiling of pac-man games. A Profile attached to a PacmanWorld with
+PacmanWorld.start_profile() accumulates the number of calls and the time spent
+in each phase of the ticks of the world and of the updates of its agents, by
+class, along with the nodes expanded and visited in the graphs it watches.
+Worlds without a profile only check that they have none.
+
+The phases are:
+
+- world: tick (all of it), movement (of the bodies) and remove_dead. The last
+  two are only timed in headless worlds;
+- agents: update (all of it), perceptions, think, record (recording the
+  decisions), eat_food and eat_ghosts for players, and eat_player for ghosts
+  (with the countdown of the scare timer).
+
+The phases of agents are timed by wrapping their methods, on each agent,
+while the world is profiled (see Profile.time_methods), so that agents run
+their usual code, and nothing is wrapped when the world is not profiled.
+
+Typical use::
+
+    profile = world.start_profile()
+    world.run(10000)
+    world.stop_profile()
+    print(profile.report())
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+from collections import namedtuple
+import time
+
+
+PHASES = ['tick', 'movement', 'remove_dead', 'update', 'perceptions', 'think',
+          'record', 'eat_food', 'eat_ghosts', 'eat_player']
+
+PhaseStats = namedtuple('PhaseStats', ['owner', 'phase', 'calls', 'seconds'])
+
+
+class Profile(object):
+    """Calls and time of each phase, by owner (the class of the world or of
+    the agent), and graph counters since the graphs started being watched."""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self._phases = {}   # (owner, phase) -> [calls, seconds]
+        self._graphs = []   # [name, graph, start counters, end counters]
+
+    def add(self, owner, phase, seconds):
+        """Count a call of a phase that took the given time."""
+        entry = self._phases.get((owner, phase))
+        if entry is None:
+            entry = self._phases[(owner, phase)] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def timed(self, function, owner, phase):
+        """function, wrapped so that each call is counted as a call of a
+        phase."""
+        clock = self.clock
+        add = self.add
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add(owner, phase, clock() - start)
+
+        return timed
+
+    def time_methods(self, obj, methods):
+        """Time the calls of methods of obj, owned by its class, until
+        untime_methods(obj, methods). The timed methods are set as attributes
+        of obj, over those of its class. Methods already timed are left as
+        they are.
+
+        :param methods: List of (method name, phase).
+        """
+        owner = type(obj)
+        attributes = vars(obj)
+        for name, phase in methods:
+            if name not in attributes:
+                setattr(obj, name, self.timed(getattr(obj, name), owner,
+                                              phase))
+
+    @staticmethod
+    def untime_methods(obj, methods):
+        """Stop timing the methods of obj timed with time_methods()."""
+        attributes = vars(obj)
+        for name, _ in methods:
+            attributes.pop(name, None)
+
+    def watch_graph(self, name, graph):
+        """Report the nodes expanded and visited in a graph.Graph from now
+        on. Watching the same graph again does nothing."""
+        for watched in self._graphs:
+            if watched[1] is graph:
+                return
+        self._graphs.append([name, graph, (graph.expanded_counter,
+                                           graph.visited_counter), None])
+
+    def stop(self):
+        """Stop counting the work of the watched graphs."""
+        for watched in self._graphs:
+            if watched[3] is None:
+                graph = watched[1]
+                watched[3] = (graph.expanded_counter, graph.visited_counter)
+
+    def reset(self):
+        """Clear all timings, and restart the graph counters."""
+        self._phases.clear()
+        for watched in self._graphs:
+            graph = watched[1]
+            watched[2] = (graph.expanded_counter, graph.visited_counter)
+            watched[3] = None
+
+    def stats(self):
+        """List of PhaseStats, by owner and in the order of PHASES. Owners
+        are class names."""
+        order = dict((phase, i) for i, phase in enumerate(PHASES))
+        stats = [PhaseStats(_name(owner), phase, calls, seconds)
+                 for (owner, phase), (calls, seconds) in self._phases.items()]
+        stats.sort(key=lambda s: (s.owner, order.get(s.phase, len(order)),
+                                  s.phase))
+        return stats
+
+    def graph_counters(self):
+        """Dictionary from the name of each watched graph to the number of
+        nodes (expanded, visited) in it."""
+        counters = {}
+        for name, graph, start, end in self._graphs:
+            if end is None:
+                end = (graph.expanded_counter, graph.visited_counter)
+            counters[name] = (end[0] - start[0], end[1] - start[1])
+        return counters
+
+    def as_dict(self):
+        """The profile as a JSON serializable dictionary."""
+        return {'phases': [s._asdict() for s in self.stats()],
+                'graphs': dict((name, {'expanded': e, 'visited': v})
+                               for name, (e, v) in
+                               self.graph_counters().items())}
+
+    def report(self):
+        """A table of the timings, with the share of the time of the ticks
+        taken by each phase, followed by the graph counters."""
+        stats = self.stats()
+        total = sum(s.seconds for s in stats if s.phase == 'tick')
+        lines = ['{:<16} {:<12} {:>10} {:>12} {:>10} {:>7}'.format(
+            'owner', 'phase', 'calls', 'total ms', 'us/call', '% tick')]
+        for s in stats:
+            per_call = s.seconds / s.calls * 1e6 if s.calls else 0
+            share = s.seconds / total * 100 if total else 0
+            lines.append('{:<16} {:<12} {:>10} {:>12.2f} {:>10.2f} '
+                         '{:>7.1f}'.format(s.owner, s.phase, s.calls,
+                                           s.seconds * 1e3, per_call, share))
+
+        counters = self.graph_counters()
+        if counters:
+            lines.append('')
+            lines.append('{:<29} {:>10} {:>12}'.format('graph', 'expanded',
+                                                       'visited'))
+            for name in sorted(counters):
+                expanded, visited = counters[name]
+                lines.append('{:<29} {:>10} {:>12}'.format(name, expanded,
+                                                           visited))
+
+        return '\n'.join(lines)
+
+
+def _name(owner):
+    return getattr(owner, '__name__', str(owner))
@@ -0,0 +1,228 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Binary, columnar recordings of game play. A recording is a directory with a
+schema.json file and one raw binary file per column. Rows are buffered and
+appended to the column files in chunks, so memory use does not grow with the
+length of the recording, and the reader memory maps the columns, so only the
+rows that are used are read.
+
+Numeric columns (int, float and bool) are stored as such. Any other values,
+such as action names, are stored as int32 codes into a list of categories
+kept in the schema.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+from io import open
+import json
+import os
+import tempfile
+import numpy as np
+
+
+FORMAT_VERSION = 1
+SCHEMA_FILE = 'schema.json'
+
+_DTYPES = {int: '<i4', float: '<f8', bool: '|i1'}
+CATEGORY_DTYPE = '<i4'
+
+
+def _column_file(index):
+    return 'column{}.bin'.format(index)
+
+
+def _to_json(value):
+    if isinstance(value, tuple):
+        return [_to_json(v) for v in value]
+    return value
+
+
+def _from_json(value):
+    if isinstance(value, list):
+        return tuple(_from_json(v) for v in value)
+    return value
+
+
+class RecordingWriter(object):
+    """Write rows to a recording directory, in chunks of chunk_size rows.
+    The schema is rewritten at each chunk, so a recording that is not closed
+    still holds every row up to the last chunk written.
+    """
+
+    def __init__(self, path, columns, chunk_size=4096):
+        """
+        :param path: Directory of the recording. It is created if needed, and
+            an existing recording in it is replaced.
+        :param columns: List of (name, type). Columns of type int, float or
+            bool are numeric, any other type is stored as categories.
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self._names = [name for name, _ in columns]
+        self._dtypes = [_DTYPES.get(t, CATEGORY_DTYPE) for _, t in columns]
+        self._categories = [None if t in _DTYPES else {} for _, t in columns]
+        self._buffer = [[] for _ in columns]
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._files = [open(os.path.join(path, _column_file(i)), 'wb')
+                       for i in range(len(columns))]
+        self._write_schema()
+
+    def append(self, row):
+        """Add a row, with one value per column."""
+        for value, column, categories in zip(row, self._buffer,
+                                             self._categories):
+            if categories is not None:
+                code = categories.get(value)
+                if code is None:
+                    code = len(categories)
+                    categories[value] = code
+                value = code
+            column.append(value)
+
+        if len(self._buffer[0]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows to disk."""
+        n = len(self._buffer[0]) if self._buffer else 0
+        if n == 0:
+            return
+
+        for values, dtype, f in zip(self._buffer, self._dtypes, self._files):
+            np.asarray(values, dtype=dtype).tofile(f)
+            f.flush()
+            del values[:]
+        self.rows += n
+        self._write_schema()
+
+    def close(self):
+        if self._files is not None:
+            self.flush()
+            for f in self._files:
+                f.close()
+            self._files = None
+
+    def _write_schema(self):
+        columns = []
+        for name, dtype, categories in zip(self._names, self._dtypes,
+                                           self._categories):
+            column = {'name': name, 'dtype': dtype}
+            if categories is not None:
+                values = sorted(categories, key=categories.get)
+                column['categories'] = [_to_json(v) for v in values]
+            columns.append(column)
+        schema = {'version': FORMAT_VERSION, 'rows': self.rows,
+                  'columns': columns}
+
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(schema, f)
+        os.replace(tmp, os.path.join(self.path, SCHEMA_FILE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Recording(object):
+    """Read a recording, memory mapping its columns."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, SCHEMA_FILE), 'r', encoding='utf8') as f:
+            schema = json.load(f)
+        if schema['version'] != FORMAT_VERSION:
+            raise ValueError("Unsupported recording version: " +
+                             str(schema['version']))
+
+        self.path = path
+        self.rows = schema['rows']
+        self.columns = [c['name'] for c in schema['columns']]
+        self._index = dict((name, i) for i, name in enumerate(self.columns))
+        self._categories = [None if 'categories' not in c else
+                            [_from_json(v) for v in c['categories']]
+                            for c in schema['columns']]
+        self._data = []
+        for i, c in enumerate(schema['columns']):
+            if self.rows:
+                data = np.memmap(os.path.join(path, _column_file(i)),
+                                 dtype=c['dtype'], mode='r',
+                                 shape=(self.rows,))
+            else:
+                data = np.zeros(0, dtype=c['dtype'])
+            self._data.append(data)
+
+    def __len__(self):
+        return self.rows
+
+    def column(self, name):
+        """The stored values of a column, as a memory mapped array. For
+        categorical columns these are codes into categories(name)."""
+        return self._data[self._index[name]]
+
+    def categories(self, name):
+        """List of category values of a column, or None if it is numeric."""
+        return self._categories[self._index[name]]
+
+    def values(self, name):
+        """The values of a column as a list, with categories decoded."""
+        categories = self.categories(name)
+        if categories is None:
+            return self.column(name).tolist()
+        return [categories[code] for code in self.column(name).tolist()]
+
+    def rows_of(self, columns, encodings=None, rows=None):
+        """A RecordingRows view of the given columns.
+
+        :param encodings: Optional dictionary from the name of a categorical
+            column to a 2D array with the feature vector of each category.
+        :param rows: Optional array of the row indices to include.
+        """
+        return RecordingRows(self, columns, encodings, rows)
+
+
+class RecordingRows(object):
+    """Selected columns of a recording as rows of float features, read on
+    demand. Indexing with an integer array returns a 2D NumPy array with one
+    row per index, so it can be used as the data of NNFeedForward.train
+    without loading the whole recording.
+    """
+
+    def __init__(self, recording, columns, encodings=None, rows=None):
+        encodings = encodings or {}
+        self._columns = [(recording.column(name),
+                          None if name not in encodings else
+                          np.asarray(encodings[name], dtype=float))
+                         for name in columns]
+        self._rows = None if rows is None else np.asarray(rows)
+        self._len = len(recording) if rows is None else len(self._rows)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        index = np.asarray(index)
+        if self._rows is not None:
+            index = self._rows[index]
+
+        parts = []
+        for data, encoding in self._columns:
+            values = data[index]
+            if encoding is None:
+                parts.append(values.astype(float).reshape(-1, 1))
+            else:
+                parts.append(encoding[values].reshape(len(values), -1))
+        return np.hstack(parts)
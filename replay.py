@@ -0,0 +1,252 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Deterministic replay of pac-man games. A ReplayLog attached to a PacmanWorld
+records the level, the random seed, the number of ticks played, where each
+agent was spawned and every action executed by each agent. A Replayer plays
+the log back in a headless world at full speed, with agents that repeat the
+logged actions instead of thinking, so games with human or non-deterministic
+players are reproduced exactly. Snapshots of the world are taken
+periodically, so that the replay can seek to any tick.
+
+Typical use::
+
+    world = pacman.PacmanWorld(20, 'levels/medium.txt')
+    log = replay.start_log(world)
+    world.spawn_player(...)
+    ...
+    log.save('game.replay.npz')
+
+    replayer = replay.Replayer(replay.ReplayLog.load('game.replay.npz'))
+    replayer.seek(1000)
+    print(replayer.world.score)
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import json
+import os
+import random
+import numpy as np
+import pacman
+
+
+FORMAT_VERSION = 2
+
+ACTIONS = [a.name for a in pacman.PacmanWorld.GAME_ACTIONS]
+PLAYER = 0
+GHOST = 1
+
+
+class ReplayLog(object):
+    """The log of a game. Ticks are numbered from 0, and agents are
+    identified by their uid, which is their number in spawn order.
+
+    - ticks: number of ticks played;
+    - spawns: list of (tick, external, kind, x, y), with kind PLAYER or
+      GHOST. External spawns were made by the caller before the tick, the
+      others by the world itself during the tick (respawns);
+    - actions: list of (tick, agent id, action index into ACTIONS).
+    """
+
+    def __init__(self, level_filename, seed, player_lives=1):
+        self.level_filename = level_filename
+        self.seed = seed
+        self.player_lives = player_lives
+        self.ticks = 0
+        self.spawns = []
+        self.actions = []
+        self._action_ids = dict((name, i) for i, name in enumerate(ACTIONS))
+
+    def on_tick(self, world):
+        if self.ticks == 0:
+            self.player_lives = world.player_lives
+        self.ticks += 1
+
+    def on_spawn(self, agent, location):
+        tick = agent.world.ticks
+        external = int(tick == self.ticks)
+        kind = GHOST if isinstance(agent, pacman.GhostAgent) else PLAYER
+        self.spawns.append((tick, external, kind, location[0], location[1]))
+
+    def on_action(self, agent, name):
+        self.actions.append((self.ticks - 1, agent.uid,
+                             self._action_ids[name]))
+
+    def save(self, filename):
+        meta = json.dumps({'version': FORMAT_VERSION,
+                           'level_filename': self.level_filename,
+                           'seed': self.seed,
+                           'player_lives': self.player_lives,
+                           'ticks': self.ticks})
+        np.savez_compressed(filename, meta=np.array(meta),
+                            spawns=np.array(self.spawns,
+                                            dtype=np.int64).reshape(-1, 5),
+                            actions=np.array(self.actions,
+                                             dtype=np.int64).reshape(-1, 3))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['version'] != FORMAT_VERSION:
+                raise ValueError("Unsupported replay log version: " +
+                                 str(meta['version']))
+            log = cls(meta['level_filename'], meta['seed'],
+                      meta['player_lives'])
+            log.ticks = meta['ticks']
+            log.spawns = [tuple(s) for s in data['spawns'].tolist()]
+            log.actions = [tuple(a) for a in data['actions'].tolist()]
+
+        return log
+
+
+def start_log(world, seed=None):
+    """Seed the random module and start logging a game. Must be called
+    before any agent is spawned.
+
+    :param seed: Defaults to a random seed.
+    :return: The ReplayLog, which keeps growing as the game is played.
+    """
+    if world._next_uid != 0:
+        raise ValueError("The log must start before any agent is spawned")
+    if seed is None:
+        seed = int.from_bytes(os.urandom(4), 'little')
+    random.seed(seed)
+    world.replay_log = ReplayLog(world.level_filename, seed,
+                                 world.player_lives)
+    return world.replay_log
+
+
+class ReplayPacman(pacman.PacmanAgent):
+    """A player that repeats its logged actions."""
+
+    # actions logged while moving had no effect
+    ACTS_AT_CELL_CENTRES = True
+
+    def _think(self, delta):
+        return self.world.logged_actions(self)
+
+
+class ReplayGhost(pacman.GhostAgent):
+    """A ghost that repeats its logged actions."""
+
+    ACTS_AT_CELL_CENTRES = True
+
+    def _think(self, delta):
+        return self.world.logged_actions(self)
+
+
+class ReplayWorld(pacman.PacmanWorld):
+    """A headless world that plays back a ReplayLog, one tick per step()."""
+
+    def __init__(self, log):
+        super(ReplayWorld, self).__init__(20, log.level_filename,
+                                          headless=True, scheduled=True)
+        self.log = log
+
+        self._actions = {}
+        for tick, agent_id, action in log.actions:
+            self._actions.setdefault((tick, agent_id), []).append(
+                ACTIONS[action])
+
+        random.seed(log.seed)
+        self._spawn_external()
+        self.player_lives = log.player_lives
+
+    @property
+    def finished(self):
+        """True when every logged tick has been played."""
+        return self.ticks >= self.log.ticks
+
+    def logged_actions(self, agent):
+        names = self._actions.get((self.ticks, agent.uid), ())
+        return [agent._actions[name] for name in names]
+
+    def _choose_ghost_start(self):
+        # ghosts appear where they appeared in the logged game
+        x, y = self.log.spawns[self._next_uid][3:]
+        return x, y
+
+    def _spawn_external(self):
+        # Spawn the agents the caller spawned before the current tick. The
+        # others are spawned again by the world itself.
+        spawns = self.log.spawns
+        while self._next_uid < len(spawns):
+            tick, external, kind = spawns[self._next_uid][:3]
+            if tick != self.ticks or not external:
+                break
+            if kind == PLAYER:
+                self.spawn_player(ReplayPacman)
+            else:
+                self.spawn_ghost(ReplayGhost)
+
+    def step(self):
+        """Play the next logged tick."""
+        if not self.finished:
+            super(ReplayWorld, self).step()
+            self._spawn_external()
+
+    def run(self, max_ticks=None):
+        start = self.ticks
+        while not self.finished and not self.game_over:
+            if max_ticks is not None and self.ticks - start >= max_ticks:
+                break
+            self.step()
+
+        return self.ticks - start
+
+
+class Replayer(object):
+    """Fast-forward and seek through a ReplayLog.
+
+    A snapshot of the world is kept every snapshot_interval ticks as the
+    replay advances, so seeking backwards only replays the ticks since the
+    closest snapshot.
+    """
+
+    def __init__(self, log, snapshot_interval=1000):
+        self.world = ReplayWorld(log)
+        self.snapshot_interval = snapshot_interval
+        self._snapshots = {0: self.world.snapshot()}
+
+    @property
+    def tick(self):
+        return self.world.ticks
+
+    def run(self, until=None):
+        """Replay until the given tick, or to the end of the log.
+
+        :return: The world.
+        """
+        world = self.world
+        interval = self.snapshot_interval
+        while not world.finished and not world.game_over:
+            if until is not None and world.ticks >= until:
+                break
+            world.step()
+            if world.ticks % interval == 0 and \
+                    world.ticks not in self._snapshots:
+                self._snapshots[world.ticks] = world.snapshot()
+
+        return world
+
+    def seek(self, tick):
+        """Bring the world to the state it had after the given number of
+        ticks.
+
+        :return: The world.
+        """
+        start = max(t for t in self._snapshots if t <= tick)
+        if self.world.ticks > tick or start > self.world.ticks:
+            self.world.restore(self._snapshots[start])
+
+        return self.run(until=tick)
@@ -0,0 +1,127 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Run many full pac-man games in parallel, over a pool of processes. Each
+episode runs in a headless PacmanWorld, seeded from the episode number, so
+results are reproducible regardless of the number of processes used.
+
+Player and ghost classes must be importable from a module (not defined in
+__main__ when using the spawn start method), so that they can be sent to the
+worker processes.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+# Workers never open a window
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import collections
+import functools
+import multiprocessing
+import random
+import pacman
+
+
+# Worlds kept by each process for reuse, by level file name
+_worlds = {}
+
+
+EpisodeResult = collections.namedtuple('EpisodeResult',
+                                       ['episode', 'seed', 'score',
+                                        'player_win', 'ticks',
+                                        'food_remaining'])
+
+
+def get_world(level_filename):
+    """A headless world for the level, ready for a new game. The world is
+    created on the first call and reset on the following ones."""
+    world = _worlds.get(level_filename)
+    if world is None:
+        world = pacman.PacmanWorld(20, level_filename, headless=True,
+                                   scheduled=True)
+        _worlds[level_filename] = world
+    else:
+        world.reset()
+
+    return world
+
+
+def run_episode(level_filename, player_class, ghost_classes, seed,
+                episode=0, player_args=(), player_lives=1, max_ticks=None,
+                reuse_world=False):
+    """Play a single game in a headless world until it is over, or until
+    max_ticks ticks have passed.
+
+    :param reuse_world: Play in the world kept by get_world, instead of
+        creating a new one.
+    :return: An EpisodeResult.
+    """
+    random.seed(seed)
+
+    if reuse_world:
+        world = get_world(level_filename)
+    else:
+        world = pacman.PacmanWorld(20, level_filename, headless=True,
+                                   scheduled=True)
+    world.spawn_player(player_class, *player_args)
+    for ghost_class in ghost_classes:
+        world.spawn_ghost(ghost_class)
+    world.player_lives = player_lives
+
+    world.run(max_ticks)
+
+    return EpisodeResult(episode, seed, world.score, world.player_win,
+                         world.ticks, world.food_count)
+
+
+def _run_task(kwargs, task):
+    episode, seed = task
+    return run_episode(seed=seed, episode=episode, reuse_world=True, **kwargs)
+
+
+def run_episodes(level_filename, player_class, ghost_classes, n_episodes,
+                 seed=0, processes=None, player_args=(), player_lives=1,
+                 max_ticks=None):
+    """Run n_episodes games over a process pool, yielding an EpisodeResult
+    for each one as soon as it finishes (not necessarily in order).
+
+    :param seed: Base seed. Episode i is seeded with seed + i.
+    :param processes: Number of worker processes. Defaults to the number of
+        cores.
+    """
+    kwargs = dict(level_filename=level_filename, player_class=player_class,
+                  ghost_classes=list(ghost_classes), player_args=player_args,
+                  player_lives=player_lives, max_ticks=max_ticks)
+    tasks = [(i, seed + i) for i in range(n_episodes)]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(functools.partial(_run_task, kwargs),
+                                          tasks):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main():
+    results = list(run_episodes('levels/pacman.txt', pacman.PacmanAgent,
+                                [pacman.RandomGhost] * 4, 100,
+                                max_ticks=10000))
+    wins = sum(1 for r in results if r.player_win)
+    print("Episodes:", len(results), "Wins:", wins)
+    print("Average score:", sum(r.score for r in results) / len(results))
+    print("Average ticks:", sum(r.ticks for r in results) / len(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,560 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Search algorithms over graph.Graph: breadth-first, uniform-cost, greedy
+best-first and A*. Every search returns a SearchResult, whose path is a list
+of action names that can be used directly as the _path of a search agent, along
+with the number of nodes expanded and visited (as counted by the graph) and the
+wall time of the query.
+
+Searches over a graph.CompactGraph use its node ids internally, without
+building connection tuples.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+from collections import deque, namedtuple
+import heapq
+import itertools
+import time
+import graph as graph_module
+
+
+SearchResult = namedtuple('SearchResult', ['path', 'cost', 'expanded',
+                                           'visited', 'time'])
+
+
+def manhattan(node, goal):
+    return abs(node[0] - goal[0]) + abs(node[1] - goal[1])
+
+
+def torus_manhattan(width, height):
+    """Manhattan distance on a grid that wraps around its edges."""
+    def heuristic(node, goal):
+        dx = abs(node[0] - goal[0])
+        dy = abs(node[1] - goal[1])
+        return min(dx, width - dx) + min(dy, height - dy)
+
+    return heuristic
+
+
+def world_heuristic(world):
+    """Manhattan heuristic for the cells of a pacman.PacmanWorld, taking the
+    wrap around of toroidal worlds into account."""
+    if world._tor:
+        return torus_manhattan(world.grid_width, world.grid_height)
+    return manhattan
+
+
+class _Problem(object):
+    # Adapts a graph.Graph to the search loops below
+
+    def __init__(self, graph, start, goal, goal_test, heuristic,
+                 with_actions):
+        self.graph = graph
+        self.start = start
+        if goal_test is None:
+            goal_test = lambda node: node == goal
+        self.is_goal = goal_test
+        if heuristic is None:
+            self.h = lambda node: 0
+        else:
+            self.h = lambda node: heuristic(node, goal)
+        if with_actions:
+            get = graph.get_connections
+            self.successors = lambda node: [(c[0] + (c[2],), c[1], c[2])
+                                            for c in get(node)]
+        else:
+            self.successors = graph.get_connections
+        self.counters = (graph.expanded_counter, graph.visited_counter)
+
+    def result(self, parents, node, cost, start_time):
+        path = None
+        if node is not None:
+            path = []
+            while parents[node] is not None:
+                node, action = parents[node]
+                path.append(action)
+            path.reverse()
+
+        return SearchResult(path, cost,
+                            self.graph.expanded_counter - self.counters[0],
+                            self.graph.visited_counter - self.counters[1],
+                            time.perf_counter() - start_time)
+
+
+class _CompactProblem(object):
+    # Same as _Problem, for a graph.CompactGraph. Nodes are handled as ids and
+    # per search state is kept in flat lists indexed by id.
+
+    def __init__(self, graph, start, goal, goal_test, heuristic,
+                 with_actions):
+        if with_actions:
+            raise ValueError("with_actions is not supported by CompactGraph "
+                             "searches")
+
+        self.graph = graph
+        self.start = graph.node_id(start)
+        # node_id is -1 for cells that are not nodes, such as walls
+        self.unreachable = self.start < 0
+        if goal_test is None:
+            goal_id = graph.node_id(goal)
+            self.unreachable = self.unreachable or goal_id < 0
+            self.is_goal = lambda key: key == goal_id
+        else:
+            node = graph.node
+            self.is_goal = lambda key: goal_test(node(key))
+        if heuristic is None:
+            self.h = lambda key: 0
+        else:
+            node = graph.node
+            self.h = lambda key: heuristic(node(key), goal)
+
+        n = len(graph)
+        self.parents = [-1] * n
+        self.actions = [-1] * n
+        self.expanded = 0
+        self.visited = 0
+
+    def result(self, key, cost, start_time):
+        path = None
+        if key is not None:
+            names = self.graph.action_names
+            path = []
+            while key != self.start:
+                path.append(names[self.actions[key]])
+                key = self.parents[key]
+            path.reverse()
+
+        self.graph.add_to_counters(self.expanded, self.visited)
+        return SearchResult(path, cost, self.expanded, self.visited,
+                            time.perf_counter() - start_time)
+
+
+def breadth_first(graph, start, goal=None, goal_test=None,
+                  with_actions=False):
+    """Breadth-first search. Finds the path with the fewest actions.
+
+    :param graph: The graph to search.
+    :param start: The start node.
+    :param goal: The goal node.
+    :param goal_test: Optional function of a node, used instead of comparing
+        with goal (e.g. to accept a cell in any direction).
+    :param with_actions: If True, search nodes are (x, y, last_action)
+        states, as expected by ex02_search.GhostGraph. The node reached by a
+        connection is its destination plus the action name.
+    :return: A SearchResult, with path None if the goal is unreachable.
+    """
+    start_time = time.perf_counter()
+    if isinstance(graph, graph_module.CompactGraph):
+        return _breadth_first_compact(graph, start, goal, goal_test,
+                                      with_actions, start_time)
+
+    problem = _Problem(graph, start, goal, goal_test, None, with_actions)
+    node = problem.start
+    parents = {node: None}
+    depth = {node: 0}
+    if problem.is_goal(node):
+        return problem.result(parents, node, 0, start_time)
+
+    frontier = deque([node])
+    while frontier:
+        node = frontier.popleft()
+        for child, _, action in problem.successors(node):
+            if child not in parents:
+                parents[child] = (node, action)
+                depth[child] = depth[node] + 1
+                if problem.is_goal(child):
+                    return problem.result(parents, child, depth[child],
+                                          start_time)
+                frontier.append(child)
+
+    return problem.result(parents, None, None, start_time)
+
+
+def _breadth_first_compact(graph, start, goal, goal_test, with_actions,
+                           start_time):
+    problem = _CompactProblem(graph, start, goal, goal_test, None,
+                              with_actions)
+    offsets, neighbours, _, actions = graph.csr_views()
+    parents = problem.parents
+    parent_actions = problem.actions
+    is_goal = problem.is_goal
+    depth = [0] * len(graph)
+    seen = bytearray(len(graph))
+    if problem.unreachable:
+        return problem.result(None, None, start_time)
+
+    key = problem.start
+    seen[key] = 1
+    if is_goal(key):
+        return problem.result(key, 0, start_time)
+
+    frontier = deque([key])
+    while frontier:
+        key = frontier.popleft()
+        begin = offsets[key]
+        end = offsets[key + 1]
+        problem.visited += 1
+        problem.expanded += end - begin
+        for i in range(begin, end):
+            child = neighbours[i]
+            if not seen[child]:
+                seen[child] = 1
+                parents[child] = key
+                parent_actions[child] = actions[i]
+                depth[child] = depth[key] + 1
+                if is_goal(child):
+                    return problem.result(child, depth[child], start_time)
+                frontier.append(child)
+
+    return problem.result(None, None, start_time)
+
+
+def _best_first(graph, start, goal, goal_test, heuristic, with_actions,
+                use_cost, use_h):
+    start_time = time.perf_counter()
+    if isinstance(graph, graph_module.CompactGraph):
+        return _best_first_compact(graph, start, goal, goal_test, heuristic,
+                                   with_actions, use_cost, use_h, start_time)
+
+    problem = _Problem(graph, start, goal, goal_test, heuristic, with_actions)
+    h = problem.h
+
+    node = problem.start
+    parents = {node: None}
+    costs = {node: 0}
+    closed = set()
+    tie = itertools.count()
+    frontier = [(h(node) if use_h else 0, next(tie), node)]
+
+    while frontier:
+        _, _, node = heapq.heappop(frontier)
+        if node in closed:
+            continue
+        if problem.is_goal(node):
+            return problem.result(parents, node, costs[node], start_time)
+        closed.add(node)
+
+        cost = costs[node]
+        for child, weight, action in problem.successors(node):
+            if child in closed:
+                continue
+            child_cost = cost + weight
+            if use_cost:
+                if child in costs and costs[child] <= child_cost:
+                    continue
+            elif child in costs:
+                continue
+
+            costs[child] = child_cost
+            parents[child] = (node, action)
+            priority = 0
+            if use_cost:
+                priority += child_cost
+            if use_h:
+                priority += h(child)
+            heapq.heappush(frontier, (priority, next(tie), child))
+
+    return problem.result(parents, None, None, start_time)
+
+
+def _best_first_compact(graph, start, goal, goal_test, heuristic,
+                        with_actions, use_cost, use_h, start_time):
+    problem = _CompactProblem(graph, start, goal, goal_test, heuristic,
+                              with_actions)
+    offsets, neighbours, weights, actions = graph.csr_views()
+    parents = problem.parents
+    parent_actions = problem.actions
+    is_goal = problem.is_goal
+    h = problem.h
+    costs = [None] * len(graph)
+    closed = bytearray(len(graph))
+    if problem.unreachable:
+        return problem.result(None, None, start_time)
+
+    key = problem.start
+    costs[key] = 0
+    tie = itertools.count()
+    frontier = [(h(key) if use_h else 0, next(tie), key)]
+
+    while frontier:
+        _, _, key = heapq.heappop(frontier)
+        if closed[key]:
+            continue
+        if is_goal(key):
+            return problem.result(key, costs[key], start_time)
+        closed[key] = 1
+
+        cost = costs[key]
+        begin = offsets[key]
+        end = offsets[key + 1]
+        problem.visited += 1
+        problem.expanded += end - begin
+        for i in range(begin, end):
+            child = neighbours[i]
+            if closed[child]:
+                continue
+            child_cost = cost + weights[i]
+            if costs[child] is not None and \
+                    (not use_cost or costs[child] <= child_cost):
+                continue
+
+            costs[child] = child_cost
+            parents[child] = key
+            parent_actions[child] = actions[i]
+            priority = 0
+            if use_cost:
+                priority += child_cost
+            if use_h:
+                priority += h(child)
+            heapq.heappush(frontier, (priority, next(tie), child))
+
+    return problem.result(None, None, start_time)
+
+
+def uniform_cost(graph, start, goal=None, goal_test=None, with_actions=False):
+    """Uniform-cost search (Dijkstra). Finds the path with the lowest cost."""
+    return _best_first(graph, start, goal, goal_test, None, with_actions,
+                       True, False)
+
+
+def greedy(graph, start, goal=None, goal_test=None, heuristic=manhattan,
+           with_actions=False):
+    """Greedy best-first search, guided only by the heuristic. Fast, but the
+    path found is not necessarily the shortest."""
+    return _best_first(graph, start, goal, goal_test, heuristic, with_actions,
+                       False, True)
+
+
+def astar(graph, start, goal=None, goal_test=None, heuristic=manhattan,
+          with_actions=False):
+    """A* search. Finds the path with the lowest cost if the heuristic is
+    admissible and consistent. In toroidal worlds use world_heuristic(world)
+    or torus_manhattan(), since plain manhattan overestimates across the
+    wrap-around."""
+    return _best_first(graph, start, goal, goal_test, heuristic, with_actions,
+                       True, True)
+
+
+class FringeRetrievingAStar(object):
+    """Incremental A* for a hunter chasing a moving target on a static graph
+    (Fringe-Retrieving A*, Sun, Yeoh and Koenig, 2009).
+
+    The search tree of the previous plan is kept. When the hunter has moved
+    along the planned path, the subtree rooted at its new node still holds
+    exact costs, so only the rest of the tree is discarded and its fringe
+    retrieved as the new open list. A* then resumes towards the current goal,
+    usually expanding only a few nodes around the target's new position, or
+    none at all if the target moved into the already searched region.
+
+    Costs are stored relative to the first root, and open list keys are
+    corrected lazily for the moves of the target (like the key modifier of
+    D* Lite), so neither re-rooting nor a new goal touches the whole tree.
+    Every node is added and discarded at most once per expansion, which keeps
+    the amortized cost per plan proportional to the nodes it expands.
+
+    If the hunter ends up outside the kept tree (e.g. it was respawned), the
+    planner simply starts a new search.
+
+    The expanded and visited counts of each SearchResult are those of the
+    nodes expanded by that call only.
+    """
+
+    def __init__(self, graph, heuristic=manhattan, goal_key=None,
+                 with_actions=False):
+        """
+        :param graph: The graph to search. Connections are assumed static.
+        :param heuristic: Consistent heuristic function of (node, goal).
+        :param goal_key: Optional function mapping a node to the value that
+            is compared with the goal (e.g. lambda node: node[:2] to chase a
+            cell with GhostGraph states).
+        :param with_actions: Search (x, y, last_action) states, see
+            breadth_first().
+        """
+        self.graph = graph
+        self._heuristic = heuristic
+        self._goal_key = goal_key if goal_key is not None else lambda n: n
+        if with_actions:
+            get = graph.get_connections
+            self._get_successors = lambda node: [(c[0] + (c[2],), c[1], c[2])
+                                                 for c in get(node)]
+        else:
+            self._get_successors = graph.get_connections
+
+        # Connections never change, so they are cached along with the
+        # expanded predecessors of each node, used to retrieve the fringe.
+        self._successors = {}
+        self._predecessors = {}
+        self.reset()
+
+    def reset(self):
+        """Forget the previous search."""
+        self._root = None
+        self._goal = None
+        self._offset = 0    # cost of the root, relative to the first root
+        self._key_offset = 0    # sum of the heuristic moves of the goal
+        self._g = {}
+        self._parents = {}
+        self._children = {}
+        self._closed = set()
+        self._closed_keys = {}
+        self._open = set()
+        self._heap = []
+        self._tie = itertools.count()
+
+    def _expand(self, node):
+        successors = self._successors.get(node)
+        if successors is None:
+            successors = list(self._get_successors(node))
+            self._successors[node] = successors
+            for child, weight, action in successors:
+                self._predecessors.setdefault(child, []).append(
+                    (node, weight, action))
+        return successors
+
+    def _relax(self, node, parent, cost, action):
+        old = self._parents.get(node)
+        if old is not None:
+            self._children[old[0]].discard(node)
+        self._parents[node] = (parent, action)
+        self._children.setdefault(parent, set()).add(node)
+        self._g[node] = cost
+        self._open.add(node)
+        self._push(node)
+
+    def _push(self, node):
+        cost = self._g[node]
+        key = cost + self._heuristic(node, self._goal) + self._key_offset
+        heapq.heappush(self._heap, (key, next(self._tie), cost, node))
+
+    def _start(self, start):
+        self.reset()
+        self._root = start
+        self._g[start] = 0
+        self._parents[start] = None
+        self._open.add(start)
+
+    def _reroot(self, start):
+        # Discard everything outside the subtree of the new root
+        discarded = [self._root]
+        i = 0
+        while i < len(discarded):
+            for child in self._children.get(discarded[i], ()):
+                if child != start:
+                    discarded.append(child)
+            i += 1
+
+        self._children[self._parents[start][0]].discard(start)
+        self._parents[start] = None
+        self._root = start
+        self._offset = self._g[start]
+
+        for node in discarded:
+            del self._g[node]
+            del self._parents[node]
+            self._children.pop(node, None)
+            self._open.discard(node)
+            if node in self._closed:
+                self._closed.remove(node)
+                self._closed_keys[self._goal_key(node)].discard(node)
+
+        # Retrieve the fringe: discarded nodes that are successors of nodes
+        # still closed become open again.
+        for node in discarded:
+            for parent, weight, action in self._predecessors.get(node, ()):
+                if parent in self._closed:
+                    cost = self._g[parent] + weight
+                    if cost < self._g.get(node, float('inf')):
+                        self._relax(node, parent, cost, action)
+
+        if len(self._heap) > 4 * len(self._open) + 64:
+            self._heap = []
+            for node in self._open:
+                self._push(node)
+
+    def plan(self, start, goal):
+        """Plan a path from start to goal, reusing the previous search if
+        start lies in its tree (e.g. it is the node reached by following the
+        previously returned path).
+
+        :return: A SearchResult, with path None if goal is unreachable.
+        """
+        start_time = time.perf_counter()
+        expanded = 0
+        visited = 0
+        h = self._heuristic
+
+        if start != self._root and start not in self._closed:
+            self._start(start)
+            self._goal = goal
+            self._push(start)
+        else:
+            if goal != self._goal:
+                # Heuristic values may drop by up to h(old goal, new goal), so
+                # keys pushed before are only lower bounds after this offset.
+                self._key_offset += h(self._goal, goal)
+                self._goal = goal
+            if start != self._root:
+                self._reroot(start)
+
+        # Best goal node that has already been expanded, if any
+        best = None
+        for node in self._closed_keys.get(goal, ()):
+            if best is None or self._g[node] < self._g[best]:
+                best = node
+
+        heap = self._heap
+        while heap:
+            key, _, cost, node = heap[0]
+            if node not in self._open or self._g[node] != cost:
+                heapq.heappop(heap)
+                continue
+
+            # Make the key exact before acting on it
+            exact = cost + h(node, goal) + self._key_offset
+            if exact > key:
+                heapq.heapreplace(heap, (exact, next(self._tie), cost, node))
+                continue
+
+            if best is not None and cost + h(node, goal) >= self._g[best]:
+                break
+            if self._goal_key(node) == goal:
+                best = node
+                break
+
+            heapq.heappop(heap)
+            self._open.remove(node)
+            self._closed.add(node)
+            self._closed_keys.setdefault(self._goal_key(node), set()).add(node)
+            successors = self._expand(node)
+            visited += 1
+            expanded += len(successors)
+            for child, weight, action in successors:
+                if child in self._closed:
+                    continue
+                child_cost = cost + weight
+                if child_cost < self._g.get(child, float('inf')):
+                    self._relax(child, node, child_cost, action)
+
+        path = None
+        cost = None
+        if best is not None:
+            cost = self._g[best] - self._offset
+            path = []
+            node = best
+            while self._parents[node] is not None:
+                node, action = self._parents[node]
+                path.append(action)
+            path.reverse()
+
+        return SearchResult(path, cost, expanded, visited,
+                            time.perf_counter() - start_time)
@@ -0,0 +1,126 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of BatchPacmanWorld against PacmanWorld games played with the same
+actions and the same random choices of the ghosts.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import numpy as np
+import pytest
+import batchworld
+import pacman
+import replay
+
+
+LEVELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels')
+
+ACTIONS = batchworld.BatchPacmanWorld.ACTIONS
+
+
+class ScriptedPacman(pacman.PacmanAgent):
+    # Executes the action of the tick, if any, chosen before the tick. A
+    # player respawned during the tick executes the same action.
+    action = batchworld.BatchPacmanWorld.NO_ACTION
+
+    def _think(self, delta):
+        if self.action != batchworld.BatchPacmanWorld.NO_ACTION:
+            return [self._actions[ACTIONS[self.action]]]
+
+
+def _choose_action(world, rng):
+    # mostly towards the nearest food, so that pellets and ghosts get eaten
+    if rng.random_sample() < 0.2:
+        return rng.randint(-1, 4)
+    direction = world.food_field.direction(world.player.body.cell)
+    if direction is None:
+        return batchworld.BatchPacmanWorld.NO_ACTION
+    return ACTIONS.index(direction)
+
+
+class LoggedBatchWorld(batchworld.BatchPacmanWorld):
+    # A single game, whose ghosts start and move as logged in a world
+
+    def __init__(self, level_filename, n_ghosts, player_lives, log):
+        # the world must be stepped before the batch, to log its choices
+        self._log = log
+        self._logged = 0
+        self._moves = {}
+        super(LoggedBatchWorld, self).__init__(level_filename, 1, n_ghosts,
+                                               player_lives)
+
+    def _choose_ghost_starts(self, games, uids):
+        starts = [tuple(s) for s in self._ghost_start.tolist()]
+        return np.array([starts.index(tuple(self._log.spawns[uid][3:]))
+                         for uid in uids])
+
+    def _choose_ghost_actions(self, games, uids, valid):
+        actions = self._log.actions
+        for tick, uid, a in actions[self._logged:]:
+            self._moves[(tick, uid)] = ACTIONS.index(replay.ACTIONS[a])
+        self._logged = len(actions)
+        return np.array([self._moves[(self.ticks[g], uid)]
+                         for g, uid in zip(games, uids)])
+
+
+def _world_state(world):
+    # a ghost eaten after its turn in the tick is only removed in the next
+    ghosts = sorted((a.uid, a.body.x, a.body.y) for a in world._agents
+                    if isinstance(a, pacman.GhostAgent) and not a.is_dead)
+    # the cell of the player is only compared while it is alive
+    player = world.player
+    return ((player.body.x, player.body.y) if world.player_lives else None,
+            [(x, y) for _, x, y in ghosts], world.food_grid.tolist(),
+            world.score, world.player_lives, world.game_over)
+
+
+def _batch_state(batch):
+    order = np.argsort(batch.guid[0])
+    return ((batch.px[0], batch.py[0]) if batch.lives[0] else None,
+            [(batch.gx[0, j], batch.gy[0, j]) for j in order],
+            (batch.food[0] > 0).tolist(), batch.score[0], batch.lives[0],
+            batch.game_over[0])
+
+
+# in all these games pellets and ghosts are eaten and the player dies; the
+# last two are won
+@pytest.mark.parametrize('level,seed,n_ghosts', [('pacman.txt', 0, 4),
+                                                 ('medium.txt', 0, 4),
+                                                 ('medium.txt', 4, 4),
+                                                 ('maze.txt', 1, 8)])
+def test_matches_world(level, seed, n_ghosts):
+    filename = os.path.join(LEVELS, level)
+    rng = np.random.RandomState(seed)
+    random.seed(seed)
+    world = pacman.PacmanWorld(20, filename, headless=True)
+    log = replay.start_log(world, seed)
+    world.player_lives = 3
+    world.spawn_player(ScriptedPacman)
+    for _ in range(n_ghosts):
+        world.spawn_ghost(pacman.RandomGhost)
+    batch = LoggedBatchWorld(filename, n_ghosts, 3, log)
+    assert _batch_state(batch) == _world_state(world)
+
+    while not world.game_over and world.ticks < 5000:
+        score, lives = world.score, world.player_lives
+        ScriptedPacman.action = _choose_action(world, rng)
+        world.step()
+        reward, over = batch.step([ScriptedPacman.action])
+        assert _batch_state(batch) == _world_state(world), world.ticks
+        assert over[0] == world.game_over
+        if world.player_lives == lives:
+            assert reward[0] == world.score - score
+    assert batch.ticks[0] == world.ticks
@@ -0,0 +1,118 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of DistanceTable against breadth-first searches.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import numpy as np
+import pytest
+import benchmark
+import distances
+import graph
+import levelcache
+import pacman
+import search
+
+
+LEVELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels')
+
+
+class NarrowTable(distances.DistanceTable):
+    # overflows int8 on graphs with more than 128 nodes, like int16 does on
+    # graphs with more than 32768 nodes
+    DISTANCE_DTYPES = (np.int8, np.int16)
+
+
+def _maze():
+    # a tree, so that the longest paths are long
+    level = levelcache.CompiledLevel.from_grid(
+        benchmark.generate_maze(31, 31, loops=0))
+    return graph.CompactGraph.from_grid(level.walls, level.valid,
+                                        levelcache.ACTIONS)
+
+
+def _check(g, table, goals_per_node=4):
+    # Compares the table with breadth-first searches from every node, to
+    # some random goals and to an unreachable one if there is any.
+    rng = random.Random(0)
+    nodes = sorted(g.get_nodes())
+    assert len(table) == len(nodes)
+    for start in nodes:
+        goals = rng.sample(nodes, goals_per_node)
+        unreachable = [goal for goal in nodes
+                       if table.distance(start, goal) is None]
+        if unreachable:
+            goals.append(rng.choice(unreachable))
+        for goal in goals:
+            path = search.breadth_first(g, start, goal).path
+            if path is None:
+                assert table.distance(start, goal) is None
+                assert table.first_action(start, goal) is None
+                assert table.path(start, goal) is None
+                continue
+            assert table.distance(start, goal) == len(path)
+            assert table.first_action(start, goal) == \
+                (path[0] if path else None)
+            # the path of the table is a shortest one, that reaches goal
+            node = start
+            for action in table.path(start, goal):
+                node = [c[0] for c in g.get_connections(node)
+                        if c[2] == action][0]
+            assert node == goal
+            assert len(table.path(start, goal)) == len(path)
+
+
+@pytest.mark.parametrize('level', ['box.txt', 'maze.txt', 'pacman.txt',
+                                   'medium.txt'])
+def test_levels(level):
+    world = pacman.PacmanWorld(20, os.path.join(LEVELS, level),
+                               headless=True)
+    _check(world.graph, distances.DistanceTable(world.graph))
+
+
+def test_unreachable():
+    # some cells of pacman.txt cannot reach others
+    world = pacman.PacmanWorld(20, os.path.join(LEVELS, 'pacman.txt'),
+                               headless=True)
+    table = distances.DistanceTable(world.graph)
+    assert (table.distances == distances.DistanceTable.UNREACHABLE).any()
+
+    # a one way connection, and a node without connections
+    g = graph.Graph()
+    g.add_node((0, 0), [((1, 0), 1, 'right')])
+    g.add_node((1, 0), [])
+    g.add_node((5, 5), [])
+    table = distances.DistanceTable(g)
+    assert table.distance((0, 0), (1, 0)) == 1
+    assert table.distance((1, 0), (0, 0)) is None
+    assert table.distance((5, 5), (0, 0)) is None
+    _check(g, table, goals_per_node=3)
+
+
+def test_overflow():
+    maze = _maze()
+    table = NarrowTable(maze)
+    assert table.distances.dtype == np.int16
+    assert table.distances.max() > np.iinfo(np.int8).max
+    assert (table.distances == distances.DistanceTable(maze).distances).all()
+    _check(maze, table)
+
+    world = pacman.PacmanWorld(20, os.path.join(LEVELS, 'medium.txt'),
+                               headless=True)
+    table = NarrowTable(world.graph)
+    assert table.distances.dtype == np.int8
+    _check(world.graph, table)
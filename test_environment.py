@@ -0,0 +1,91 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of the reinforcement learning environment, against observations rebuilt
+from its world after each step.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import numpy as np
+import pytest
+import environment
+import pacman
+
+
+LEVEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels',
+                     'pacman.txt')
+
+
+def _observation(env):
+    world = env.world
+    obs = np.zeros_like(env.observation)
+    obs[environment.WALLS] = world._level.walls
+    for y, x in zip(*world.food_grid.nonzero()):
+        if isinstance(world._food[y][x], pacman.Pellet):
+            obs[environment.PELLETS, y, x] = 1
+        else:
+            obs[environment.DOTS, y, x] = 1
+    for agent in world._agents:
+        if agent.is_dead:
+            continue
+        x, y = agent.body.cell
+        if isinstance(agent, pacman.GhostAgent):
+            channel = environment.SCARED_GHOSTS if agent.scared else \
+                environment.GHOSTS
+        else:
+            channel = environment.PLAYER
+        obs[channel, y, x] += 1
+    return obs
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_episode(seed):
+    env = environment.PacmanEnv(LEVEL, player_lives=3, max_ticks=5000)
+    actions = random.Random(seed)
+    obs = env.reset(seed=seed)
+    assert (obs == _observation(env)).all()
+    # every player is seen, since a respawned one can act at once
+    players = [env.world.player]
+    total = 0
+    done = False
+    while not done:
+        obs, reward, done, info = env.step(actions.randrange(env.n_actions))
+        total += reward
+        assert (obs == _observation(env)).all(), env.world.ticks
+        if env.world.player is not players[-1]:
+            players.append(env.world.player)
+    assert info['lives'] == 0 and not info['truncated']
+    assert len(players) == 3
+    assert total == sum(player.score for player in players) > 0
+
+
+def test_truncation_and_stepping_after_done():
+    env = environment.PacmanEnv(LEVEL, ghost_classes=(), max_ticks=300)
+    env.reset(seed=0)
+    actions = random.Random(0)
+    done = False
+    while not done:
+        obs, _, done, info = env.step(actions.randrange(env.n_actions))
+    assert info['truncated'] and not env.world.game_over
+    assert info['ticks'] == 300
+
+    before = obs.copy()
+    obs, reward, done, info = env.step(0)
+    assert (reward, done, info['ticks']) == (0, True, 300)
+    assert (obs == before).all()
+
+    assert (env.reset(seed=0) == _observation(env)).all()
+    assert not env.done
@@ -0,0 +1,112 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of the compiled knowledge bases of ex03_kb.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import glob
+import random
+import pytest
+import ex03_kb
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+KB_FILE = os.path.join(HERE, 'ex03_kb_test.txt')
+
+
+@pytest.fixture
+def cache_home(tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir))
+    return str(tmpdir)
+
+
+def test_cache_round_trip(cache_home):
+    engine, bodies, facts = ex03_kb.compile_kb(KB_FILE, use_cache=False)
+    ex03_kb.compile_kb(KB_FILE)
+    path = ex03_kb.kb_cache_path(KB_FILE)
+    assert path.startswith(cache_home)
+    assert os.path.exists(path)
+
+    cached, cached_bodies, cached_facts = ex03_kb.compile_kb(KB_FILE)
+    assert vars(cached) == vars(engine)
+    assert cached_bodies == bodies
+    assert cached_facts == facts
+
+
+def test_cache_not_in_source_tree(cache_home):
+    ex03_kb.compile_kb(KB_FILE)
+    assert not glob.glob(os.path.join(HERE, '*.kbcache'))
+
+
+def test_broken_cache_is_rebuilt(cache_home):
+    engine = ex03_kb.compile_kb(KB_FILE, use_cache=False)[0]
+    path = ex03_kb.kb_cache_path(KB_FILE)
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write('{"engine": ')
+    assert vars(ex03_kb.compile_kb(KB_FILE)[0]) == vars(engine)
+
+
+def _random_engine(rng, n_base=6, n_derived=14, n_rules=30):
+    # Derived atoms have levels, and only negate atoms of lower levels, so
+    # that the rules can be stratified. Positive cycles are allowed.
+    atoms = ['b{}'.format(i) for i in range(n_base)] + \
+        ['d{}'.format(i) for i in range(n_derived)]
+    level = [0] * n_base + [rng.randint(1, 3) for _ in range(n_derived)]
+    heads = []
+    bodies = []
+    for _ in range(n_rules):
+        head = rng.randrange(n_base, len(atoms))
+        pos = [a for a in range(len(atoms)) if level[a] <= level[head]]
+        neg = [a for a in range(len(atoms)) if level[a] < level[head]]
+        body = [(False, rng.choice(pos)) for _ in range(rng.randint(0, 3))]
+        body += [(True, rng.choice(neg)) for _ in range(rng.randint(0, 2))]
+        heads.append(head)
+        bodies.append(body)
+    return ex03_kb.RuleEngine(atoms, heads, bodies), atoms[:n_base]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_working_memory_matches_run(seed):
+    rng = random.Random(seed)
+    engine, base = _random_engine(rng)
+    memory = ex03_kb.WorkingMemory(engine, range(len(engine)))
+    asserted = []
+    for _ in range(40):
+        if asserted and rng.random() < 0.5:
+            memory.retract_atom(asserted.pop(rng.randrange(len(asserted))))
+        else:
+            atom = rng.choice(base)
+            asserted.append(atom)
+            memory.assert_atom(atom)
+        memory.update()
+
+        true, fired = engine.run(asserted)
+        assert memory.true_atoms() == true
+        assert memory.active_watched == set(fired)
+
+
+def test_recompute_matches_update():
+    rng = random.Random(0)
+    engine, base = _random_engine(rng)
+    memory = ex03_kb.WorkingMemory(engine, range(len(engine)), base[:3])
+    memory.assert_atom(base[3])
+    memory.retract_atom(base[0])
+    memory.update()
+    true, active = memory.true_atoms(), set(memory.active_watched)
+    memory.recompute()
+    assert memory.true_atoms() == true
+    assert memory.active_watched == active
@@ -0,0 +1,114 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of the feed forward neural network.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import math
+import random
+import numpy as np
+import pytest
+import ex04_nn
+
+
+def _layer(weights, inputs):
+    # a layer neuron by neuron, each with the bias weight last
+    inputs = list(inputs) + [1]
+    return [1 / (1 + math.e ** -sum(w * i for w, i in zip(row, inputs)))
+            for row in weights]
+
+
+def _feed_forward(weights, shape, inputs):
+    n_in, n_hidden, n_out = shape
+    n = n_hidden * (n_in + 1)
+    hidden = [weights[i:i + n_in + 1] for i in range(0, n, n_in + 1)]
+    out = [weights[i:i + n_hidden + 1]
+           for i in range(n, len(weights), n_hidden + 1)]
+    return _layer(out, _layer(hidden, inputs))
+
+
+def test_feed_forward():
+    shape = (5, 4, 3)
+    rng = random.Random(0)
+    weights = [rng.uniform(-3, 3) for _ in range(4 * 6 + 3 * 5)]
+    net = ex04_nn.NNFeedForward(*shape)
+    net.set_weights(weights)
+    inputs = [[rng.randint(0, 1) for _ in range(5)] for _ in range(7)]
+
+    outputs = net.feed_forward(inputs[0])
+    assert isinstance(outputs, list)
+    assert outputs == pytest.approx(_feed_forward(weights, shape, inputs[0]))
+
+    outputs = net.feed_forward(np.array(inputs))
+    assert outputs.shape == (7, 3)
+    for row, x in zip(outputs.tolist(), inputs):
+        assert row == pytest.approx(_feed_forward(weights, shape, x))
+
+
+def _weights(net):
+    return np.concatenate((net._hidden._weights.ravel(),
+                           net._out._weights.ravel()))
+
+
+def test_batch_gradient():
+    random.seed(0)
+    net = ex04_nn.NNFeedForward(3, 4, 2)
+    rng = np.random.RandomState(0)
+    data = np.column_stack((rng.uniform(-1, 1, (6, 3)),
+                            rng.randint(2, size=(6, 2))))
+    x, t = data[:, :3], data[:, 3:]
+    weights = _weights(net)
+
+    # train minimizes half the squared error, summed over the outputs and
+    # averaged over the examples
+    def cost(w):
+        net.set_weights(w)
+        return 0.5 * t.shape[1] * net.loss(x, t)
+
+    eps = 1e-6
+    gradient = np.zeros_like(weights)
+    for i in range(len(weights)):
+        step = np.zeros_like(weights)
+        step[i] = eps
+        gradient[i] = (cost(weights + step) - cost(weights - step)) / (2 * eps)
+
+    # a single batch with a rate of 1 and no momentum moves the weights by
+    # minus the gradient
+    net.set_weights(weights)
+    net.train(data, 1.0, epochs=1, batch_size=len(data), momentum=0.0)
+    assert np.allclose(weights - _weights(net), gradient, atol=1e-8)
+
+
+def test_training_and_early_stopping():
+    random.seed(0)
+    rng = np.random.RandomState(0)
+    x = rng.uniform(-1, 1, (200, 2))
+    y = (x[:, 0] > x[:, 1]).astype(float)
+    data = np.column_stack((x, y))
+    net = ex04_nn.NNFeedForward(2, 4, 1)
+    history = net.train(data, 0.5, epochs=2000, momentum=0.9,
+                        validation=0.25, patience=5, seed=0)
+
+    assert history[-1][0] < history[0][0] / 10
+    losses = [val_loss for _, val_loss in history]
+    best = int(np.argmin(losses))
+    # stopped after patience epochs without improvement
+    assert len(history) == best + 6 < 2000
+    # with the best weights, held out as by train
+    val_rows = np.random.RandomState(0).permutation(len(data))[:50]
+    assert np.isclose(net.loss(x[val_rows], y[val_rows, None]), losses[best])
+    outputs = np.array(net.feed_forward(x))[:, 0]
+    assert ((outputs > 0.5) == (y > 0.5)).mean() > 0.95
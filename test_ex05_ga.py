@@ -0,0 +1,103 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of the genetic algorithms.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import numpy as np
+import pytest
+import ex05_ga
+import test_ex04_nn
+
+
+LEVEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels',
+                     'medium.txt')
+
+
+def _fitness(ga, ind):
+    # the fitness of an individual, from its network on each test case
+    nn = ex05_ga.NNFeedForward(*ga._shape)
+    nn.set_weights(ind)
+    return sum(abs(nn.feed_forward(inputs)[0] - target)
+               for inputs, target in ga._test)
+
+
+def test_feed_forward():
+    # same as the network of ex04_nn
+    shape = (2, 2, 1)
+    rng = random.Random(0)
+    weights = [rng.uniform(-10, 10) for _ in range(9)]
+    nn = ex05_ga.NNFeedForward(*shape)
+    nn.set_weights(weights)
+    for x in ([0, 1], [1, 1]):
+        assert nn.feed_forward(x) == pytest.approx(
+            test_ex04_nn._feed_forward(weights, shape, x))
+    outputs = nn.feed_forward(np.array([[0, 0], [1, 0]]))
+    assert outputs.shape == (2, 1)
+    assert outputs[:, 0].tolist() == pytest.approx(
+        [test_ex04_nn._feed_forward(weights, shape, x)[0]
+         for x in ([0, 0], [1, 0])])
+
+
+def test_population_fitness():
+    random.seed(0)
+    ga = ex05_ga.GA(20)
+    individuals = [p[0] for p in ga._population]
+    fitness = ga.population_fitness(individuals)
+    assert fitness.shape == (20,)
+    for ind, f in zip(individuals, fitness.tolist()):
+        assert f == pytest.approx(_fitness(ga, ind))
+    assert ga.fitness(individuals[3]) == pytest.approx(fitness[3])
+
+
+@pytest.mark.parametrize('prob_cx', [0.0, 1.0])
+def test_cached_fitness_stays_valid(prob_cx):
+    random.seed(1)
+    ga = ex05_ga.GA(20)
+    ga._prob_cx = prob_cx
+    ga._prob_m = 0.5
+    ga.run(5)
+    # elites kept the fitness computed in earlier generations
+    for ind, f in ga._population:
+        assert f == pytest.approx(_fitness(ga, ind))
+
+    # offspring are new lists, so mutating them leaves the parents alone
+    p1, p2 = ga._population[0][0], ga._population[1][0]
+    before = (p1[:], p2[:])
+    ga._prob_m = 1.0
+    for child in ga.cross_over(p1, p2):
+        assert child is not p1 and child is not p2
+        ga.mutate(child)
+    assert (p1, p2) == before
+
+
+def _pacman_run(processes):
+    random.seed(0)
+    ga = ex05_ga.PacmanGA(4, LEVEL, episodes=2, max_ticks=1000,
+                          processes=processes)
+    # the tournaments take the whole population, so the offspring all come
+    # from the best individual, and their fitness may well be the same
+    fitness = ga.population_fitness([ind for ind, _ in ga._population])
+    _, best = ga.run(1)
+    return fitness.tolist(), best, ga._population
+
+
+def test_pacman_pool_matches_serial():
+    fitness, best, population = _pacman_run(1)
+    assert len(set(fitness)) > 1
+    assert _pacman_run(2) == (fitness, best, population)
+    assert best == min(f for _, f in population)
@@ -0,0 +1,78 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of FoodDistanceField against a breadth-first search from all the food
+left, after each food is removed.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+from collections import deque
+import random
+import pytest
+import foodfield
+import pacman
+
+
+LEVELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels')
+
+
+def _distances(maze, food):
+    # multi-source breadth-first search from the food cells
+    distance = dict((cell, 0) for cell in food)
+    frontier = deque(food)
+    while frontier:
+        cell = frontier.popleft()
+        for child, _, _ in maze.get_connections(cell):
+            if child not in distance:
+                distance[child] = distance[cell] + 1
+                frontier.append(child)
+    return distance
+
+
+@pytest.mark.parametrize('level', ['box.txt', 'maze.txt', 'pacman.txt',
+                                   'medium.txt'])
+def test_matches_breadth_first(level):
+    world = pacman.PacmanWorld(20, os.path.join(LEVELS, level),
+                               headless=True)
+    maze = world.compact_graph
+    food = [(int(x), int(y)) for y, x in zip(*world.food_grid.nonzero())]
+    field = foodfield.FoodDistanceField(maze, food)
+    random.Random(0).shuffle(food)
+    cells = maze.get_nodes()
+
+    while True:
+        expected = _distances(maze, food)
+        for cell in cells:
+            d = field.distance(cell)
+            assert d == expected.get(cell), cell
+            if d:
+                # the direction leads one step closer
+                step = [dest for dest, _, action in maze.get_connections(cell)
+                        if action == field.direction(cell)]
+                assert field.distance(step[0]) == d - 1
+            if d is not None:
+                assert expected[field.nearest(cell)] == 0
+        if not food:
+            break
+        field.remove(food.pop())
+
+
+def test_remove_without_food():
+    world = pacman.PacmanWorld(20, os.path.join(LEVELS, 'box.txt'),
+                               headless=True)
+    maze = world.compact_graph
+    field = foodfield.FoodDistanceField(maze, [])
+    assert field.remove(maze.get_nodes()[0]) == 0
+    assert field.distance(maze.get_nodes()[0]) is None
@@ -0,0 +1,121 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of gamestate.step against the snapshots of a PacmanWorld playing the
+same game.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import pytest
+import gamestate
+import pacman
+import replay
+
+
+LEVELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels')
+
+
+class LoggedStarts(object):
+    # Gives the respawned ghosts the cells they got in the world
+    def __init__(self, log):
+        self._starts = [(x, y) for _, external, kind, x, y in log.spawns
+                        if not external and kind == replay.GHOST]
+        self._i = 0
+
+    def choice(self, seq):
+        start = self._starts[self._i]
+        self._i += 1
+        return start
+
+
+class GreedyPacman(pacman.PacmanAgent):
+    # Follows the food, with some random moves
+    def _think(self, delta):
+        if self.body.target is None:
+            d = self.world.food_field.direction(self.body.cell)
+            valid = self.world.get_valid_actions(self)
+            if random.random() < 0.2 and valid:
+                d = random.choice(valid)
+            if d in valid:
+                return [self._actions[d]]
+
+
+def _key(state):
+    # GameState.__eq__ compares the rules by identity
+    return (state.ticks, state.food, state.food_count, state.player,
+            state.score, state.player_lives, state.game_over,
+            state.player_win, state.next_uid, state.agents)
+
+
+@pytest.mark.parametrize('level,seed', [('pacman.txt', 0), ('pacman.txt', 1),
+                                        ('medium.txt', 2)])
+def test_step_matches_world(level, seed):
+    random.seed(seed)
+    world = pacman.PacmanWorld(20, os.path.join(LEVELS, level),
+                               headless=True)
+    log = replay.start_log(world, seed)
+    world.player_lives = 2
+    world.spawn_player(GreedyPacman)
+    for _ in range(4):
+        world.spawn_ghost(pacman.RandomGhost)
+
+    states = [world.snapshot()]
+    while not world.game_over and world.ticks < 1500:
+        world.step()
+        states.append(world.snapshot())
+
+    actions = {}
+    for tick, uid, action in log.actions:
+        actions.setdefault(tick, {}).setdefault(uid, []).append(
+            replay.ACTIONS[action])
+    rng = LoggedStarts(log)
+    state = states[0]
+    for tick in range(1, len(states)):
+        state = gamestate.step(state, actions.get(tick - 1, {}), rng)
+        assert _key(state) == _key(states[tick]), tick
+
+
+def _ghost_on_player(world):
+    # A state where a scared ghost stands still in the cell of the player
+    state = world.snapshot()
+    player = state.agent(state.player)
+    agents = tuple(a._replace(x=player.x, y=player.y, scared=True,
+                              scared_timer=100) if a.ghost else a
+                   for a in state.agents)
+    return gamestate.GameState(
+        state.rules, state.ticks, state.food, state.food_count, agents,
+        state.player, state.score, state.player_lives, state.game_over,
+        state.player_win, state.next_uid)
+
+
+@pytest.mark.parametrize('scheduled', [False, True])
+def test_eaten_ghost_is_killed_once(scheduled):
+    random.seed(0)
+    world = pacman.PacmanWorld(20, os.path.join(LEVELS, 'pacman.txt'),
+                               headless=True, scheduled=scheduled)
+    world.spawn_player(pacman.PacmanAgent)
+    world.spawn_ghost(pacman.RandomGhost)
+    state = _ghost_on_player(world)
+    world.restore(state)
+    world.step()
+
+    after = world.snapshot()
+    assert after.next_uid == state.next_uid + 1
+    assert [a.ghost for a in after.agents] == [False, True]
+
+    stepped = gamestate.step(state, {}, random.Random(0))
+    assert stepped.next_uid == state.next_uid + 1
+    assert [a.ghost for a in stepped.agents] == [False, True]
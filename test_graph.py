@@ -0,0 +1,82 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of CompactGraph against the dictionary based Graph it replaces.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import pytest
+import graph
+import pacman
+import search
+
+
+LEVEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels',
+                     'pacman.txt')
+
+
+@pytest.fixture(scope='module')
+def world():
+    return pacman.PacmanWorld(20, LEVEL, headless=True)
+
+
+def _connections(g, node):
+    return sorted((tuple(dest), weight, action)
+                  for dest, weight, action in g.get_connections(node))
+
+
+def test_same_nodes_and_connections(world):
+    compact, dict_graph = world.compact_graph, world.graph
+    assert len(compact) == len(dict_graph)
+    assert sorted(compact.get_nodes()) == sorted(dict_graph.get_nodes())
+    for node in dict_graph.get_nodes():
+        assert _connections(compact, node) == _connections(dict_graph, node)
+
+
+def test_from_graph_matches_from_grid(world):
+    grid = world.compact_graph
+    compact = graph.CompactGraph.from_graph(world.graph, grid.width,
+                                            grid.height)
+    for node in world.graph.get_nodes():
+        assert _connections(compact, node) == _connections(grid, node)
+
+
+def test_integer_weights_give_integer_costs(world):
+    compact, dict_graph = world.compact_graph, world.graph
+    for _, weight, _ in compact.get_connections(compact.get_nodes()[0]):
+        assert type(weight) is int
+    cells = sorted(dict_graph.get_nodes())
+    expected = search.uniform_cost(dict_graph, cells[0], cells[1])
+    result = search.uniform_cost(compact, cells[0], cells[1])
+    assert result.cost == expected.cost
+    assert type(result.cost) is type(expected.cost)
+
+
+def test_fractional_weights_are_kept():
+    g = graph.Graph()
+    g.add_node((0, 0), [((1, 0), 0.5, 'right')])
+    g.add_node((1, 0), [((0, 0), 1.5, 'left')])
+    compact = graph.CompactGraph.from_graph(g, 2, 1)
+    assert search.uniform_cost(compact, (0, 0), (1, 0)).cost == 0.5
+    assert search.uniform_cost(compact, (1, 0), (0, 0)).cost == 1.5
+
+
+def test_immutable(world):
+    compact = world.compact_graph
+    with pytest.raises(TypeError):
+        compact.add_node((0, 0), [])
+    with pytest.raises(TypeError):
+        compact.clear()
+    assert len(compact) == len(world.graph)
@@ -0,0 +1,90 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of the compiled level cache.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import errno
+import shutil
+import stat
+import numpy as np
+import pytest
+import levelcache
+import pacman
+
+
+LEVELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels')
+
+
+@pytest.fixture
+def level_file(tmpdir):
+    filename = str(tmpdir.join('pacman.txt'))
+    shutil.copy(os.path.join(LEVELS, 'pacman.txt'), filename)
+    return filename
+
+
+def _assert_same(level, expected):
+    for name in levelcache.CompiledLevel.ARRAYS:
+        a = getattr(level, name)
+        b = getattr(expected, name)
+        assert a.dtype == b.dtype and (a == b).all(), name
+
+
+def test_cached_load_matches_parsing(level_file):
+    expected = levelcache.CompiledLevel.from_grid(
+        levelcache.read_level(level_file))
+    directory = levelcache.cache_dir_for(level_file)
+
+    first = levelcache.load_level(level_file)
+    assert os.path.isdir(directory)
+    _assert_same(first, expected)
+
+    cached = levelcache.load_level(level_file)
+    assert isinstance(cached.walls, np.memmap)
+    _assert_same(cached, expected)
+
+
+def test_cache_modes(level_file):
+    umask = os.umask(0o022)
+    try:
+        level = levelcache.load_level(level_file)
+        world = pacman.PacmanWorld(20, level_file, headless=True)
+        level.distance_table(world.graph)
+    finally:
+        os.umask(umask)
+
+    directory = levelcache.cache_dir_for(level_file)
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o755
+    names = os.listdir(directory)
+    assert len(names) == len(levelcache.CompiledLevel.ARRAYS +
+                             levelcache.CompiledLevel.DISTANCE_ARRAYS)
+    for name in names:
+        mode = os.stat(os.path.join(directory, name)).st_mode
+        assert stat.S_IMODE(mode) == 0o644, name
+
+
+def test_unwritable_directory(level_file, monkeypatch):
+    # read-only directories do not stop root, so the error of creating the
+    # cache in one is simulated
+    def mkdtemp(*args, **kwargs):
+        raise OSError(errno.EACCES, 'Permission denied')
+
+    monkeypatch.setattr(levelcache.tempfile, 'mkdtemp', mkdtemp)
+    level = levelcache.load_level(level_file)
+    assert not os.path.exists(levelcache.cache_dir_for(level_file))
+    assert level._cache_dir is None
+    _assert_same(level, levelcache.CompiledLevel.from_grid(
+        levelcache.read_level(level_file)))
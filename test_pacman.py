@@ -0,0 +1,40 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of PacmanWorld.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import pytest
+import pacman
+
+
+LEVEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels',
+                     'pacman.txt')
+
+
+@pytest.mark.parametrize('max_ticks', [None, 100])
+def test_run_paused(max_ticks):
+    random.seed(0)
+    world = pacman.PacmanWorld(20, LEVEL, headless=True)
+    world.spawn_player(pacman.PacmanAgent)
+    world.spawn_ghost(pacman.RandomGhost)
+    world.paused = True
+    assert world.run(max_ticks) == 0
+    assert world.ticks == 0
+
+    world.paused = False
+    assert world.run(100) == 100
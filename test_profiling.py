@@ -0,0 +1,70 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of the profiling of PacmanWorld games.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import pytest
+import pacman
+
+
+LEVEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels',
+                     'pacman.txt')
+
+
+def _play(scheduled, profiled, ticks=500):
+    random.seed(0)
+    world = pacman.PacmanWorld(20, LEVEL, headless=True, scheduled=scheduled)
+    world.spawn_player(pacman.PacmanAgent)
+    world.player_lives = ticks + 1
+    for _ in range(4):
+        world.spawn_ghost(pacman.RandomGhost)
+    profile = world.start_profile() if profiled else None
+    world.run(ticks)
+    if profiled:
+        world.stop_profile()
+    state = world.snapshot()
+    return world, profile, (state.ticks, state.food, state.agents,
+                            state.next_uid, state.player_lives)
+
+
+@pytest.mark.parametrize('scheduled', [False, True])
+def test_profile_does_not_change_the_game(scheduled):
+    assert _play(scheduled, True)[2] == _play(scheduled, False)[2]
+
+
+@pytest.mark.parametrize('scheduled', [False, True])
+def test_phases(scheduled):
+    world, profile, _ = _play(scheduled, True)
+    calls = dict(((s.owner, s.phase), s.calls) for s in profile.stats())
+    assert calls[('PacmanWorld', 'tick')] == 500
+    for owner in ('PacmanAgent', 'RandomGhost'):
+        assert calls[(owner, 'update')] == calls[(owner, 'think')] == \
+            calls[(owner, 'perceptions')]
+    assert calls[('PacmanAgent', 'eat_ghosts')] == \
+        2 * calls[('PacmanAgent', 'update')]
+    assert calls[('RandomGhost', 'eat_player')] == \
+        calls[('RandomGhost', 'update')]
+
+
+def test_stop_profile_unwraps_agents():
+    world, profile, _ = _play(False, True)
+    for agent in world._agents:
+        assert 'update' not in vars(agent)
+    before = profile.stats()
+    world.run(10)
+    assert profile.stats() == before
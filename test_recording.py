@@ -0,0 +1,126 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of binary recordings, and of training NNPacman from them.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import numpy as np
+import ex04_nn
+import pacman
+import recording
+
+
+LEVEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels',
+                     'pacman.txt')
+
+COLUMNS = [('count', int), ('value', float), ('flag', bool),
+           ('action', str), ('cell', tuple)]
+
+
+def _rows(n):
+    rng = random.Random(0)
+    return [(i, i / 4, i % 3 == 0, rng.choice(['up', 'down', 'stop']),
+             (i % 2, -1)) for i in range(n)]
+
+
+def test_write_and_read(tmpdir):
+    path = str(tmpdir.join('rec'))
+    rows = _rows(23)
+    writer = recording.RecordingWriter(path, COLUMNS, chunk_size=5)
+    for row in rows:
+        writer.append(row)
+    # only whole chunks are written before closing
+    assert len(recording.Recording(path)) == 20
+    writer.close()
+
+    rec = recording.Recording(path)
+    assert len(rec) == 23
+    assert rec.columns == [name for name, _ in COLUMNS]
+    assert [rec.column(name).dtype for name, _ in COLUMNS] == \
+        [np.dtype(t) for t in ('<i4', '<f8', '|i1', '<i4', '<i4')]
+    for i, (name, _) in enumerate(COLUMNS):
+        assert rec.values(name) == [row[i] for row in rows]
+    assert rec.categories('count') is None
+    # categories are numbered in order of appearance
+    actions = [row[3] for row in rows]
+    assert rec.categories('action') == \
+        sorted(set(actions), key=actions.index)
+    assert rec.categories('cell') == [(0, -1), (1, -1)]
+
+    encoding = np.eye(len(rec.categories('action')))
+    data = rec.rows_of(['count', 'flag', 'action'], {'action': encoding},
+                       rows=np.arange(3, 23, 2))
+    assert len(data) == 10
+    expected = [[row[0], row[2]] + encoding[
+        rec.categories('action').index(row[3])].tolist()
+        for row in rows[3::2]]
+    assert data[np.arange(10)].tolist() == expected
+
+
+class RecordedPacman(ex04_nn.NNPacman):
+    # Records each decision both in memory and in a binary recording. Stands
+    # still at first, then follows the food, with some random moves
+    def _record(self):
+        super(RecordedPacman, self)._record()
+        recorder, self._recorder = self._recorder, None
+        super(RecordedPacman, self)._record()
+        self._recorder = recorder
+
+    def _think(self, delta):
+        if self.body.target is None and self.world.ticks >= 10:
+            d = self.world.food_field.direction(self.body.cell)
+            valid = self.world.get_valid_actions(self)
+            if random.random() < 0.3 and valid:
+                d = random.choice(valid)
+            if d in valid:
+                return [self._actions[d]]
+
+
+def _training_data(player, filename):
+    # the data that NNPacman.train passes to the network
+    def train(data, rate, epochs, **kwargs):
+        if isinstance(data, recording.RecordingRows):
+            data = data[np.arange(len(data))]
+        return np.asarray(data, dtype=float)
+
+    player._nn.train = train
+    return player.train(filename)
+
+
+def test_train_from_csv_and_binary(tmpdir):
+    random.seed(0)
+    world = pacman.PacmanWorld(20, LEVEL, headless=True)
+    world.spawn_player(RecordedPacman)
+    for _ in range(4):
+        world.spawn_ghost(pacman.RandomGhost)
+    player = world.player
+    path = str(tmpdir.join('rec'))
+    player.start_recording(path, chunk_size=16)
+    world.run(max_ticks=1500)
+    player.stop_recording()
+    filename = str(tmpdir.join('game.csv'))
+    player.save_recording(filename)
+
+    rec = recording.Recording(path)
+    # the recording has rows that cannot be trained on
+    assert 'stop' in rec.categories('action')
+    assert len(rec) == len(player._history) > 16
+
+    csv = _training_data(player, filename)
+    binary = _training_data(player, path)
+    assert len(csv) == sum(1 for a in rec.values('action') if a != 'stop')
+    assert csv.tolist() == binary.tolist()
@@ -0,0 +1,87 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of the replay of logged games, and of seeking through them.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import pytest
+import pacman
+import replay
+
+
+LEVELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels')
+
+
+class GreedyPacman(pacman.PacmanAgent):
+    # Follows the food, with some random moves
+    def _think(self, delta):
+        if self.body.target is None:
+            d = self.world.food_field.direction(self.body.cell)
+            valid = self.world.get_valid_actions(self)
+            if random.random() < 0.3 and valid:
+                d = random.choice(valid)
+            if d in valid:
+                return [self._actions[d]]
+
+
+def _key(world):
+    # replayed agents have other classes than the logged ones
+    state = world.snapshot()
+    return (state.ticks, state.food, state.score, state.player_lives,
+            state.game_over, state.next_uid,
+            tuple(a[:1] + a[2:] for a in state.agents))
+
+
+@pytest.fixture(scope='module')
+def game(tmpdir_factory):
+    # the player eats ghosts in this game, and a ghost is added midway
+    random.seed(10)
+    world = pacman.PacmanWorld(20, os.path.join(LEVELS, 'pacman.txt'),
+                               headless=True)
+    log = replay.start_log(world, 10)
+    world.player_lives = 3
+    world.spawn_player(GreedyPacman)
+    for _ in range(4):
+        world.spawn_ghost(pacman.RandomGhost)
+    world.run(max_ticks=800)
+    world.spawn_ghost(pacman.RandomGhost)
+    world.run(max_ticks=1200)
+
+    filename = str(tmpdir_factory.mktemp('replay').join('game.npz'))
+    log.save(filename)
+    return world, replay.ReplayLog.load(filename)
+
+
+def test_replay_matches_game(game):
+    world, log = game
+    replayed = replay.Replayer(log).run()
+    assert _key(replayed) == _key(world)
+
+
+@pytest.mark.parametrize('tick', [0, 299, 300, 500, 1999])
+def test_seek(game, tick):
+    _, log = game
+    expected = _key(replay.Replayer(log).run(until=tick))
+
+    replayer = replay.Replayer(log, snapshot_interval=300)
+    assert _key(replayer.seek(tick)) == expected
+    replayer.run()
+    # backwards, from the nearest snapshot
+    assert _key(replayer.seek(tick)) == expected
+    replayer.seek(tick // 2)
+    # forwards
+    assert _key(replayer.seek(tick)) == expected
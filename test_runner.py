@@ -0,0 +1,66 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of the parallel episode runner.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import pacman
+import runner
+
+
+LEVEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels',
+                     'pacman.txt')
+
+GHOSTS = [pacman.RandomGhost] * 4
+
+
+class GreedyPacman(pacman.PacmanAgent):
+    # Follows the food, with some random moves, so that games depend on the
+    # seed
+    def _think(self, delta):
+        if self.body.target is None:
+            d = self.world.food_field.direction(self.body.cell)
+            valid = self.world.get_valid_actions(self)
+            if random.random() < 0.3 and valid:
+                d = random.choice(valid)
+            if d in valid:
+                return [self._actions[d]]
+
+
+def _episode(seed, reuse_world=False):
+    return runner.run_episode(LEVEL, GreedyPacman, GHOSTS, seed,
+                              episode=seed, player_lives=3, max_ticks=2000,
+                              reuse_world=reuse_world)
+
+
+def test_seed_makes_episode_deterministic():
+    first = _episode(5)
+    assert _episode(5) == first
+    assert len(set(_episode(seed) for seed in range(4))) > 1
+
+
+def test_pool_matches_serial():
+    results = sorted(runner.run_episodes(LEVEL, GreedyPacman, GHOSTS, 4,
+                                         seed=7, processes=2, player_lives=3,
+                                         max_ticks=2000))
+    assert results == [_episode(7 + i)._replace(episode=i) for i in range(4)]
+
+
+def test_reused_world_matches_new_world():
+    runner._worlds.clear()
+    _episode(1, reuse_world=True)
+    assert _episode(2, reuse_world=True) == _episode(2)
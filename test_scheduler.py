@@ -0,0 +1,91 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of scheduled headless worlds against worlds that update every agent in
+every tick.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import pytest
+import pacman
+
+
+LEVELS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels')
+
+
+class GreedyPacman(pacman.PacmanAgent):
+    # Follows the food, with some random moves
+    ACTS_AT_CELL_CENTRES = True
+
+    def _think(self, delta):
+        if self.body.target is None:
+            d = self.world.food_field.direction(self.body.cell)
+            valid = self.world.get_valid_actions(self)
+            if random.random() < 0.3 and valid:
+                d = random.choice(valid)
+            if d in valid:
+                return [self._actions[d]]
+
+
+class GreedyPacmanEveryTick(GreedyPacman):
+    ACTS_AT_CELL_CENTRES = False
+
+
+def _key(state):
+    # GameState.__eq__ compares the rules by identity
+    return (state.ticks, state.food, state.food_count, state.player,
+            state.score, state.player_lives, state.game_over,
+            state.player_win, state.next_uid, state.agents)
+
+
+def _play(level, seed, scheduled, player_class, n_ghosts, restore_at=None):
+    random.seed(seed)
+    world = pacman.PacmanWorld(20, os.path.join(LEVELS, level),
+                               headless=True, scheduled=scheduled)
+    world.player_lives = 3
+    world.spawn_player(player_class)
+    for _ in range(n_ghosts):
+        world.spawn_ghost(pacman.RandomGhost)
+
+    states = []
+    while not world.game_over and world.ticks < 2000:
+        states.append(_key(world.snapshot()))
+        if world.ticks == restore_at:
+            # a lookahead that is undone must not change the game
+            rng_state = random.getstate()
+            state = world.snapshot()
+            world.step()
+            world.step()
+            world.restore(state)
+            random.setstate(rng_state)
+        world.step()
+    states.append(_key(world.snapshot()))
+    return states
+
+
+# the player eats ghosts in all but the first and last games
+@pytest.mark.parametrize('level,seed,player_class,n_ghosts', [
+    ('pacman.txt', 0, GreedyPacman, 1),
+    ('pacman.txt', 10, GreedyPacman, 4),
+    ('pacman.txt', 2, GreedyPacmanEveryTick, 12),
+    ('medium.txt', 11, GreedyPacman, 4),
+    ('medium.txt', 3, GreedyPacman, 30),
+])
+def test_scheduled_matches_every_tick(level, seed, player_class, n_ghosts):
+    expected = _play(level, seed, False, player_class, n_ghosts)
+    assert _play(level, seed, True, player_class, n_ghosts) == expected
+    assert _play(level, seed, True, player_class, n_ghosts,
+                 restore_at=100) == expected
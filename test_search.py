@@ -0,0 +1,72 @@
+# coding: utf-8
+# -----------------------------------------------------------------------------
+# Copyright (c) 2015 Tiago Baptista
+# All rights reserved.
+# -----------------------------------------------------------------------------
+
+"""
+Tests of the searches on CompactGraph, against the same searches on the
+dictionary based Graph of the same level.
+
+"""
+
+from __future__ import division
+
+__docformat__ = 'restructuredtext'
+__author__ = 'Tiago Baptista'
+
+import os
+os.environ.setdefault('PACMAN_HEADLESS', '1')
+
+import random
+import pytest
+import pacman
+import search
+
+
+LEVEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels',
+                     'pacman.txt')
+
+ALGORITHMS = [search.breadth_first, search.uniform_cost, search.astar]
+
+
+@pytest.fixture(scope='module')
+def world():
+    return pacman.PacmanWorld(20, LEVEL, headless=True)
+
+
+def _wall(graph):
+    for y in range(graph.height):
+        for x in range(graph.width):
+            if graph.node_id((x, y)) < 0:
+                return x, y
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_wall_start_or_goal_has_no_path(world, algorithm):
+    graph = world.compact_graph
+    wall = _wall(graph)
+    cell = graph.get_nodes()[0]
+    counters = graph.expanded_counter, graph.visited_counter
+    for start, goal in ((wall, cell), (cell, wall)):
+        result = algorithm(graph, start, goal)
+        assert result.path is None
+        assert result.cost is None
+        assert result.expanded == 0
+        assert result.visited == 0
+    assert (graph.expanded_counter, graph.visited_counter) == counters
+
+
+@pytest.mark.parametrize('algorithm', ALGORITHMS)
+def test_compact_matches_graph(world, algorithm):
+    compact, graph = world.compact_graph, world.graph
+    rng = random.Random(0)
+    cells = sorted(graph.get_nodes())
+    for _ in range(50):
+        start, goal = rng.choice(cells), rng.choice(cells)
+        expected = algorithm(graph, start, goal)
+        result = algorithm(compact, start, goal)
+        assert result.cost == expected.cost
+        assert (result.path is None) == (expected.path is None)
+        if result.path is not None:
+            assert len(result.path) == len(expected.path)